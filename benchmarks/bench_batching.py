@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from postgresql_lib import script as pgscript
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.benchmarks.bench_batching")
+logger.setLevel(logging.INFO)
+logging.getLogger("postgres_tools.postgresql_lib.script").setLevel(logging.WARNING)
+
+parser = argparse.ArgumentParser(description="Compare statements/sec of PostgresqlScriptExecutor.run with and "
+                                             "without batching")
+parser.add_argument('--config', dest="config", help='Path to the psql config file: Ex : ../tests_config/psql.json',
+                    required=True)
+parser.add_argument('--statements', dest="statements", type=int, default=3000,
+                    help='Number of statements of the generated script, defaults to 3000')
+parser.add_argument('--batch-size', dest="batch_size", type=int, default=100,
+                    help='Batch size compared to the unbatched run, defaults to 100')
+
+
+def generate_script(statements):
+    """
+    Generate a provisioning-like script: tables, comments, grants and single row inserts.
+
+    :param statements: approximate number of statements
+    :return: the script
+    """
+    lines = ["CREATE SCHEMA bench_batching;"]
+    for i in range(statements // 4):
+        lines.append("CREATE TABLE bench_batching.t{i} (id int PRIMARY KEY, name text);".format(i=i))
+        lines.append("COMMENT ON TABLE bench_batching.t{i} IS 'table {i}';".format(i=i))
+        lines.append("GRANT SELECT ON bench_batching.t{i} TO PUBLIC;".format(i=i))
+        lines.append("INSERT INTO bench_batching.t{i} VALUES ({i}, 'row {i}');".format(i=i))
+    return "\n".join(lines)
+
+
+def measure(con, script, batch_size):
+    """
+    Run the script and drop what it created.
+
+    :return: number of statements executed per second
+    """
+    start = time.perf_counter()
+    res = pgscript.PostgresqlScriptExecutor.run(con, script, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    pgscript.PostgresqlScriptExecutor.run(con, "DROP SCHEMA bench_batching CASCADE;")
+    return len(res) / elapsed
+
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+    with open(args.config) as json_data:
+        config = json.load(json_data)
+
+    script = generate_script(args.statements)
+    con = psycopg2.connect(host=config.get('host'), user=config.get('user'), password=config.get('password'),
+                           port=config.get('port'))
+    try:
+        results = {}
+        for batch_size in (1, args.batch_size):
+            results[batch_size] = measure(con, script, batch_size)
+            logger.info("batch size {b}: {r:.0f} statements/sec".format(b=batch_size, r=results[batch_size]))
+        logger.info("speedup: {s:.1f}x".format(s=results[args.batch_size] / results[1]))
+    finally:
+        con.close()
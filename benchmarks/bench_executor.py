@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import logging
+import argparse
+import resource
+import tempfile
+import platform
+import subprocess
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from postgresql_lib import script as pgscript
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.benchmarks.bench_executor")
+logger.setLevel(logging.INFO)
+logging.getLogger("postgres_tools.postgresql_lib").setLevel(logging.WARNING)
+
+SHAPES = ("ddl", "insert", "function")
+
+# relative change of a metric reported as a regression
+DEFAULT_TOLERANCE = 0.1
+
+parser = argparse.ArgumentParser(description="Benchmark PostgresqlScriptExecutor.run on synthetic scripts, against "
+                                             "a throwaway postgresql cluster, and compare with a baseline")
+parser.add_argument('--shapes', dest="shapes", default=",".join(SHAPES),
+                    help='Comma separated shapes of the generated scripts among {s}, defaults to all'.format(
+                        s=", ".join(SHAPES)))
+parser.add_argument('--statements', dest="statements", type=int, default=5000,
+                    help='Number of statements of each generated script, defaults to 5000')
+parser.add_argument('--repeat', dest="repeat", type=int, default=3,
+                    help='Number of runs of each script, the best run is kept, defaults to 3')
+parser.add_argument('--batch-size', dest="batch_size", type=int, default=1,
+                    help='batch_size passed to PostgresqlScriptExecutor.run, defaults to 1')
+parser.add_argument('--insert-rows', dest="insert_rows", type=int, default=1,
+                    help='insert_rows passed to PostgresqlScriptExecutor.run, defaults to 1')
+parser.add_argument('--transactional', dest="transactional", default=False, action="store_true",
+                    help='Run the scripts in transactional mode')
+parser.add_argument('--pg-bin', dest="pg_bin",
+                    help='Directory of initdb and pg_ctl, defaults to the output of pg_config --bindir or the PATH')
+parser.add_argument('--config', dest="config",
+                    help='Path to a psql config file: Ex : ../tests_config/psql.json. Runs against this server '
+                         'instead of a throwaway cluster')
+parser.add_argument('--output', dest="output",
+                    help='Path of the json file receiving the results, to be used as a later baseline')
+parser.add_argument('--baseline', dest="baseline",
+                    help='Path of the json results of a previous version, the exit code is 1 on regression')
+parser.add_argument('--tolerance', dest="tolerance", type=float, default=DEFAULT_TOLERANCE,
+                    help='Relative change reported as a regression, defaults to {t}'.format(t=DEFAULT_TOLERANCE))
+parser.add_argument('--worker', dest="worker", help=argparse.SUPPRESS)
+
+
+def generate_script(shape, statements, path):
+    """
+    Write a synthetic script.
+
+    ddl: schemas, tables, indexes, comments and grants, as a provisioning script.
+    insert: single row inserts into a few tables, as a data seed.
+    function: plpgsql functions with large dollar quoted bodies full of semicolons.
+
+    :param shape: one of SHAPES
+    :param statements: approximate number of statements
+    :param path: path of the script file
+    """
+    with open(path, "w") as f:
+        f.write("CREATE SCHEMA bench;\n")
+        if shape == "ddl":
+            for i in range(statements // 5):
+                f.write("CREATE TABLE bench.t{i} (id int PRIMARY KEY, name text NOT NULL, created timestamp "
+                        "DEFAULT now());\n".format(i=i))
+                f.write("CREATE INDEX t{i}_name ON bench.t{i} (name);\n".format(i=i))
+                f.write("COMMENT ON TABLE bench.t{i} IS 'table {i}; generated';\n".format(i=i))
+                f.write("GRANT SELECT ON bench.t{i} TO PUBLIC;\n".format(i=i))
+                f.write("ALTER TABLE bench.t{i} ADD COLUMN extra jsonb;\n".format(i=i))
+        elif shape == "insert":
+            tables = 10
+            for i in range(tables):
+                f.write("CREATE TABLE bench.t{i} (id int PRIMARY KEY, name text, payload text);\n".format(i=i))
+            for i in range(statements - tables):
+                f.write("INSERT INTO bench.t{t} (id, name, payload) VALUES ({i}, 'row {i}', '{p}');\n".format(
+                    t=(i // 500) % tables, i=i, p="x;" * 40))
+        elif shape == "function":
+            body = "\n".join("    total := total + {i}; -- step {i};".format(i=i) for i in range(200))
+            for i in range(statements):
+                f.write("CREATE FUNCTION bench.f{i}() RETURNS int AS $body$\nDECLARE\n    total int := 0;\n"
+                        "BEGIN\n{body}\n    RETURN total;\nEND;\n$body$ LANGUAGE plpgsql;\n".format(i=i, body=body))
+        else:
+            raise ValueError("Unknown script shape {shape}".format(shape=shape))
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile.
+
+    :param values: sorted list of numbers
+    :param fraction: between 0 and 1
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_worker(options):
+    """
+    Run one script several times in the current process, so that ru_maxrss is the peak RSS of this script only.
+
+    :param options: dict with path, connect, repeat, batch_size, insert_rows and transactional
+    :return: dict of the measures of the best run
+    """
+    con = psycopg2.connect(**options["connect"])
+    size = os.path.getsize(options["path"])
+    best = None
+    try:
+        for _ in range(options["repeat"]):
+            with open(options["path"], "r") as f:
+                start = time.perf_counter()
+                res = pgscript.PostgresqlScriptExecutor.run(con, f, batch_size=options["batch_size"],
+                                                            insert_rows=options["insert_rows"],
+                                                            transactional=options["transactional"])
+                elapsed = time.perf_counter() - start
+            pgscript.PostgresqlScriptExecutor.run(con, "DROP SCHEMA bench CASCADE;")
+            if best is None or elapsed < best[0]:
+                best = (elapsed, res)
+    finally:
+        con.close()
+
+    elapsed, res = best
+    latencies = sorted(entry["duration"] for entry in res.values())
+    return {
+        "statements": len(res),
+        "bytes": size,
+        "seconds": elapsed,
+        "statements_per_second": len(res) / elapsed,
+        "megabytes_per_second": size / elapsed / 1024 / 1024,
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p90": percentile(latencies, 0.9),
+        "latency_p99": percentile(latencies, 0.99),
+        "latency_max": latencies[-1] if latencies else None,
+        # kilobytes on linux
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+class ThrowawayCluster(object):
+    """Postgresql cluster created by initdb in a temporary directory and removed when stopped."""
+
+    def __init__(self, pg_bin=None):
+        self.pg_bin = pg_bin or find_pg_bin()
+        self.directory = None
+        self.port = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self.directory = tempfile.mkdtemp(prefix="bench_executor_")
+        data = os.path.join(self.directory, "data")
+        self.port = free_port()
+        logger.info("Creating a throwaway cluster in {path} on port {port}".format(path=data, port=self.port))
+        subprocess.check_call([self._bin("initdb"), "-D", data, "-U", "postgres", "-A", "trust", "-N"],
+                              stdout=subprocess.DEVNULL)
+        # durability is not measured: fsync off keeps the disk out of the measures
+        subprocess.check_call([self._bin("pg_ctl"), "-D", data, "-w", "-l", os.path.join(self.directory, "log"),
+                               "-o", "-F -h 127.0.0.1 -k {dir} -p {port}".format(dir=self.directory, port=self.port),
+                               "start"], stdout=subprocess.DEVNULL)
+
+    def stop(self):
+        if self.directory is None:
+            return
+        try:
+            subprocess.call([self._bin("pg_ctl"), "-D", os.path.join(self.directory, "data"), "-m", "immediate",
+                             "stop"], stdout=subprocess.DEVNULL)
+        finally:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def connect_kwargs(self):
+        return {"host": "127.0.0.1", "port": self.port, "user": "postgres"}
+
+    def _bin(self, name):
+        return os.path.join(self.pg_bin, name) if self.pg_bin else name
+
+
+def find_pg_bin():
+    """Directory of the postgresql programs, None to look them up in the PATH."""
+    try:
+        return subprocess.check_output(["pg_config", "--bindir"]).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def free_port():
+    sock = socket.socket()
+    try:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+def version():
+    """Version of the benchmarked code, from git."""
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def server_version(connect_kwargs):
+    con = psycopg2.connect(**connect_kwargs)
+    try:
+        with con.cursor() as cur:
+            cur.execute("SHOW server_version")
+            return cur.fetchone()[0]
+    finally:
+        con.close()
+
+
+def run_shapes(args, connect_kwargs, directory):
+    """
+    Benchmark each shape in its own process.
+
+    :return: dict mapping each shape to its measures
+    """
+    results = {}
+    for shape in args.shapes.split(","):
+        path = os.path.join(directory, "{shape}.sql".format(shape=shape))
+        generate_script(shape, args.statements, path)
+        options = {
+            "path": path,
+            "connect": connect_kwargs,
+            "repeat": args.repeat,
+            "batch_size": args.batch_size,
+            "insert_rows": args.insert_rows,
+            "transactional": args.transactional,
+        }
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--worker", json.dumps(options)])
+        results[shape] = json.loads(output.decode())
+        logger.info("{shape}: {r[statements_per_second]:.0f} statements/sec, p50 {p50:.3f}ms, p99 {p99:.3f}ms, "
+                    "peak RSS {r[peak_rss_kb]} kB".format(shape=shape, r=results[shape],
+                                                          p50=results[shape]["latency_p50"] * 1000,
+                                                          p99=results[shape]["latency_p99"] * 1000))
+    return results
+
+
+# metric -> True if higher is better
+_COMPARED = {
+    "statements_per_second": True,
+    "latency_p50": False,
+    "latency_p99": False,
+    "peak_rss_kb": False,
+}
+
+
+def compare(baseline, results, tolerance):
+    """
+    Compare results with a baseline.
+
+    :param baseline: results of a previous version, as written by --output
+    :param results: results of this version
+    :param tolerance: relative change reported as a regression
+    :return: list of regression descriptions
+    """
+    regressions = []
+    for shape, measures in results["results"].items():
+        previous = baseline["results"].get(shape)
+        if previous is None:
+            continue
+        for metric, higher_is_better in _COMPARED.items():
+            old, new = previous.get(metric), measures.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append("{shape} {metric}: {old:.6g} -> {new:.6g} ({change:+.1%})".format(
+                    shape=shape, metric=metric, old=old, new=new, change=change))
+    return regressions
+
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+    if args.worker:
+        print(json.dumps(run_worker(json.loads(args.worker))))
+        sys.exit(0)
+
+    directory = tempfile.mkdtemp(prefix="bench_scripts_")
+    cluster = None
+    try:
+        if args.config:
+            with open(args.config) as json_data:
+                config = json.load(json_data)
+            connect_kwargs = {"host": config.get('host'), "port": config.get('port'), "user": config.get('user'),
+                              "password": config.get('password')}
+        else:
+            cluster = ThrowawayCluster(args.pg_bin)
+            cluster.start()
+            connect_kwargs = cluster.connect_kwargs()
+
+        results = {
+            "version": version(),
+            "python": platform.python_version(),
+            "psycopg2": psycopg2.__version__,
+            "postgresql": server_version(connect_kwargs),
+            "options": {"statements": args.statements, "repeat": args.repeat, "batch_size": args.batch_size,
+                        "insert_rows": args.insert_rows, "transactional": args.transactional},
+            "results": run_shapes(args, connect_kwargs, directory),
+        }
+    finally:
+        if cluster is not None:
+            cluster.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, sort_keys=True, indent=4, separators=(',', ': '))
+        logger.info("Results written to {path}".format(path=args.output))
+
+    if args.baseline:
+        with open(args.baseline) as json_data:
+            baseline = json.load(json_data)
+        if baseline.get("options") != results["options"]:
+            logger.warning("The baseline was measured with other options: {o}".format(o=baseline.get("options")))
+        regressions = compare(baseline, results, args.tolerance)
+        for regression in regressions:
+            logger.error("Regression {r}".format(r=regression))
+        if regressions:
+            sys.exit(1)
+        logger.info("No regression against {v}".format(v=baseline.get("version")))
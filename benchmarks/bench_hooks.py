@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from postgresql_lib import splitter
+from postgresql_lib import tracing
+from postgresql_lib import transcript as pgtranscript
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.benchmarks.bench_hooks")
+logger.setLevel(logging.INFO)
+logging.getLogger("postgres_tools.postgresql_lib").setLevel(logging.WARNING)
+
+parser = argparse.ArgumentParser(description="Measure the per statement cost of the statement hooks of "
+                                             "PostgresqlScriptExecutor.run, registered or not")
+parser.add_argument('--statements', dest="statements", type=int, default=100000,
+                    help='Number of statements of the generated script, defaults to 100000')
+parser.add_argument('--repeat', dest="repeat", type=int, default=5,
+                    help='Number of runs of each measure, the best run is kept, defaults to 5')
+parser.add_argument('--config', dest="config",
+                    help='Path to a psql config file: Ex : ../tests_config/psql.json. Also runs the executor against '
+                         'this server, with and without hooks')
+
+
+def generate_script(statements):
+    """
+    :param statements: number of statements
+    :return: a script of single row inserts
+    """
+    return "\n".join("INSERT INTO bench_hooks VALUES ({i}, 'row {i}');".format(i=i) for i in range(statements))
+
+
+def best(repeat, function, *args):
+    """
+    :return: shortest duration of repeat calls of function, in seconds
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def bookkeeping(script, statements, hooks):
+    """
+    Record the statements in a transcript as the executor does, without sending them: the hooks are called from
+    Transcript.add and Transcript.complete, so this is the whole cost they add to the hot loop.
+    """
+    res = pgtranscript.Transcript(script, hooks=hooks)
+    for statement in statements:
+        counter = res.add(statement)
+        res.complete(counter, "INSERT 0 1", 0.0001, 1, 40)
+
+
+def disabled_checks(statements, hooks):
+    """The tests made per statement when no hook is registered, alone."""
+    for _ in statements:
+        if hooks is not None:
+            pass
+        if hooks is not None:
+            pass
+
+
+def empty_loop(statements, hooks):
+    for _ in statements:
+        pass
+
+
+def execute(con, script, hooks):
+    """Run the script on postgresql and empty the table."""
+    from postgresql_lib import script as pgscript
+
+    pgscript.PostgresqlScriptExecutor.run(con, script, hooks=hooks)
+    with con.cursor() as cur:
+        cur.execute("TRUNCATE bench_hooks")
+
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+    script = generate_script(args.statements)
+    statements = list(splitter.iter_statements(script))
+    spans = []
+    variants = [("no hooks", None),
+                ("empty hooks", tracing.StatementHooks()),
+                ("span emitter", tracing.SpanEmitter(spans.append))]
+
+    per_statement = {}
+    for name, hooks in variants:
+        per_statement[name] = best(args.repeat, bookkeeping, script, statements, hooks) / len(statements)
+        del spans[:]
+        logger.info("transcript, {name}: {t:.0f} ns/statement".format(name=name, t=per_statement[name] * 1e9))
+    disabled = max(0.0, best(args.repeat, disabled_checks, statements, None) -
+                   best(args.repeat, empty_loop, statements, None)) / len(statements)
+    logger.info("tests of the hooks when none is registered: {t:.1f} ns/statement, {p:.2f}% of the "
+                "bookkeeping".format(t=disabled * 1e9, p=100 * disabled / per_statement["no hooks"]))
+
+    if args.config:
+        import psycopg2
+
+        with open(args.config) as json_data:
+            config = json.load(json_data)
+        con = psycopg2.connect(host=config.get('host'), user=config.get('user'), password=config.get('password'),
+                               port=config.get('port'))
+        try:
+            con.autocommit = True
+            with con.cursor() as cur:
+                cur.execute("CREATE TABLE bench_hooks (id int, name text)")
+            try:
+                for name, hooks in variants:
+                    duration = best(args.repeat, execute, con, script, hooks) / len(statements)
+                    del spans[:]
+                    logger.info("executor, {name}: {r:.0f} statements/sec".format(name=name, r=1 / duration))
+                    if hooks is None:
+                        logger.info("tests of the hooks when none is registered: {p:.4f}% of a statement".format(
+                            p=100 * disabled / duration))
+            finally:
+                with con.cursor() as cur:
+                    cur.execute("DROP TABLE bench_hooks")
+        finally:
+            con.close()
@@ -9,10 +9,14 @@ import json
 def pytest_addoption(parser):
 	parser.addoption("--config-file", action="store", help="Json container configuration file ", dest="config_file")
 	parser.addoption("--psql-config-file", action="store", help="Json psql credentials file ", dest="psql_config_file")
+	parser.addoption("--container", action="store", help="Container tested, among the ones of the config file ", dest="container")
+	parser.addoption("--docker-socket", action="store", help="Socket of the docker daemon ", dest="docker_socket")
 
 
-@pytest.fixture()
-def settings(pytestconfig):
+def container_config(pytestconfig):
+	"""Settings of the container tested and its psql settings differing from the psql config file."""
+	from postgresql_lib import fleet
+
 	try:
 		with open(pytestconfig.getoption('config_file')) as json_data:
 			config = json.load(json_data)
@@ -20,7 +24,12 @@ def settings(pytestconfig):
 	except IOError as e:
 		raise IOError("Config file {path} not found".format(path=pytestconfig.getoption('config_file')))
 
-	return config
+	return fleet.container_settings(config, pytestconfig.getoption('container'))
+
+
+@pytest.fixture()
+def settings(pytestconfig):
+	return container_config(pytestconfig)[0]
 
 @pytest.fixture()
 def psql_settings(pytestconfig):
@@ -31,4 +40,24 @@ def psql_settings(pytestconfig):
 	except IOError as e:
 		raise IOError("Psql config file {path} not found".format(path=pytestconfig.getoption('psql_config_file')))
 
-	return config
\ No newline at end of file
+	# e.g. each container of a fleet publishes postgresql on its own port
+	if pytestconfig.getoption('config_file'):
+		config.update(container_config(pytestconfig)[1])
+
+	return config
+
+@pytest.fixture(scope="session")
+def docker_client(pytestconfig):
+	"""Client of the Docker Engine API, its connection to the docker daemon is shared by all the tests."""
+	from postgresql_lib import docker_api
+
+	with docker_api.DockerClient(pytestconfig.getoption('docker_socket')) as client:
+		yield client
+
+@pytest.fixture(scope="module")
+def health(pytestconfig, docker_client):
+	"""State of the systemd units of the container, collected once with a single command for the tests of a module."""
+	from postgresql_lib import health as pghealth
+
+	config = container_config(pytestconfig)[0]
+	return pghealth.snapshot(config['container_name'], pghealth.units(config), docker_client)
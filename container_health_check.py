@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import sys
+import json
+import logging
+import argparse
+
+from postgresql_lib import fleet
+from postgresql_lib import health
+from postgresql_lib import docker_api
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+
+version = "1.0"
+prog_name = sys.argv[0]
+usage = """{pn} [options]
+
+Check the systemd units of postgresql containers, exits with 1 if a unit is not active
+""".format(
+    pn=prog_name
+)
+parser = argparse.ArgumentParser(prog="{pn} {v}".format(pn=prog_name, v=version), usage=usage)
+
+parser.add_argument(
+    '--config-file',
+    dest="config_file",
+    help='Path of the json container configuration: Ex : tests_config/dev.json',
+    required=False
+)
+
+parser.add_argument(
+    '--container',
+    dest="containers",
+    help='Container to check, can be repeated, defaults to all the containers of the config file',
+    action="append",
+    required=False
+)
+
+parser.add_argument(
+    '--unit',
+    dest="units",
+    help='Unit to check, can be repeated, defaults to the units of the config file or {units}'.format(
+        units=" ".join(health.DEFAULT_UNITS)),
+    action="append",
+    required=False
+)
+
+parser.add_argument(
+    '--docker-socket',
+    dest="docker_socket",
+    help='Socket of the docker daemon, defaults to DOCKER_HOST or {path}'.format(path=docker_api.DEFAULT_SOCKET),
+    required=False
+)
+
+parser.add_argument(
+    '--json',
+    dest="json",
+    default=False,
+    action="store_true",
+    help='Print the snapshots as json'
+)
+
+parser.add_argument(
+    '--debug',
+    dest="debug",
+    default=False,
+    action="store_true",
+    help='Enable debug'
+)
+
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+    logger = logging.getLogger("postgres_tools.container_health_check")
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+        logging.getLogger("postgres_tools.postgresql_lib").setLevel(logging.DEBUG)
+    else:
+        logger.setLevel(logging.INFO)
+        logging.getLogger("postgres_tools.postgresql_lib").setLevel(logging.INFO)
+
+    config = {}
+    if args.config_file:
+        try:
+            with open(args.config_file) as json_data:
+                config = json.load(json_data)
+        except IOError as e:
+            logger.debug(e)
+            raise IOError("Config file {path} not found".format(path=args.config_file))
+
+    containers = args.containers or (fleet.containers(config) if config else [])
+    if not containers:
+        parser.error("no container given, use --container or --config-file")
+
+    snapshots = []
+    healthy = True
+    with docker_api.DockerClient(args.docker_socket) as docker:
+        for container in containers:
+            settings = fleet.container_settings(config, container)[0] if config else {}
+            snapshot = health.snapshot(container, args.units or health.units(settings), docker)
+            snapshots.append(snapshot.as_dict())
+            problems = snapshot.problems()
+            healthy = healthy and not problems
+            for name, properties in snapshot.units.items():
+                logger.debug("{container} {unit}: {properties}".format(container=container, unit=name,
+                                                                       properties=properties))
+            for problem in problems:
+                logger.error("{container}: {problem}".format(container=container, problem=problem))
+            if not problems:
+                logger.info("{container}: {units} active".format(container=container,
+                                                                 units=", ".join(snapshot.units)))
+
+    if args.json:
+        print(json.dumps(snapshots, indent=4, separators=(',', ': ')))
+    sys.exit(0 if healthy else 1)
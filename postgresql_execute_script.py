@@ -14,20 +14,15 @@
 # DEALINGS IN THE SOFTWARE.
 #
 
+# Only the standard library is imported here: psycopg2 and the library modules are imported by main once the
+# arguments are parsed, and only those the chosen mode needs, so --help, a config error or a request sent to a
+# daemon do not pay for them.
+
+import os
 import sys
 import json
 import logging
 import argparse
-import psycopg2
-
-from postgresql_lib import script as pgscript
-
-# logging
-logging.basicConfig(
-    format='%(asctime)s %'
-           '(name)s %(levelname)s %(message)s',
-    datefmt='%m/%d/%Y %I:%M:%S %p'
-)
 
 version="1.0"
 prog_name = sys.argv[0]
@@ -53,6 +48,31 @@ parser.add_argument(
     required=False
 )
 
+parser.add_argument(
+    '--manifest',
+    dest="manifest",
+    help='Path of a json manifest of script/rollback pairs run concurrently, replaces --sql-script: '
+         'Ex : ../manifest.json',
+    required=False
+)
+
+parser.add_argument(
+    '--parameters',
+    dest="parameters",
+    help='Path of the rows of parameters of a template --sql-script, a csv file or a json list of objects: the '
+         'script runs once per row, see postgresql_lib/template.py. Ex : ../tenants.csv',
+    type=str,
+    required=False,
+)
+
+parser.add_argument(
+    '--workers',
+    dest="workers",
+    help='Maximum number of manifest scripts run at the same time, defaults to 4',
+    type=int,
+    required=False
+)
+
 parser.add_argument(
     '--config',
     dest="config",
@@ -93,6 +113,159 @@ parser.add_argument(
     required=False,
 )
 
+parser.add_argument(
+    '--batch-size',
+    dest="batch_size",
+    help='Maximum number of queries sent to postgresql in one round trip, defaults to 1 (no batching)',
+    type=int,
+    required=False,
+)
+
+parser.add_argument(
+    '--insert-rows',
+    dest="insert_rows",
+    help='Maximum number of consecutive single row INSERT of constants into the same table sent as one multi-row '
+         'INSERT, defaults to 1 (no grouping)',
+    type=int,
+    required=False,
+)
+
+parser.add_argument(
+    '--prepared',
+    dest="prepared",
+    help='Number of statement templates kept prepared, repeated DML queries differing only by their literals run '
+         'with EXECUTE; defaults to 0 (no preparation), needs a batch size of 1 and no --transactional',
+    type=int,
+    required=False,
+)
+
+parser.add_argument(
+    '--transactional',
+    dest="transactional",
+    default=False,
+    action="store_true",
+    help='Run each script in a single transaction: a failing script is rolled back without running its rollback '
+         'script, unless it contains queries which cannot run inside a transaction, e.g. CREATE DATABASE'
+)
+
+parser.add_argument(
+    '--lock-timeout',
+    dest="lock_timeout",
+    help='Maximum wait of each query for a lock, in milliseconds or as a postgresql duration, e.g. "2s": a query '
+         'which times out is retried after a jittered exponential backoff instead of blocking the live traffic '
+         'queued behind it',
+    type=str,
+    required=False,
+)
+
+parser.add_argument(
+    '--statement-timeout',
+    dest="statement_timeout",
+    help='Maximum duration of each query, in milliseconds or as a postgresql duration, e.g. "5min"',
+    type=str,
+    required=False,
+)
+
+parser.add_argument(
+    '--lock-retries',
+    dest="lock_retries",
+    help='Maximum number of retries of a query failing on --lock-timeout, defaults to 5',
+    type=int,
+    required=False,
+)
+
+parser.add_argument(
+    '--statement-cache',
+    dest="statement_cache",
+    help='Directory caching the parsed scripts by content hash: a script run again, e.g. on each tenant database, '
+         'is not parsed again. Ex : /var/cache/postgresql_tools',
+    type=str,
+    required=False,
+)
+
+parser.add_argument(
+    '--ledger',
+    dest="ledger",
+    nargs='?',
+    const=True,
+    help='Record the applied scripts and queries in a ledger table and skip them on the next runs, '
+         'the table defaults to postgresql_tools_ledger',
+    required=False
+)
+
+parser.add_argument(
+    '--report',
+    dest="report",
+    help='Path of a JSON Lines file receiving the transcript: duration, estimated server duration, row count and '
+         'size of each query. Ex : ../report.jsonl',
+    type=str,
+    required=False,
+)
+
+parser.add_argument(
+    '--slowest',
+    dest="slowest",
+    help='Number of slowest queries listed at the end of the execution, defaults to 10, 0 to disable',
+    type=int,
+    required=False,
+)
+
+parser.add_argument(
+    '--metrics-port',
+    dest="metrics_port",
+    help='Serve the metrics of the execution (statements, durations, bytes sent, failures by sqlstate, rollbacks, '
+         'connection acquisition time) on http://127.0.0.1:PORT/metrics, e.g. for the daemon started with --serve',
+    type=int,
+    required=False,
+)
+
+parser.add_argument(
+    '--metrics-file',
+    dest="metrics_file",
+    help='Write the metrics of the execution to this file, in the Prometheus text format, e.g. in the directory of '
+         'the textfile collector of the node exporter. Ex : /var/lib/node_exporter/postgresql_tools.prom',
+    type=str,
+    required=False,
+)
+
+parser.add_argument(
+    '--dry-run',
+    dest="dry_run",
+    default=False,
+    action="store_true",
+    help='Do not run the scripts, list the category, lock and risk of each of their statements, e.g. table rewrites '
+         'and index builds blocking the writes. The --report file receives one json object per statement'
+)
+
+parser.add_argument(
+    '--analyze',
+    dest="analyze",
+    default=False,
+    action="store_true",
+    help='Like --dry-run, and also connect to explain the queries and DML statements and read the size of the '
+         'tables locked by the heavier statements'
+)
+
+parser.add_argument(
+    '--serve',
+    dest="serve",
+    nargs='?',
+    const=True,
+    help='Run as a daemon listening on a unix socket, /tmp/postgresql_tools.sock by default, and run the scripts '
+         'sent with --daemon on connections kept open',
+    required=False
+)
+
+parser.add_argument(
+    '--daemon',
+    dest="daemon",
+    nargs='?',
+    const=True,
+    help='Send the scripts to the daemon listening on this unix socket, /tmp/postgresql_tools.sock by default, '
+         'instead of connecting to postgresql',
+    required=False
+)
+
 parser.add_argument(
     '--debug',
     dest="debug",
@@ -102,17 +275,27 @@ parser.add_argument(
 )
 
 
-if __name__ == "__main__":
+def main(argv=None):
+    """
+    Run the command line.
+
+    :param argv: arguments, defaults to the arguments of the process
+    """
+    logging.basicConfig(
+        format='%(asctime)s %'
+               '(name)s %(levelname)s %(message)s',
+        datefmt='%m/%d/%Y %I:%M:%S %p'
+    )
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     debug = args.debug
     logger = logging.getLogger("postgres_tools.postgresql_execute_script")
     if debug:
         logger.setLevel(logging.DEBUG)
-        logging.getLogger("postgres_tools.postgresql_lib.script").setLevel(logging.DEBUG)
+        logging.getLogger("postgres_tools.postgresql_lib").setLevel(logging.DEBUG)
     else:
         logger.setLevel(logging.INFO)
-        logging.getLogger("postgres_tools.postgresql_lib.script").setLevel(logging.INFO)
+        logging.getLogger("postgres_tools.postgresql_lib").setLevel(logging.INFO)
 
     # Take commandline arguments. Those have highest precedence.
     user = args.user
@@ -121,7 +304,27 @@ if __name__ == "__main__":
     port = args.port
     script = args.script
     rollback_script = args.rollback_script
+    batch_size = args.batch_size
+    insert_rows = args.insert_rows
+    prepared = args.prepared
+    transactional = args.transactional
+    lock_timeout = args.lock_timeout
+    statement_timeout = args.statement_timeout
+    lock_retries = args.lock_retries
+    statement_cache_dir = args.statement_cache
+    ledger_table = args.ledger
+    report = args.report
+    slowest = args.slowest
+    metrics_port = args.metrics_port
+    metrics_file = args.metrics_file
+    manifest = args.manifest
+    parameters = args.parameters
+    workers = args.workers
     config_file = args.config
+    dry_run = args.dry_run or args.analyze
+    analyze = args.analyze
+    serve = args.serve
+    daemon_socket = args.daemon
 
     # Check against config parameters, if the variable isn't already defined
     if config_file:
@@ -136,58 +339,331 @@ if __name__ == "__main__":
                 port = port or config.get('port')
                 script = script or config.get('script')
                 rollback_script = rollback_script or config.get('rollback_script')
+                batch_size = batch_size or config.get('batch_size')
+                insert_rows = insert_rows or config.get('insert_rows')
+                prepared = prepared or config.get('prepared')
+                transactional = transactional or config.get('transactional', False)
+                lock_timeout = lock_timeout or config.get('lock_timeout')
+                statement_timeout = statement_timeout or config.get('statement_timeout')
+                lock_retries = lock_retries if lock_retries is not None else config.get('lock_retries')
+                statement_cache_dir = statement_cache_dir or config.get('statement_cache')
+                ledger_table = ledger_table or config.get('ledger')
+                report = report or config.get('report')
+                slowest = slowest if slowest is not None else config.get('slowest')
+                metrics_port = metrics_port or config.get('metrics_port')
+                metrics_file = metrics_file or config.get('metrics_file')
+                manifest = manifest or config.get('manifest')
+                parameters = parameters or config.get('parameters')
+                workers = workers or config.get('workers')
         except IOError as e:
             logger.debug(e)
             raise IOError("Config file {path} not found".format(path=config_file))
 
+    batch_size = batch_size or 1
+    insert_rows = insert_rows or 1
+    prepared = prepared or 0
+
+    if daemon_socket:
+        from postgresql_lib import client
+
+        template = None
+        if manifest:
+            logger.info("loading manifest from {file}".format(file=manifest))
+            with open(manifest) as json_data:
+                manifest_data = json.load(json_data)
+            entries = manifest_data.get('scripts', [])
+            workers = workers or manifest_data.get('workers')
+        elif parameters:
+            from postgresql_lib import template as pgtemplate
+
+            logger.info("loading parameters from {file}".format(file=parameters))
+            # the daemon renders the template for each row
+            template = {"script": script, "rollback_script": rollback_script,
+                        "parameters": pgtemplate.load_parameters(parameters)}
+            entries = [template]
+        else:
+            entries = [{"name": script, "script": script, "rollback_script": rollback_script}]
+        # the daemon has its own working directory
+        for entry in entries:
+            for key in ('script', 'rollback_script'):
+                if entry.get(key):
+                    entry[key] = os.path.abspath(entry[key])
+
+        message = {
+            "scripts": [] if template else entries,
+            "workers": workers,
+            "options": {"batch_size": batch_size, "insert_rows": insert_rows, "prepared": prepared,
+                        "transactional": transactional, "lock_timeout": lock_timeout,
+                        "statement_timeout": statement_timeout, "lock_retries": lock_retries},
+            # true for the default table of the daemon
+            "ledger": ledger_table,
+            "report": os.path.abspath(report) if report else None,
+        }
+        if slowest is not None:
+            message["slowest"] = slowest
+        if template is not None:
+            message["template"] = template
+        res = client.request(message, client.DEFAULT_SOCKET if daemon_socket is True else daemon_socket)
+        if "error" in res and "scripts" not in res:
+            raise Exception("The daemon refused the request: {e}".format(e=res["error"]))
+        for line in res.get("summary", []):
+            logger.info(line)
+        for name in res["scripts"]:
+            logger.info("{name}: {status}".format(name=name, status=res["scripts"][name]["status"]))
+            if "error" in res["scripts"][name]:
+                logger.debug(res["scripts"][name]["error"])
+        sys.exit(2 if res["status"] == "failed" else 0)
+
+    from postgresql_lib import report as pgreport
+    from postgresql_lib import splitter
+
+    slowest = pgreport.DEFAULT_SLOWEST if slowest is None else slowest
+
+    def write_report(records):
+        """Write the report file and log the slowest queries."""
+        if report:
+            with open(report, "w") as f:
+                pgreport.write_report(f, records)
+            logger.info("Transcript written to {path}".format(path=report))
+        if slowest > 0:
+            for line in pgreport.summary(records, slowest):
+                logger.info(line)
+
+    if dry_run:
+        from postgresql_lib import analyzer
+
+    def analyze_scripts(scripts, connections=None):
+        """Analyse the scripts without running them, log a line per statement and write them to the report."""
+        analyses = []
+        report_file = open(report, "w") if report else None
+        try:
+            for name, path, database in scripts:
+                logger.info("analysing sql file {file}".format(file=path))
+                script_buffer = splitter.map_file(path)
+                if connections is None:
+                    res = list(analyzer.analyze_script(script_buffer))
+                else:
+                    with connections.connection(database) as con:
+                        with con.cursor() as cur:
+                            res = list(analyzer.analyze_script(script_buffer, cur))
+                        con.rollback()
+                for analysis in res:
+                    logger.info(analysis.describe())
+                    if report_file is not None:
+                        record = analysis.as_dict()
+                        if name is not None:
+                            record["script"] = name
+                        pgreport.write_report(report_file, [record])
+                analyses.extend(res)
+        finally:
+            if report_file is not None:
+                report_file.close()
+                logger.info("Analysis written to {path}".format(path=report))
+        for line in analyzer.summary(analyses):
+            logger.info(line)
+
+    if dry_run:
+        if manifest:
+            from postgresql_lib import parallel
+
+            logger.info("loading manifest from {file}".format(file=manifest))
+            pairs, manifest_workers = parallel.load_manifest(manifest)
+            scripts = [(pair.name, pair.script, pair.database) for pair in pairs]
+        else:
+            scripts = [(None, script, None)]
+        if not analyze:
+            analyze_scripts(scripts)
+        else:
+            from postgresql_lib import pool
+
+            logger.info("Connecting to postgres with user {name}".format(name=user))
+            with pool.ConnectionPool(maxconn=1, host=host, user=user, password=password, port=port) as connections:
+                analyze_scripts(scripts, connections)
+        sys.exit(0)
+
+    from postgresql_lib import script as pgscript
+    from postgresql_lib import pool
+    from postgresql_lib import parallel
+    from postgresql_lib import locks as pglocks
+    from postgresql_lib import ledger as pgledger
+    from postgresql_lib import cache as pgcache
+
+    lock_retries = pglocks.DEFAULT_RETRIES if lock_retries is None else lock_retries
+    if ledger_table is True:
+        ledger_table = pgledger.DEFAULT_TABLE
+    ledger = pgledger.MigrationLedger(ledger_table) if ledger_table else None
+    statement_cache = pgcache.StatementCache(statement_cache_dir) if statement_cache_dir else None
+
+    metrics = None
+    if metrics_port or metrics_file:
+        from postgresql_lib import metrics as pgmetrics
+
+        metrics = pgmetrics.MetricsRegistry(metrics_file)
+        if metrics_port:
+            metrics.serve(metrics_port)
+
+    if serve:
+        from postgresql_lib import daemon
+        from postgresql_lib import client
+
+        workers = workers or parallel.DEFAULT_WORKERS
+        path = client.DEFAULT_SOCKET if serve is True else serve
+        logger.info("Connecting to postgres with user {name}".format(name=user))
+        with pool.ConnectionPool(minconn=workers, maxconn=workers, host=host, user=user, password=password,
+                                 port=port, metrics=metrics) as connections:
+            server = daemon.ScriptDaemon(connections, path, workers, batch_size=batch_size, insert_rows=insert_rows,
+                                         transactional=transactional, ledger=ledger, prepared=prepared,
+                                         lock_timeout=lock_timeout, statement_timeout=statement_timeout,
+                                         lock_retries=lock_retries,
+                                         statement_cache=statement_cache or pgcache.StatementCache(),
+                                         metrics=metrics)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                logger.info("Interrupted, stopping the daemon")
+        sys.exit(0)
+
+    if manifest or parameters:
+        if manifest:
+            logger.info("loading manifest from {file}".format(file=manifest))
+            pairs, manifest_workers = parallel.load_manifest(manifest)
+        else:
+            from postgresql_lib import template as pgtemplate
+
+            logger.info("loading parameters from {file}".format(file=parameters))
+            pairs, manifest_workers = parallel.template_pairs(script, rollback_script,
+                                                              pgtemplate.load_parameters(parameters)), None
+        workers = workers or manifest_workers or parallel.DEFAULT_WORKERS
+
+        logger.info("Connecting to postgres with user {name}".format(name=user))
+        with pool.ConnectionPool(maxconn=workers, host=host, user=user, password=password, port=port,
+                                 metrics=metrics) as connections:
+            runner = parallel.ParallelScriptRunner(connections, workers, batch_size=batch_size,
+                                                   insert_rows=insert_rows, transactional=transactional,
+                                                   ledger=ledger, prepared=prepared, lock_timeout=lock_timeout,
+                                                   statement_timeout=statement_timeout, lock_retries=lock_retries,
+                                                   statement_cache=statement_cache, metrics=metrics)
+            res = runner.run(pairs)
+        if metrics is not None:
+            metrics.flush()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                json.dumps(
+                    res,
+                    sort_keys=True,
+                    indent=4,
+                    separators=(',', ': '),
+                    default=lambda transcript: transcript.as_dict()
+                )
+            )
+        records = []
+        for name in res:
+            records.extend(pgreport.records(res[name].get("transcript", {}), name))
+            records.extend(pgreport.records(res[name].get("rollback_transcript", {}), pgreport.rollback_name(name)))
+        write_report(records)
+        for name in res:
+            logger.info("{name}: {status}".format(name=name, status=res[name]["status"]))
+        if any(res[name]["status"] == parallel.FAILED for name in res):
+            sys.exit(2)
+        sys.exit(0)
+
     logger.info("loading sql file from {file}".format(file=script))
     logger.info("loading rollback sql file from {file}".format(file=rollback_script))
 
-    commands = ""
-
+    # the script is mapped in memory instead of being read, the rollback script is only read if the script fails
     try:
-        with open(script, "r") as f:
-            commands = f.read()
+        script_buffer = splitter.map_file(script)
 
     except Exception as e:
         logger.debug(e)
         raise Exception("Sql file {path} cannot be read".format(path=script))
 
-    rollback_commands = ""
+    if not rollback_script or not os.path.isfile(rollback_script):
+        raise Exception("Rollback sql file {path} cannot be read".format(path=rollback_script))
 
-    try:
-        with open(rollback_script, "r") as f:
-            rollback_commands = f.read()
+    # the transcript is written to the report while the script runs, it is only kept in memory to be logged
+    report_file = open(report, "w") if report else None
+    summary = pgreport.Summary(slowest)
 
-    except Exception as e:
-        logger.debug(e)
-        raise Exception("Rollback sql file {path} cannot be read".format(path=rollback_script))
+    def report_query(counter, entry):
+        """Sink of the transcript: write the query to the report file and add it to the summary."""
+        record = pgreport.record(counter, entry)
+        if report_file is not None:
+            pgreport.write_report(report_file, [record])
+        summary.add(record)
+
+    def log_summary():
+        """Close the report file and log the slowest queries."""
+        if report_file is not None:
+            report_file.close()
+            logger.info("Transcript written to {path}".format(path=report))
+        if slowest > 0:
+            for line in summary.lines():
+                logger.info(line)
 
     try:
         logger.info("Connecting to postgres with user {name}".format(name=user))
-        with psycopg2.connect(host=host, user=user, password=password, port=port) as con:
+        with pool.ConnectionPool(maxconn=1, host=host, user=user, password=password, port=port,
+                                 metrics=metrics) as connections:
+            with connections.connection() as con:
 
-            try:
-                res = pgscript.PostgresqlScriptExecutor.run(con, commands)
-                logger.debug(
-                    json.dumps(
-                        res,
-                        sort_keys=True,
-                        indent=4,
-                        separators=(',', ': ')
-                    )
-                )
-            except Exception as e:
-                logger.debug(e)
                 try:
-                    res = pgscript.PostgresqlScriptExecutor.run(con, rollback_commands)
-                except Exception as e:
+                    res = pgscript.PostgresqlScriptExecutor.run(con, script_buffer, batch_size=batch_size,
+                                                                insert_rows=insert_rows,
+                                                                transactional=transactional, ledger=ledger,
+                                                                script_name=script, measure_rtt=True,
+                                                                prepared=prepared, sink=report_query,
+                                                                retain=logger.isEnabledFor(logging.DEBUG),
+                                                                lock_timeout=lock_timeout,
+                                                                statement_timeout=statement_timeout,
+                                                                lock_retries=lock_retries,
+                                                                statement_cache=statement_cache,
+                                                                metrics=metrics)
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(
+                            json.dumps(
+                                res.as_dict(),
+                                sort_keys=True,
+                                indent=4,
+                                separators=(',', ': ')
+                            )
+                        )
+                    log_summary()
+                except pgscript.ScriptExecutionError as e:
                     logger.debug(e)
-                    sys.exit(2)
-        if con:
-            con.close()
-            logger.info("Closed connection to postgresql")
+                    log_summary()
+                    if not e.committed:
+                        # nothing was left behind, the rollback script is not needed
+                        logger.info("The script failed and its transaction was rolled back")
+                    else:
+                        if metrics is not None:
+                            metrics.observe_rollback()
+                        try:
+                            res = pgscript.PostgresqlScriptExecutor.run_file(con, rollback_script,
+                                                                             batch_size=batch_size,
+                                                                             insert_rows=insert_rows,
+                                                                             transactional=transactional,
+                                                                             prepared=prepared,
+                                                                             lock_timeout=lock_timeout,
+                                                                             statement_timeout=statement_timeout,
+                                                                             lock_retries=lock_retries,
+                                                                             statement_cache=statement_cache,
+                                                                             metrics=metrics)
+                            if ledger is not None:
+                                # the queries undone by the rollback script must run again next time
+                                ledger.forget(con, script_buffer, script)
+                        except Exception as e:
+                            logger.debug(e)
+                            sys.exit(2)
+        logger.info("Closed connection to postgresql")
 
     except Exception as e:
         logger.debug(e)
-        logger.info("Unexpected failure when connecting and running script. Closing connection.")
\ No newline at end of file
+        logger.info("Unexpected failure when connecting and running script. Closing connection.")
+    finally:
+        if metrics is not None:
+            metrics.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import re
+import json
+import logging
+import collections
+
+import psycopg2
+
+from postgresql_lib import splitter
+from postgresql_lib import classifier
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.analyzer")
+
+# categories of the statements
+DDL = "ddl"
+DML = "dml"
+QUERY = "query"
+PRIVILEGE = "privilege"
+TRANSACTION = "transaction"
+MAINTENANCE = "maintenance"
+OTHER = "other"
+
+# risk levels, ordered
+LOW = "low"
+MEDIUM = "medium"
+HIGH = "high"
+LEVELS = (LOW, MEDIUM, HIGH)
+
+# characters of a statement shown in the report lines
+_DESCRIBE_WIDTH = 60
+
+_NAME = r"""(?:"(?:[^"]|"")*"|[\w$]+)(?:\s*\.\s*(?:"(?:[^"]|"")*"|[\w$]+))*"""
+
+# first words of the statements of each category, the longest prefix wins
+_CATEGORIES = {
+    "CREATE": DDL, "ALTER": DDL, "DROP": DDL, "COMMENT": DDL, "TRUNCATE": DDL, "SECURITY": DDL, "IMPORT": DDL,
+    "INSERT": DML, "UPDATE": DML, "DELETE": DML, "MERGE": DML, "COPY": DML,
+    "SELECT": QUERY, "WITH": QUERY, "VALUES": QUERY, "TABLE": QUERY, "SHOW": QUERY, "EXPLAIN": QUERY,
+    "GRANT": PRIVILEGE, "REVOKE": PRIVILEGE, "REASSIGN": PRIVILEGE, "DROP OWNED": PRIVILEGE,
+    "ALTER DEFAULT": PRIVILEGE,
+    "CREATE ROLE": PRIVILEGE, "ALTER ROLE": PRIVILEGE, "DROP ROLE": PRIVILEGE,
+    "CREATE USER": PRIVILEGE, "ALTER USER": PRIVILEGE, "DROP USER": PRIVILEGE,
+    "CREATE GROUP": PRIVILEGE, "ALTER GROUP": PRIVILEGE, "DROP GROUP": PRIVILEGE,
+    "BEGIN": TRANSACTION, "START": TRANSACTION, "COMMIT": TRANSACTION, "END": TRANSACTION,
+    "ROLLBACK": TRANSACTION, "ABORT": TRANSACTION, "SAVEPOINT": TRANSACTION, "RELEASE": TRANSACTION,
+    "PREPARE TRANSACTION": TRANSACTION,
+    "VACUUM": MAINTENANCE, "ANALYZE": MAINTENANCE, "CLUSTER": MAINTENANCE, "REINDEX": MAINTENANCE,
+    "REFRESH": MAINTENANCE, "CHECKPOINT": MAINTENANCE,
+}
+
+# actions of ALTER TABLE which rewrite or scan the table under its ACCESS EXCLUSIVE lock: (pattern, risk)
+_ALTER_TABLE_RISKS = [(re.compile(pattern, re.IGNORECASE | re.DOTALL), risk) for pattern, risk in [
+    (r"\bALTER\s+(?:COLUMN\s+)?" + _NAME + r"\s+(?:SET\s+DATA\s+)?TYPE\b", "rewrites the table to change a column type"),
+    (r"\bADD\s+(?:COLUMN\s+)?[^,]*\bDEFAULT\s+[^,]*\b(?:random|clock_timestamp|timeofday|gen_random_uuid"
+     r"|uuid_generate_v\d\w*|nextval)\s*\(", "rewrites the table to fill a volatile default"),
+    (r"\bGENERATED\s+ALWAYS\s+AS\s*\(.*\)\s*STORED\b", "rewrites the table to compute a stored column"),
+    (r"\bSET\s+(?:TABLESPACE|LOGGED|UNLOGGED|WITHOUT\s+OIDS)\b", "rewrites the table"),
+    (r"\bSET\s+NOT\s+NULL\b", "scans the table to check NOT NULL"),
+    (r"\bADD\s+(?:CONSTRAINT\s+" + _NAME + r"\s+)?(?:CHECK|FOREIGN\s+KEY)\b(?![^,]*\bNOT\s+VALID\b)",
+     "scans the table to validate the constraint, NOT VALID then VALIDATE CONSTRAINT does not block"),
+    (r"\bADD\s+(?:CONSTRAINT\s+" + _NAME + r"\s+)?(?:PRIMARY\s+KEY|UNIQUE|EXCLUDE)\b(?![^,]*\bUSING\s+INDEX\b)",
+     "builds an index, CREATE INDEX CONCURRENTLY then ADD ... USING INDEX does not block"),
+]]
+
+# actions of ALTER TABLE taking a lighter lock than ACCESS EXCLUSIVE
+_ALTER_TABLE_LIGHT = re.compile(
+    r"^ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?(?:ONLY\s+)?" + _NAME +
+    r"\s+(?:VALIDATE\s+CONSTRAINT|ATTACH\s+PARTITION|DETACH\s+PARTITION\s+" + _NAME + r"\s+CONCURRENTLY"
+    r"|ALTER\s+(?:COLUMN\s+)?" + _NAME + r"\s+SET\s+STATISTICS|SET\s+\(|CLUSTER\s+ON)\b",
+    re.IGNORECASE | re.DOTALL
+)
+
+# (pattern of the leading words, lock taken, risk, level), the first matching pattern applies
+_RULES = [(re.compile(pattern), lock, risk, level) for pattern, lock, risk, level in [
+    (r"^CREATE (?:UNIQUE )?INDEX CONCURRENTLY\b", "SHARE UPDATE EXCLUSIVE",
+     "builds an index without blocking writes, slower and fails on a deadlock leaving an invalid index", MEDIUM),
+    (r"^CREATE (?:UNIQUE )?INDEX\b", "SHARE", "blocks the writes to the table during the index build, "
+                                              "CREATE INDEX CONCURRENTLY does not", HIGH),
+    (r"^DROP INDEX CONCURRENTLY\b", "SHARE UPDATE EXCLUSIVE", None, LOW),
+    (r"^DROP INDEX\b", "ACCESS EXCLUSIVE", "waits for the running queries on the table, DROP INDEX CONCURRENTLY "
+                                           "does not", MEDIUM),
+    (r"^REINDEX\b(?: \w+)* CONCURRENTLY\b", "SHARE UPDATE EXCLUSIVE", "rebuilds indexes without blocking writes",
+     MEDIUM),
+    (r"^REINDEX\b", "ACCESS EXCLUSIVE", "blocks the table while the indexes are rebuilt, REINDEX CONCURRENTLY "
+                                        "does not", HIGH),
+    (r"^VACUUM\b(?: \w+)* FULL\b", "ACCESS EXCLUSIVE", "rewrites the table", HIGH),
+    (r"^VACUUM\b", "SHARE UPDATE EXCLUSIVE", None, LOW),
+    (r"^ANALYZE\b", "SHARE UPDATE EXCLUSIVE", None, LOW),
+    (r"^CLUSTER\b", "ACCESS EXCLUSIVE", "rewrites the table", HIGH),
+    (r"^REFRESH MATERIALIZED VIEW CONCURRENTLY\b", "EXCLUSIVE", "blocks the writes to the view", MEDIUM),
+    (r"^REFRESH MATERIALIZED VIEW\b", "ACCESS EXCLUSIVE", "blocks the reads of the view while it is recomputed",
+     HIGH),
+    (r"^TRUNCATE\b", "ACCESS EXCLUSIVE", "waits for the running queries on the table", MEDIUM),
+    (r"^DROP (?:TABLE|MATERIALIZED VIEW)\b", "ACCESS EXCLUSIVE", "waits for the running queries on the table",
+     MEDIUM),
+    (r"^CREATE (?:OR REPLACE )?(?:CONSTRAINT )?TRIGGER\b", "SHARE ROW EXCLUSIVE", "blocks the writes to the table",
+     MEDIUM),
+    (r"^LOCK\b", "ACCESS EXCLUSIVE", "holds an explicit lock until the end of the transaction", HIGH),
+    (r"^(?:INSERT|UPDATE|DELETE|MERGE|COPY)\b", "ROW EXCLUSIVE", None, LOW),
+    (r"^(?:SELECT|WITH|VALUES|TABLE)\b", "ACCESS SHARE", None, LOW),
+    (r"^DO\b", None, "runs procedural code, its cost cannot be analysed", MEDIUM),
+]]
+
+_LOCK_MODE = re.compile(r"\bIN\s+([A-Z ]+?)\s+MODE\b", re.IGNORECASE)
+_WHERE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+
+# relation touched by a statement, in the first group
+_RELATIONS = [re.compile(pattern, re.IGNORECASE | re.DOTALL) for pattern in [
+    r"^ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?(?:ONLY\s+)?(" + _NAME + ")",
+    r"^CREATE\s+(?:UNIQUE\s+)?INDEX\b.*?\bON\s+(?:ONLY\s+)?(" + _NAME + ")",
+    r"^CREATE\s+(?:OR\s+REPLACE\s+)?(?:CONSTRAINT\s+)?TRIGGER\b.*?\bON\s+(" + _NAME + ")",
+    r"^TRUNCATE\s+(?:TABLE\s+)?(?:ONLY\s+)?(" + _NAME + ")",
+    r"^DROP\s+(?:TABLE|MATERIALIZED\s+VIEW)\s+(?:IF\s+EXISTS\s+)?(" + _NAME + ")",
+    r"^VACUUM\b(?:\s*\([^)]*\)|\s+(?:FULL|FREEZE|VERBOSE|ANALYZE))*\s+(" + _NAME + ")",
+    r"^CLUSTER\s+(?:VERBOSE\s+)?(" + _NAME + ")",
+    r"^REFRESH\s+MATERIALIZED\s+VIEW\s+(?:CONCURRENTLY\s+)?(" + _NAME + ")",
+    r"^REINDEX\s+(?:\([^)]*\)\s*)?(?:TABLE|INDEX)\s+(?:CONCURRENTLY\s+)?(" + _NAME + ")",
+    r"^LOCK\s+(?:TABLE\s+)?(?:ONLY\s+)?(" + _NAME + ")",
+    r"^UPDATE\s+(?:ONLY\s+)?(" + _NAME + ")",
+    r"^DELETE\s+FROM\s+(?:ONLY\s+)?(" + _NAME + ")",
+    r"^INSERT\s+INTO\s+(" + _NAME + ")",
+]]
+
+# statements postgresql can explain without executing them
+_EXPLAINABLE = {"SELECT", "WITH", "VALUES", "TABLE", "INSERT", "UPDATE", "DELETE", "MERGE"}
+
+
+class StatementAnalysis(object):
+    """Category, lock and risks of a statement, and its estimated cost when analysed against a database."""
+
+    __slots__ = ("counter", "command", "category", "transactional", "lock", "risks", "level", "relation",
+                 "relation_size", "relation_rows", "plan_cost", "plan_rows", "error")
+
+    def __init__(self, counter, command, category, transactional, lock, risks, level, relation=None):
+        self.counter = counter
+        self.command = command
+        self.category = category
+        self.transactional = transactional
+        self.lock = lock
+        self.risks = risks
+        self.level = level
+        self.relation = relation
+        self.relation_size = None
+        self.relation_rows = None
+        self.plan_cost = None
+        self.plan_rows = None
+        self.error = None
+
+    def as_dict(self):
+        """
+        :return: ordered dict of the fields which are known, serialisable as json
+        """
+        return collections.OrderedDict((name, getattr(self, name)) for name in self.__slots__
+                                       if getattr(self, name) is not None)
+
+    def describe(self):
+        """
+        :return: one line describing the statement
+        """
+        command = " ".join(self.command.split())
+        if len(command) > _DESCRIBE_WIDTH:
+            command = command[:_DESCRIBE_WIDTH - 3] + "..."
+        details = list(self.risks)
+        if not self.transactional:
+            details.append("cannot run in a transaction")
+        if self.relation_size is not None:
+            details.append("{relation} is {size}".format(relation=self.relation, size=_human_size(self.relation_size)))
+        if self.plan_cost is not None:
+            details.append("plan cost {cost:.0f} for {rows} rows".format(cost=self.plan_cost, rows=self.plan_rows))
+        if self.error is not None:
+            details.append("cannot be explained: {e}".format(e=self.error))
+        return "#{counter} {level:6} {category:11} {lock:22} {command}{details}".format(
+            counter=self.counter,
+            level=self.level,
+            category=self.category,
+            lock=self.lock or "-",
+            command=command,
+            details="".join("\n    " + detail for detail in details)
+        )
+
+
+def category(text):
+    """
+    Category of a statement.
+
+    :param text: statement text
+    :return: DDL, DML, QUERY, PRIVILEGE, TRANSACTION, MAINTENANCE or OTHER
+    """
+    words = classifier.leading_words(text, 3).split(" ")
+    for size in (2, 1):
+        res = _CATEGORIES.get(" ".join(words[:size]))
+        if res is not None:
+            return res
+    return OTHER
+
+
+def analyze_statement(text, counter=0):
+    """
+    Classify a statement and flag the locks it takes, without a database.
+
+    :param text: statement text
+    :param counter: position of the statement in its script
+    :return: StatementAnalysis
+    """
+    words = classifier.leading_words(text)
+    lock = None
+    risks = []
+    level = LOW
+
+    if words.startswith("ALTER TABLE"):
+        lock = "SHARE UPDATE EXCLUSIVE" if _ALTER_TABLE_LIGHT.match(text) else "ACCESS EXCLUSIVE"
+        risks = [risk for pattern, risk in _ALTER_TABLE_RISKS if pattern.search(text)]
+        if risks:
+            level = HIGH
+        elif lock == "ACCESS EXCLUSIVE":
+            risks = ["waits for the running queries on the table and blocks the next ones meanwhile"]
+            level = MEDIUM
+    else:
+        for pattern, rule_lock, risk, rule_level in _RULES:
+            if pattern.match(words):
+                lock, level = rule_lock, rule_level
+                if risk is not None:
+                    risks.append(risk)
+                break
+        if words.startswith("LOCK"):
+            m = _LOCK_MODE.search(text)
+            if m is not None:
+                lock = " ".join(m.group(1).upper().split())
+        if words.split(" ")[0] in ("UPDATE", "DELETE") and not _WHERE.search(text):
+            risks.append("modifies every row of the table")
+            level = MEDIUM
+
+    return StatementAnalysis(counter, text, category(text), classifier.is_transaction_safe(text), lock, risks,
+                             level, relation(text))
+
+
+def relation(text):
+    """
+    Relation locked or modified by a statement.
+
+    :param text: statement text
+    :return: name of the relation as written in the statement, None if unknown
+    """
+    for pattern in _RELATIONS:
+        m = pattern.match(text)
+        if m is not None:
+            return m.group(1)
+    return None
+
+
+def analyze_script(script, cur=None):
+    """
+    Analyse the statements of a script without executing them.
+
+    With a cursor, the queries and DML statements are explained and the size of the relations locked by the heavier
+    statements is read from the catalog. A statement using objects created earlier in the script cannot be
+    explained, its error is recorded instead.
+
+    :param script: the script, either a string, a bytes buffer or a file object opened in text mode
+    :param cur: cursor on the target database, None to analyse the script alone
+    :return: iterator of StatementAnalysis
+    """
+    sizes = {}
+    for counter, statement in enumerate(splitter.iter_statements(script), 1):
+        analysis = analyze_statement(statement.text, counter)
+        if cur is not None:
+            if analysis.level != LOW and analysis.relation is not None:
+                if analysis.relation not in sizes:
+                    sizes[analysis.relation] = _relation_size(cur, analysis.relation)
+                analysis.relation_size, analysis.relation_rows = sizes[analysis.relation]
+            if classifier.leading_words(statement.text, 1) in _EXPLAINABLE and statement.copy_data is None:
+                _explain(cur, analysis)
+        yield analysis
+
+
+def summary(analyses):
+    """
+    Count the statements of each risk level.
+
+    :param analyses: list of StatementAnalysis
+    :return: list of lines
+    """
+    counts = collections.Counter(analysis.level for analysis in analyses)
+    lines = ["{n} statements: {levels}".format(n=len(analyses), levels=", ".join(
+        "{count} {level}".format(count=counts[level], level=level) for level in reversed(LEVELS)))]
+    heavy = [analysis for analysis in analyses if analysis.level == HIGH]
+    if heavy:
+        lines.append("run outside peak load, {n} statements block the tables they use: {counters}".format(
+            n=len(heavy), counters=", ".join("#{c}".format(c=analysis.counter) for analysis in heavy)))
+    return lines
+
+
+def _explain(cur, analysis):
+    """Add the estimated cost and rows of the plan of a statement to its analysis."""
+    try:
+        cur.execute("EXPLAIN (FORMAT JSON) " + analysis.command)
+        plan = cur.fetchone()[0]
+    except psycopg2.Error as e:
+        analysis.error = " ".join("{e}".format(e=e).split())
+        _recover(cur)
+        return
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    node = plan[0]["Plan"]
+    analysis.plan_cost = node["Total Cost"]
+    if node["Node Type"] == "ModifyTable" and node.get("Plans"):
+        # the rows modified are the rows of the scan below, the modification returns none
+        node = node["Plans"][0]
+    analysis.plan_rows = node["Plan Rows"]
+
+
+def _relation_size(cur, name):
+    """
+    Size of a relation, its indexes and toast included, and its estimated number of rows.
+
+    :return: (bytes, rows), (None, None) if the relation does not exist yet
+    """
+    try:
+        cur.execute("SELECT pg_total_relation_size(c.oid), c.reltuples::bigint FROM pg_class c "
+                    "WHERE c.oid = to_regclass(%s)", (name,))
+    except psycopg2.Error as e:
+        logger.debug("Cannot read the size of {name}: {e}".format(name=name, e=e))
+        _recover(cur)
+        return None, None
+    row = cur.fetchone()
+    if row is None:
+        return None, None
+    return row[0], row[1]
+
+
+def _recover(cur):
+    """Roll back the transaction aborted by an error, so the next statements can be analysed."""
+    if not cur.connection.autocommit:
+        cur.connection.rollback()
+
+
+def _human_size(size):
+    for unit in ("bytes", "kB", "MB", "GB"):
+        if size < 1024:
+            return "{size:.0f} {unit}".format(size=size, unit=unit)
+        size /= 1024.0
+    return "{size:.1f} TB".format(size=size)
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import time
+import asyncio
+import logging
+
+import psycopg2
+from psycopg2 import extensions
+
+from postgresql_lib import bulk
+from postgresql_lib import cache as pgcache
+from postgresql_lib import splitter
+from postgresql_lib import parallel
+from postgresql_lib import script as pgscript
+from postgresql_lib import transcript as pgtranscript
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.async_script")
+
+DEFAULT_CONCURRENCY = 50
+
+
+async def wait(con):
+    """
+    Wait, without blocking the event loop, until the pending operation of an asynchronous connection completes.
+
+    :param con: psycopg2 connection opened with async_=True
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        state = con.poll()
+        if state == extensions.POLL_OK:
+            return
+        fd = con.fileno()
+        ready = loop.create_future()
+        if state == extensions.POLL_READ:
+            loop.add_reader(fd, ready.set_result, None)
+            try:
+                await ready
+            finally:
+                loop.remove_reader(fd)
+        elif state == extensions.POLL_WRITE:
+            loop.add_writer(fd, ready.set_result, None)
+            try:
+                await ready
+            finally:
+                loop.remove_writer(fd)
+        else:
+            raise psycopg2.OperationalError("Unexpected poll state {state}".format(state=state))
+
+
+async def connect(**kwargs):
+    """
+    Open an asynchronous connection to postgresql.
+
+    :param kwargs: arguments of psycopg2.connect, e.g. host, port, user, password, dbname
+    :return: the connection, always in autocommit mode
+    """
+    con = psycopg2.connect(async_=True, **kwargs)
+    await wait(con)
+    return con
+
+
+class AsyncPostgresqlScriptExecutor(object):
+    """
+    asyncio counterpart of script.PostgresqlScriptExecutor.
+
+    Statements are split, batched and grouped as by the synchronous executor and the transcript has the same format.
+    Asynchronous connections are always in autocommit mode, like the connections of the synchronous executor.
+    psycopg2 does not support COPY on asynchronous connections, so scripts with COPY ... FROM STDIN data must be run
+    by the synchronous executor.
+    """
+
+    @staticmethod
+    async def run(con, script, chunk_size=splitter.DEFAULT_CHUNK_SIZE, batch_size=1,
+                  batch_bytes=pgscript.DEFAULT_BATCH_BYTES, insert_rows=1, sink=None, retain=True,
+                  statement_cache=None, metrics=None, hooks=None, measure_rtt=False):
+        """
+
+        :param con: asynchronous connection to postgresql, see connect
+        :param script: queries to execute, either a string or a file object opened in text mode
+        :param chunk_size: number of characters read at once when the script is a file object
+        :param batch_size: maximum number of queries sent in one round trip, 1 disables batching
+        :param batch_bytes: maximum size of the queries sent in one round trip
+        :param insert_rows: maximum number of consecutive single row INSERT of constants into the same table sent
+            as one multi-row INSERT, 1 disables the grouping, see bulk.coalesce_inserts
+        :param sink: function called with the counter and the entry of each query once executed
+        :param retain: keep the entries passed to the sink in the transcript returned
+        :param statement_cache: cache.StatementCache of the parsed scripts, e.g. shared by the targets of run_all so
+            the script is parsed once
+        :param metrics: metrics.MetricsRegistry counting the queries and the failure of the script
+        :param hooks: tracing.StatementHooks called before and after each query
+        :param measure_rtt: measure the network round trip before the script, see script.PostgresqlScriptExecutor.run
+        :return: transcript.Transcript of the executed queries
+        """
+        res = pgtranscript.Transcript(script, sink, retain, metrics, hooks)
+        try:
+            cur = con.cursor()
+            try:
+                if measure_rtt:
+                    res.rtt = await _round_trip(cur)
+                if statement_cache is not None:
+                    statements = statement_cache.iter_statements(script, chunk_size)
+                else:
+                    statements = splitter.iter_statements(script, chunk_size)
+                if insert_rows > 1:
+                    statements = bulk.coalesce_inserts(statements, insert_rows)
+                if batch_size > 1:
+                    for batch in pgscript.batches(statements, batch_size, batch_bytes):
+                        await _execute_batch(cur, batch, res)
+                else:
+                    for statement in statements:
+                        await _execute(cur, statement, res)
+            except Exception as e:
+                res.fail(e)
+                raise
+            finally:
+                cur.close()
+                res.close()
+        except Exception as e:
+            # asynchronous connections are in autocommit mode, the queries before the failure are committed
+            if metrics is not None:
+                metrics.observe_failure(e, False)
+            raise pgscript.ScriptExecutionError("Unexpected failure when executing the script: {e}".format(e=e), res,
+                                                True) from e
+
+        return res
+
+    @staticmethod
+    async def run_with_rollback(con, script, rollback_script=None, **options):
+        """
+        Run a script and, if it fails, its rollback script on the same connection.
+
+        :param con: asynchronous connection to postgresql, see connect
+        :param script: queries to execute, either a string or a file object opened in text mode
+        :param rollback_script: queries undoing the script, either a string or a file object opened in text mode
+        :param options: keyword arguments of run, e.g. batch_size
+        :return: {"status": ..., "transcript": ..., "error": ..., "rollback_transcript": ...} as returned by
+            parallel.ParallelScriptRunner.run_pair
+        """
+        res = {"status": parallel.DONE}
+        try:
+            res["transcript"] = await AsyncPostgresqlScriptExecutor.run(con, script, **options)
+            return res
+        except Exception as e:
+            logger.debug(e)
+            res["error"] = "{e}".format(e=e)
+            if isinstance(e, pgscript.ScriptExecutionError):
+                res["transcript"] = e.transcript
+
+        if rollback_script is None:
+            res["status"] = parallel.FAILED
+            return res
+        if options.get("metrics") is not None:
+            options["metrics"].observe_rollback()
+        try:
+            res["rollback_transcript"] = await AsyncPostgresqlScriptExecutor.run(con, rollback_script, **options)
+            res["status"] = parallel.ROLLED_BACK
+        except Exception as e:
+            logger.debug(e)
+            res["status"] = parallel.FAILED
+        return res
+
+    @staticmethod
+    async def run_all(targets, script, rollback_script=None, concurrency=DEFAULT_CONCURRENCY, **options):
+        """
+        Run the same script against many databases or clusters from the current event loop.
+
+        :param targets: list of dicts of psycopg2.connect arguments, one per database
+        :param script: queries to execute, a string as it is read once per target
+        :param rollback_script: queries undoing the script on a target where it fails, a string or None
+        :param concurrency: maximum number of connections open at the same time
+        :param options: keyword arguments of run, e.g. batch_size. Without a statement_cache, the script is parsed
+            once in a cache kept for the call.
+        :return: list of the results of run_with_rollback, in the order of targets
+        """
+        options.setdefault("statement_cache", pgcache.StatementCache())
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_target(target):
+            async with semaphore:
+                try:
+                    con = await connect(**target)
+                except Exception as e:
+                    logger.debug(e)
+                    return {"status": parallel.FAILED, "error": "{e}".format(e=e)}
+                try:
+                    return await AsyncPostgresqlScriptExecutor.run_with_rollback(con, script, rollback_script,
+                                                                                 **options)
+                finally:
+                    con.close()
+
+        return await asyncio.gather(*[run_target(target) for target in targets])
+
+
+async def _execute(cur, statement, res):
+    """
+    Execute a single query and add it to the transcript, see script._execute.
+
+    :param cur: cursor of an asynchronous connection
+    :param statement: splitter.Statement or bulk.InsertGroup to execute
+    :param res: transcript of the executed queries
+    """
+    if isinstance(statement, bulk.InsertGroup):
+        await _execute_insert_group(cur, statement, res)
+        return
+
+    command = statement.text
+    counter = res.add(statement)
+    if statement.copy_data is not None:
+        raise Exception("COPY FROM STDIN is not supported on asynchronous connections")
+    start = time.time()
+    cur.execute(command)
+    await wait(cur.connection)
+    duration = time.time() - start
+    logger.info(command)
+    res.complete(counter, cur.statusmessage, duration, cur.rowcount, pgscript.query_size(command))
+
+
+async def _execute_batch(cur, batch, res):
+    """
+    Execute a batch of queries in one round trip and add them to the transcript, see script._execute_batch.
+
+    :param cur: cursor of an asynchronous connection
+    :param batch: list of (statement, command tag) built by script.batches
+    :param res: transcript of the executed queries
+    """
+    if len(batch) == 1:
+        await _execute(cur, batch[0][0], res)
+        return
+
+    start = time.time()
+    try:
+        cur.execute(pgscript.batch_query(batch))
+        await wait(cur.connection)
+    except psycopg2.Error as e:
+        logger.debug("Batch of {n} queries failed, replaying them one by one: {e}".format(n=len(batch), e=e))
+        for statement, tag in batch:
+            await _execute(cur, statement, res)
+        return
+
+    pgscript.complete_batch(cur, batch, res, time.time() - start)
+
+
+async def _execute_insert_group(cur, group, res):
+    """
+    Execute a group of single row INSERT as one multi-row INSERT, see script._execute_insert_group.
+
+    :param cur: cursor of an asynchronous connection
+    :param group: bulk.InsertGroup to execute
+    :param res: transcript of the executed queries
+    """
+    start = time.time()
+    try:
+        cur.execute(group.text)
+        await wait(cur.connection)
+    except psycopg2.Error as e:
+        logger.debug("INSERT of {n} rows failed, replaying them one by one: {e}".format(n=len(group.rows), e=e))
+        for statement in group.statements:
+            await _execute(cur, statement, res)
+        return
+
+    pgscript.complete_insert_group(cur, group, res, time.time() - start)
+
+
+async def _round_trip(cur):
+    """
+    Measure the network round trip to postgresql, see script._round_trip.
+
+    :param cur: cursor of an asynchronous connection
+    :return: shortest duration of an empty query, in seconds
+    """
+    durations = []
+    for _ in range(pgscript.RTT_PROBES):
+        start = time.time()
+        cur.execute("SELECT 1")
+        await wait(cur.connection)
+        durations.append(time.time() - start)
+    return min(durations)
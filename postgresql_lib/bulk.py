@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import re
+
+_NAME = r"""(?:"(?:[^"]|"")*"|[^\W\d][\w$]*)"""
+
+# INSERT INTO target [(columns)] VALUES, up to the opening parenthesis of the row
+_INSERT_VALUES = re.compile(
+    r"""^INSERT\s+INTO\s+(?P<target>{name}(?:\s*\.\s*{name})*)\s*"""
+    r"""(?P<columns>\((?:[^()"]|"(?:[^"]|"")*")*\))?\s*VALUES\s*(?=\()""".format(name=_NAME),
+    re.IGNORECASE
+)
+
+# tokens of a row of values which may hide a parenthesis
+_ROW_TOKEN = re.compile(
+    r"""(?<![\w$])[eE]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*'|"(?:[^"]|"")*"|\$(?P<tag>(?:[^\W\d]\w*)?)\$.*?\$(?P=tag)\$"""
+    r"""|--[^\n]*|/\*.*?\*/|[()]""",
+    re.DOTALL
+)
+_SPACES = re.compile(r"\s+")
+
+# tokens of the values of a row, anything else, e.g. an operator, makes the row not constant
+_VALUE_TOKEN = re.compile(
+    r"""\s+|--[^\n]*|/\*.*?\*/"""
+    r"""|(?P<string>(?<![\w$])[eE]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*'|\$(?P<tag>(?:[^\W\d]\w*)?)\$.*?\$(?P=tag)\$)"""
+    r"""|(?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)(?![\w$])"""
+    r"""|(?P<word>"(?:[^"]|"")*"|[^\W\d][\w$]*)|(?P<symbol>::|[(),.\[\]])""",
+    re.DOTALL
+)
+
+# values standing alone
+_CONSTANT_WORDS = {"NULL", "DEFAULT", "TRUE", "FALSE"}
+
+
+class InsertGroup(object):
+    """Consecutive single row INSERT statements into the same table and columns, sent as one multi-row INSERT."""
+
+    __slots__ = ("prefix", "statements", "rows")
+
+    def __init__(self, prefix):
+        """
+
+        :param prefix: the INSERT INTO ... VALUES part shared by the statements
+        """
+        self.prefix = prefix
+        self.statements = []
+        self.rows = []
+
+    @property
+    def text(self):
+        return "{prefix} {rows}".format(prefix=self.prefix, rows=",\n".join(self.rows))
+
+
+def split_single_row_insert(text):
+    """
+    Cut a single row INSERT ... VALUES statement into its INSERT INTO ... VALUES prefix and its row.
+
+    Only the rows of constants can be grouped: a subquery or a function call, e.g. (SELECT max(id) FROM t) + 1 or
+    nextval(...), may depend on the rows inserted by the statements before it, which a multi-row INSERT does not see.
+
+    :param text: statement text
+    :return: (prefix, row), or None if the statement is not a plain single row insert of constants, e.g.
+        INSERT ... SELECT, several rows, a value which is not a constant, see is_constant_row, or an ON CONFLICT or
+        RETURNING clause
+    """
+    m = _INSERT_VALUES.match(text)
+    if m is None:
+        return None
+
+    depth = 0
+    for token in _ROW_TOKEN.finditer(text, m.end()):
+        value = token.group()
+        if value == "(":
+            depth += 1
+        elif value == ")":
+            depth -= 1
+            if depth == 0:
+                if text[token.end():].strip() or not is_constant_row(text[m.end():token.end()]):
+                    return None
+                prefix = "INSERT INTO {target}".format(target=_SPACES.sub(" ", m.group("target")))
+                if m.group("columns"):
+                    prefix += " " + _SPACES.sub(" ", m.group("columns"))
+                return prefix + " VALUES", text[m.end():token.end()]
+    return None
+
+
+def is_constant_row(row):
+    """
+    Tell if a row of values only holds constants.
+
+    :param row: the row, with its parentheses
+    :return: True if each value is a number, a string, NULL, DEFAULT, TRUE, FALSE, a typed literal such as
+        DATE '2018-01-01', or one of them cast with ::, e.g. '{1,2}'::int[] or 1.5::numeric(10, 2)
+    """
+    tokens = []
+    pos = 1
+    end = len(row) - 1
+    while pos < end:
+        m = _VALUE_TOKEN.match(row, pos, end)
+        if m is None:
+            return False
+        pos = m.end()
+        if m.lastgroup is not None and m.lastgroup != "tag":
+            tokens.append((m.lastgroup, m.group().upper()))
+        elif m.group("string") is not None:
+            tokens.append(("string", m.group()))
+
+    i = 0
+    n = len(tokens)
+    while i < n:
+        # a value: a constant, or words of a type followed by a string
+        kind, value = tokens[i]
+        if kind == "word" and value in _CONSTANT_WORDS:
+            i += 1
+        elif kind in ("string", "number"):
+            i += 1
+        else:
+            while i < n and tokens[i][0] == "word":
+                i += 1
+            if i == n or tokens[i][0] != "string":
+                return False
+            i += 1
+        # followed by casts
+        while i < n and tokens[i][1] == "::":
+            i = _skip_type(tokens, i + 1)
+            if i is None:
+                return False
+        if i < n:
+            if tokens[i][1] != ",":
+                return False
+            i += 1
+            if i == n:
+                return False
+    return n > 0
+
+
+def _skip_type(tokens, i):
+    """
+    :param tokens: tokens of a row, see is_constant_row
+    :param i: index of the first token of a type name
+    :return: index after the type name, its modifiers and its array brackets, None if it is not a type name
+    """
+    n = len(tokens)
+    if i == n or tokens[i][0] != "word":
+        return None
+    while i < n and (tokens[i][0] == "word" or tokens[i][1] == "."):
+        i += 1
+    if i < n and tokens[i][1] == "(":
+        i += 1
+        while i < n and (tokens[i][0] == "number" or tokens[i][1] == ","):
+            i += 1
+        if i == n or tokens[i][1] != ")":
+            return None
+        i += 1
+    while i + 1 < n and tokens[i][1] == "[" and tokens[i + 1][1] == "]":
+        i += 2
+    return i
+
+
+def coalesce_inserts(statements, rows):
+    """
+    Group runs of single row INSERT statements of constants into the same table and columns.
+
+    The rows are inserted by a single statement: the statement level triggers of the table fire once per group
+    instead of once per row.
+
+    Other statements are passed through unchanged. At most rows statements are held in memory.
+
+    :param statements: iterator of splitter.Statement
+    :param rows: maximum number of rows of a group
+    :return: iterator of splitter.Statement and InsertGroup, groups have at least two statements
+    """
+    group = None
+    for statement in statements:
+        insert = None if statement.copy_data is not None else split_single_row_insert(statement.text)
+        if group is not None and (insert is None or insert[0] != group.prefix or len(group.rows) >= rows):
+            for item in _flush(group):
+                yield item
+            group = None
+
+        if insert is None:
+            yield statement
+            continue
+
+        if group is None:
+            group = InsertGroup(insert[0])
+        group.statements.append(statement)
+        group.rows.append(insert[1])
+
+    if group is not None:
+        for item in _flush(group):
+            yield item
+
+
+def _flush(group):
+    """A group of a single statement is sent as the original statement."""
+    if len(group.statements) == 1:
+        return group.statements
+    return [group]
@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import os
+import sys
+import json
+import array
+import hashlib
+import logging
+import tempfile
+import threading
+import collections
+
+from postgresql_lib import splitter
+from postgresql_lib import classifier
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.cache")
+
+# bytes of parsed scripts kept in memory
+DEFAULT_MEMORY_SIZE = 64 * 1024 * 1024
+# bytes of parsed scripts kept on disk
+DEFAULT_DISK_SIZE = 256 * 1024 * 1024
+
+# version of the cache files, changed with the splitter or the classifier so that older files are parsed again
+_FORMAT = 2
+_MAGIC = b"postgresql_tools statements\n"
+_SUFFIX = ".stmts"
+# no COPY data after a statement
+_NO_DATA = -1
+# no command tag known in advance
+_NO_TAG = -1
+
+
+class CachedStatement(splitter.Statement):
+    """Statement of a string script replayed from a StatementCache, with its classification."""
+
+    __slots__ = ("transaction_safe", "tag")
+
+
+class CachedBufferStatement(splitter.BufferStatement):
+    """Statement of a bytes buffer script replayed from a StatementCache, with its classification."""
+
+    __slots__ = ("transaction_safe", "tag")
+
+
+_CACHED = (CachedStatement, CachedBufferStatement)
+
+
+class ParsedScript(object):
+    """
+    Statement boundaries and classification of a script, a few dozen bytes per statement.
+
+    bounds holds start, end, data start and data end of each statement: the offsets of the statement and of its
+    COPY ... FROM STDIN inline data in the script, in characters for a string and in bytes for a bytes buffer.
+    """
+
+    __slots__ = ("bounds", "safe", "tag_index", "tags")
+
+    def __init__(self):
+        self.bounds = array.array("q")
+        # classifier.is_transaction_safe of each statement
+        self.safe = array.array("b")
+        # index of the command tag of each statement in tags, _NO_TAG if unknown
+        self.tag_index = array.array("l")
+        self.tags = []
+
+    def __len__(self):
+        return len(self.safe)
+
+    @property
+    def nbytes(self):
+        return sum(values.itemsize * len(values) for values in (self.bounds, self.safe, self.tag_index)) + \
+            sum(len(tag) for tag in self.tags)
+
+    def append(self, statement, safe, tag):
+        """
+        Add a statement, once its COPY data, if any, has been read.
+
+        :param statement: splitter.Statement or splitter.BufferStatement
+        :param safe: classifier.is_transaction_safe of the statement
+        :param tag: classifier.command_tag of the statement, None if it is not transaction safe
+        """
+        end = statement.end if isinstance(statement, splitter.BufferStatement) \
+            else statement.offset + len(statement.text)
+        data = statement.copy_data
+        self.bounds.extend((statement.offset, end, data.start if data is not None else _NO_DATA,
+                            data.end if data is not None else _NO_DATA))
+        self.safe.append(safe)
+        if tag is None:
+            self.tag_index.append(_NO_TAG)
+        else:
+            if tag not in self.tags:
+                self.tags.append(tag)
+            self.tag_index.append(self.tags.index(tag))
+
+    def statements(self, source):
+        """
+        Rebuild the statements of a script without scanning it.
+
+        :param source: the script parsed, a string or a bytes buffer
+        :return: iterator of CachedStatement, CachedBufferStatement for a bytes buffer
+        """
+        buffer = splitter.is_buffer(source)
+        bounds = self.bounds
+        for i in range(len(self.safe)):
+            start, end, data_start, data_end = bounds[4 * i:4 * i + 4]
+            data = splitter.CopyRange(source, data_start, data_end) if data_start != _NO_DATA else None
+            if buffer:
+                statement = CachedBufferStatement(source, start, end, data)
+            else:
+                statement = CachedStatement(start, source[start:end], data)
+            statement.transaction_safe = bool(self.safe[i])
+            statement.tag = self.tags[self.tag_index[i]] if self.tag_index[i] != _NO_TAG else None
+            yield statement
+
+    def dumps(self):
+        """
+        :return: the cache file content
+        """
+        header = {"format": _FORMAT, "byteorder": sys.byteorder, "statements": len(self.safe), "tags": self.tags}
+        return b"".join([_MAGIC, json.dumps(header).encode("utf-8"), b"\n", self.bounds.tobytes(),
+                         self.safe.tobytes(), self.tag_index.tobytes()])
+
+    @staticmethod
+    def loads(data):
+        """
+        :param data: content of a cache file, see dumps
+        :return: ParsedScript, None if the file was written by another version or on another architecture
+        """
+        if not data.startswith(_MAGIC):
+            return None
+        end = data.index(b"\n", len(_MAGIC))
+        header = json.loads(data[len(_MAGIC):end].decode("utf-8"))
+        if header.get("format") != _FORMAT or header.get("byteorder") != sys.byteorder:
+            return None
+        res = ParsedScript()
+        count = header["statements"]
+        pos = end + 1
+        for values, n in ((res.bounds, 4 * count), (res.safe, count), (res.tag_index, count)):
+            size = values.itemsize * n
+            values.frombytes(data[pos:pos + size])
+            if len(values) != n:
+                return None
+            pos += size
+        res.tags = header["tags"]
+        return res
+
+
+class StatementCache(object):
+    """
+    Cache of the statement boundaries and classification of scripts, keyed by the hash of their content.
+
+    A script run again, e.g. the same template run against hundreds of databases, is hashed instead of being
+    scanned: its statements are rebuilt from their offsets, and their classification, used to batch them, is not
+    computed again. Parsed scripts are kept in memory, shared by the threads of the process, and in a directory,
+    shared by the processes, each bounded in size: the least recently used are evicted first. Files are written
+    atomically, a file evicted or damaged meanwhile by another process is parsed again.
+
+    Only the scripts in a string or a bytes buffer are cached, the scripts in a file object are split as they are
+    read.
+
+    statement_cache = StatementCache("/var/cache/postgresql_tools")
+    PostgresqlScriptExecutor.run_file(con, path, statement_cache=statement_cache)
+    """
+
+    def __init__(self, directory=None, memory_size=DEFAULT_MEMORY_SIZE, disk_size=DEFAULT_DISK_SIZE):
+        """
+
+        :param directory: directory of the cache files, created if it does not exist, None to only cache in memory
+        :param memory_size: maximum number of bytes of parsed scripts kept in memory
+        :param disk_size: maximum number of bytes of cache files kept in the directory
+        """
+        self.directory = directory
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # key -> ParsedScript, most recently used last
+        self._parsed = collections.OrderedDict()
+        self._size = 0
+        # key -> lock held by the thread parsing the script
+        self._parsing = {}
+        self.hits = 0
+        self.misses = 0
+
+    def iter_statements(self, source, chunk_size=splitter.DEFAULT_CHUNK_SIZE):
+        """
+        Iterate over the statements of a sql script, see splitter.iter_statements.
+
+        :param source: the script, either a string, a bytes buffer encoded in utf-8 or a file object opened in text
+            mode
+        :param chunk_size: number of characters read from the file object at once
+        :return: iterator of statements
+        """
+        if not isinstance(source, str) and not splitter.is_buffer(source):
+            return splitter.iter_statements(source, chunk_size)
+        return self.parse(source).statements(source)
+
+    def parse(self, source):
+        """
+        Parsed script of a source, from the cache or parsed once if several threads ask for it at the same time.
+
+        :param source: the script, a string or a bytes buffer
+        :return: ParsedScript
+        """
+        key = _key(source)
+        with self._lock:
+            parsed = self._get(key)
+            if parsed is not None:
+                self.hits += 1
+                return parsed
+            parsing = self._parsing.setdefault(key, threading.Lock())
+
+        with parsing:
+            with self._lock:
+                parsed = self._get(key)
+            if parsed is None:
+                parsed = self._load(key)
+                if parsed is None:
+                    logger.debug("Parsing script {key}".format(key=key))
+                    parsed = _parse(source)
+                    self._save(key, parsed)
+                with self._lock:
+                    self.misses += 1
+                    self._put(key, parsed)
+            else:
+                with self._lock:
+                    self.hits += 1
+
+        with self._lock:
+            self._parsing.pop(key, None)
+        return parsed
+
+    def clear(self):
+        """Forget the parsed scripts kept in memory, the files are kept."""
+        with self._lock:
+            self._parsed.clear()
+            self._size = 0
+
+    def _get(self, key):
+        parsed = self._parsed.get(key)
+        if parsed is not None:
+            self._parsed.move_to_end(key)
+        return parsed
+
+    def _put(self, key, parsed):
+        if key in self._parsed or parsed.nbytes > self.memory_size:
+            return
+        self._parsed[key] = parsed
+        self._size += parsed.nbytes
+        while self._size > self.memory_size:
+            _, evicted = self._parsed.popitem(last=False)
+            self._size -= evicted.nbytes
+
+    def _load(self, key):
+        """Read a parsed script from its file, None if there is none or it cannot be read."""
+        if self.directory is None:
+            return None
+        path = os.path.join(self.directory, key + _SUFFIX)
+        try:
+            with open(path, "rb") as f:
+                parsed = ParsedScript.loads(f.read())
+            # the file is used: the last to be evicted
+            os.utime(path)
+        except (IOError, OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.debug("Cannot read cache file {path}: {e}".format(path=path, e=e))
+            return None
+        return parsed
+
+    def _save(self, key, parsed):
+        """Write a parsed script to its file, atomically, and evict the files beyond disk_size."""
+        if self.directory is None:
+            return
+        try:
+            fd, temp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(parsed.dumps())
+                os.replace(temp, os.path.join(self.directory, key + _SUFFIX))
+            except BaseException:
+                os.remove(temp)
+                raise
+            self._evict_files()
+        except (IOError, OSError) as e:
+            logger.debug("Cannot write cache file for {key}: {e}".format(key=key, e=e))
+
+    def _evict_files(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(_SUFFIX):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    # evicted by another process
+                    continue
+                files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.disk_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def is_transaction_safe(statement):
+    """
+    classifier.is_transaction_safe of a statement, known in advance for the statements of a StatementCache.
+
+    :param statement: splitter.Statement
+    :return: False for statements such as CREATE DATABASE or VACUUM, True otherwise
+    """
+    if isinstance(statement, _CACHED):
+        return statement.transaction_safe
+    return classifier.is_transaction_safe(statement.text)
+
+
+def command_tag(statement):
+    """
+    classifier.command_tag of a statement, known in advance for the statements of a StatementCache.
+
+    :param statement: splitter.Statement
+    :return: the command tag, None if it depends on the data
+    """
+    if isinstance(statement, _CACHED):
+        return statement.tag
+    return classifier.command_tag(statement.text)
+
+
+def _key(source):
+    """Hash of the content of a script, the offsets of a string and of a buffer are not interchangeable."""
+    if isinstance(source, str):
+        return "s" + hashlib.sha256(source.encode("utf-8")).hexdigest()
+    return "b" + hashlib.sha256(source).hexdigest()
+
+
+def _parse(source):
+    """Scan a script with the splitter and classify its statements."""
+    res = ParsedScript()
+    previous = None
+    for statement in splitter.iter_statements(source):
+        # the COPY data of the previous statement has been skipped, its end is known
+        if previous is not None:
+            res.append(*previous)
+        safe = classifier.is_transaction_safe(statement.text)
+        previous = (statement, safe, classifier.command_tag(statement.text) if safe else None)
+    if previous is not None:
+        res.append(*previous)
+    return res
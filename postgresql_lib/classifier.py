@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import re
+
+_WORD = re.compile(r"[A-Za-z_][\w$]*")
+
+# words, parentheses, quoted identifiers, and the tokens skipped: string literals and comments. An E'' string is
+# tried before the words, its E would be a word.
+_TOKEN = re.compile(
+    r"""(?<![\w$])[eE]'(?:[^'\\]|\\.|'')*'|[A-Za-z_][\w$]*|[()]|"(?:[^"]|"")*"|'(?:[^']|'')*'|--[^\n]*|/\*"""
+)
+_BLOCK_COMMENT = re.compile(r"/\*|\*/")
+
+# statements refused by postgresql inside a transaction block, or controlling the transaction themselves
+_NON_TRANSACTIONAL = re.compile(
+    r"^(?:BEGIN|START|COMMIT|END|ROLLBACK|ABORT|SAVEPOINT|RELEASE|PREPARE TRANSACTION|VACUUM|ALTER SYSTEM"
+    r"|(?:CREATE|DROP) (?:DATABASE|TABLESPACE)|(?:CREATE|ALTER|DROP) SUBSCRIPTION|CLUSTER$|REINDEX (?:SYSTEM|DATABASE)"
+    r"|REINDEX(?: \w+)* CONCURRENTLY|CREATE (?:UNIQUE )?INDEX CONCURRENTLY|DROP INDEX CONCURRENTLY"
+    r"|ALTER DATABASE \w+ SET TABLESPACE|ALTER TYPE \w+ ADD VALUE|DISCARD ALL|SET LOCAL|SET TRANSACTION)\b"
+)
+
+_CREATE_TABLE = re.compile(
+    r"""^CREATE\s+(?:(?:GLOBAL|LOCAL)\s+)?(?:(?:TEMP|TEMPORARY|UNLOGGED)\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?"""
+    r"""(?:"(?:[^"]|"")*"|[\w$]+)(?:\s*\.\s*(?:"(?:[^"]|"")*"|[\w$]+))*\s*(?:\(|PARTITION\s+OF\b|OF\b)""",
+    re.IGNORECASE
+)
+
+# objects whose CREATE, ALTER and DROP command tags do not depend on the data
+_OBJECTS = {
+    "AGGREGATE", "CAST", "COLLATION", "DOMAIN", "EXTENSION", "FUNCTION", "INDEX", "POLICY", "PROCEDURE",
+    "ROLE", "RULE", "SCHEMA", "SEQUENCE", "TABLE", "TRIGGER", "TYPE", "VIEW",
+}
+_ROLE_ALIASES = {"USER": "ROLE", "GROUP": "ROLE"}
+# GRANT and REVOKE of privileges, GRANT ROLE and REVOKE ROLE of a role membership, told apart by tokens
+_GRANTS = {"GRANT": "TO", "REVOKE": "FROM"}
+_FIXED_TAGS = {
+    "COMMENT": "COMMENT",
+    "SET": "SET",
+    "RESET": "RESET",
+    "DO": "DO",
+    "TRUNCATE": "TRUNCATE TABLE",
+    "DROP OWNED": "DROP OWNED",
+    "REASSIGN OWNED": "REASSIGN OWNED",
+    "ALTER DEFAULT PRIVILEGES": "ALTER DEFAULT PRIVILEGES",
+    "ALTER DATABASE": "ALTER DATABASE",
+}
+
+
+def leading_words(text, count=6):
+    """
+    Upper case keywords at the beginning of a statement, skipping the comments and the string literals.
+
+    :param text: statement text
+    :param count: maximum number of words returned
+    :return: the words separated by a single space
+    """
+    words = []
+    for token in _tokens(text):
+        if token[0] == '"':
+            words.extend(m.group().upper() for m in _WORD.finditer(token))
+        elif token not in ("(", ")"):
+            words.append(token)
+        if len(words) >= count:
+            del words[count:]
+            break
+    return " ".join(words)
+
+
+def _tokens(text, pos=0):
+    """
+    Tokens of a statement, without its comments and string literals.
+
+    :param text: statement text
+    :param pos: index where the scan starts
+    :return: iterator of the upper case words, the parentheses and the quoted identifiers as written
+    """
+    while True:
+        m = _TOKEN.search(text, pos)
+        if m is None:
+            return
+        token = m.group()
+        pos = m.end()
+        if token == "/*":
+            pos = _skip_block_comment(text, pos)
+        elif token[0] == '"' or token in ("(", ")"):
+            yield token
+        elif token[0] not in "'-" and token[1:2] != "'":
+            yield token.upper()
+
+
+def _skip_block_comment(text, pos):
+    """
+    :param pos: index just after the opening /* of a comment
+    :return: index just after its closing */, block comments nest
+    """
+    depth = 1
+    for m in _BLOCK_COMMENT.finditer(text, pos):
+        depth += 1 if m.group() == "/*" else -1
+        if depth == 0:
+            return m.end()
+    return len(text)
+
+
+def is_transaction_safe(text):
+    """
+    Tell if a statement may run inside a transaction block, together with other statements.
+
+    :param text: statement text
+    :return: False for statements such as CREATE DATABASE or VACUUM, True otherwise
+    """
+    return _NON_TRANSACTIONAL.match(leading_words(text)) is None
+
+
+def command_tag(text):
+    """
+    Command tag postgresql returns for a statement, when it can be known without executing it.
+
+    Statements whose tag depends on the data, such as INSERT or CREATE TABLE AS, return None.
+
+    :param text: statement text
+    :return: the command tag, e.g. "CREATE ROLE" for CREATE USER, or None
+    """
+    words = leading_words(text).split(" ")
+    verb = words[0]
+
+    if verb in _GRANTS:
+        return _grant_tag(text, verb)
+    for size in (3, 2, 1):
+        tag = _FIXED_TAGS.get(" ".join(words[:size]))
+        if tag is not None:
+            return tag
+
+    if verb not in ("CREATE", "ALTER", "DROP") or len(words) < 2:
+        return None
+
+    i = 1
+    if verb == "CREATE":
+        if words[1:3] == ["OR", "REPLACE"]:
+            i = 3
+        while i < len(words) and words[i] in ("GLOBAL", "LOCAL", "TEMP", "TEMPORARY", "UNLOGGED", "RECURSIVE",
+                                              "UNIQUE", "TRUSTED", "CONSTRAINT"):
+            i += 1
+    if i >= len(words):
+        return None
+
+    kind = _ROLE_ALIASES.get(words[i], words[i])
+    if kind not in _OBJECTS:
+        return None
+    if verb == "CREATE" and kind == "TABLE" and _is_create_table_as(text):
+        # CREATE TABLE AS reports the number of rows
+        return None
+    return "{verb} {kind}".format(verb=verb, kind=kind)
+
+
+def _grant_tag(text, verb):
+    """
+    :param verb: GRANT or REVOKE
+    :return: GRANT or REVOKE when the statement names the objects of the privileges with ON, GRANT ROLE or
+        REVOKE ROLE for a role membership, e.g. GRANT ra TO rb
+    """
+    depth = 0
+    for token in _tokens(text):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0 and token == "ON":
+            return verb
+        elif depth == 0 and token == _GRANTS[verb]:
+            break
+    return "{verb} ROLE".format(verb=verb)
+
+
+def _is_create_table_as(text):
+    """
+    :return: True unless the statement is a CREATE TABLE with a column list, PARTITION OF or OF: CREATE TABLE ... AS,
+        with or without the names of its columns, e.g. CREATE TABLE t (a, b) AS SELECT ...
+    """
+    m = _CREATE_TABLE.match(text)
+    if m is None:
+        return True
+    if not m.group().endswith("("):
+        return False
+    depth = 1
+    for token in _tokens(text, m.end()):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0 and token == "AS":
+            return True
+    return False
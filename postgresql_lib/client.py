@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+# Thin client of daemon.ScriptDaemon: it only needs the standard library, so a process sending a script to the
+# daemon does not load psycopg2 nor the executor.
+
+import json
+import socket
+
+DEFAULT_SOCKET = "/tmp/postgresql_tools.sock"
+
+
+def request(message, path=DEFAULT_SOCKET, timeout=None):
+    """
+    Send a request to a daemon and wait for its answer.
+
+    :param message: json serialisable request, see daemon.ScriptDaemon
+    :param path: path of the unix socket of the daemon
+    :param timeout: seconds to wait for the answer, forever if None
+    :return: the answer of the daemon
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        try:
+            s.connect(path)
+        except (IOError, OSError) as e:
+            raise Exception("No daemon listening on {path}: {e}".format(path=path, e=e))
+        s.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        with s.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise Exception("The daemon on {path} closed the connection without answering".format(path=path))
+    return json.loads(line.decode("utf-8"))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import os
+import json
+import socket
+import logging
+import socketserver
+
+from postgresql_lib import client
+from postgresql_lib import parallel
+from postgresql_lib import ledger as pgledger
+from postgresql_lib import report as pgreport
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.daemon")
+
+# options of PostgresqlScriptExecutor.run a request may set
+_RUN_OPTIONS = ("batch_size", "insert_rows", "prepared", "transactional", "lock_timeout", "statement_timeout",
+                "lock_retries")
+
+# status of a request, from the worst status of its scripts
+_SEVERITY = [parallel.DONE, parallel.ROLLED_BACK, parallel.SKIPPED, parallel.FAILED]
+
+
+class ScriptDaemon(object):
+    """
+    Long running process executing the scripts sent on a unix socket, on connections kept open between requests.
+
+    Each invocation of postgresql_execute_script.py pays for the start of the interpreter, the import of psycopg2 and
+    the connection to postgresql. The daemon pays them once: a client only sends the paths of the scripts.
+
+    A request is a json object on one line, e.g.
+    {"scripts": [{"name": "keycloak", "script": "/sql/keycloak.sql", "rollback_script": "/sql/keycloak_rollback.sql",
+                  "depends_on": [], "database": null, "parameters": null}],
+     "workers": 4, "options": {"batch_size": 100, "transactional": true}, "ledger": "postgresql_tools_ledger",
+     "report": "/tmp/report.jsonl", "slowest": 10}
+    where only scripts (or template, see below) is required, and is answered by a json object on one line, e.g.
+    {"status": "done", "scripts": {"keycloak": {"status": "done", "queries": 12}}, "summary": [...]}
+    or {"status": "failed", "error": ...} if the request is invalid. Instead of scripts, a request may send a template
+    and its rows of parameters, run once per row (see parallel.template_pairs):
+    {"template": {"script": "/sql/tenant.sql", "rollback_script": "/sql/tenant_rollback.sql",
+                  "parameters": [{"name": "tenant1", "tenant": "tenant1"}, {"name": "tenant2", "tenant": "tenant2"}]}}
+    The scripts run as a manifest, see parallel.ParallelScriptRunner. The paths are opened by the daemon: they must be
+    absolute, or relative to its working directory. The ledger is the name of a ledger table, or true for
+    ledger.DEFAULT_TABLE.
+
+    with pool.ConnectionPool(minconn=4, maxconn=4, host="127.0.0.1", user="postgres", password="1234") as connections:
+        ScriptDaemon(connections, "/tmp/postgresql_tools.sock").serve_forever()
+    """
+
+    def __init__(self, pool, path=client.DEFAULT_SOCKET, workers=parallel.DEFAULT_WORKERS, **run_options):
+        """
+
+        :param pool: pool.ConnectionPool shared by the requests, its connections stay open between them
+        :param path: path of the unix socket, only the user running the daemon may connect to it
+        :param workers: maximum number of scripts of a request running at the same time, unless the request sets it
+        :param run_options: keyword arguments passed to PostgresqlScriptExecutor.run, overridden by the options of
+            the requests. The textfile of the metrics, if any, is written after each request.
+        """
+        self.pool = pool
+        self.path = path
+        self.workers = workers
+        self.run_options = run_options
+        self._server = None
+
+    def serve_forever(self):
+        """Listen on the socket and handle the requests until shutdown is called."""
+        _remove_stale_socket(self.path)
+        umask = os.umask(0o177)
+        try:
+            self._server = _Server(self.path, _RequestHandler)
+        finally:
+            os.umask(umask)
+        self._server.script_daemon = self
+        logger.info("Listening on {path}".format(path=self.path))
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            os.remove(self.path)
+            logger.info("Stopped listening on {path}".format(path=self.path))
+
+    def shutdown(self):
+        """Stop serve_forever, from another thread, once the requests in progress are answered."""
+        if self._server is not None:
+            self._server.shutdown()
+
+    def handle(self, message):
+        """
+        Run the scripts of a request.
+
+        :param message: request, see ScriptDaemon
+        :return: answer, see ScriptDaemon
+        """
+        try:
+            pairs = [parallel.ScriptPair(entry['name'], entry['script'], entry.get('rollback_script'),
+                                         entry.get('depends_on'), entry.get('database'), entry.get('parameters'))
+                     for entry in message.get('scripts', [])]
+            if message.get('template'):
+                template = message['template']
+                pairs.extend(parallel.template_pairs(template['script'], template.get('rollback_script'),
+                                                     template['parameters']))
+            options = dict(self.run_options)
+            options.update((name, value) for name, value in message.get('options', {}).items()
+                           if name in _RUN_OPTIONS and value is not None)
+            if message.get('ledger'):
+                table = pgledger.DEFAULT_TABLE if message['ledger'] is True else message['ledger']
+                options['ledger'] = pgledger.MigrationLedger(table)
+            runner = parallel.ParallelScriptRunner(self.pool, message.get('workers') or self.workers, **options)
+            res = runner.run(pairs)
+        except Exception as e:
+            logger.debug(e)
+            return {"status": parallel.FAILED, "error": "{e}".format(e=e)}
+        finally:
+            if self.run_options.get("metrics") is not None:
+                self.run_options["metrics"].flush()
+
+        answer = {"status": parallel.DONE, "scripts": {}}
+        records = []
+        for name in res:
+            transcript = res[name].pop("transcript", {})
+            res[name]["queries"] = len(transcript)
+            answer["scripts"][name] = res[name]
+            if _SEVERITY.index(res[name]["status"]) > _SEVERITY.index(answer["status"]):
+                answer["status"] = res[name]["status"]
+            records.extend(pgreport.records(transcript, name))
+            records.extend(pgreport.records(res[name].pop("rollback_transcript", {}), pgreport.rollback_name(name)))
+
+        if message.get('report'):
+            with open(message['report'], "w") as f:
+                pgreport.write_report(f, records)
+        slowest = message.get('slowest', pgreport.DEFAULT_SLOWEST)
+        if slowest > 0:
+            answer["summary"] = pgreport.summary(records, slowest)
+        return answer
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # each client is served by its own thread, a slow script does not delay the others
+    daemon_threads = True
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Answer the requests of a client, one json object per line, until it closes the connection."""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                message = json.loads(line.decode("utf-8"))
+            except ValueError as e:
+                answer = {"status": parallel.FAILED, "error": "Invalid request: {e}".format(e=e)}
+            else:
+                answer = self.server.script_daemon.handle(message)
+            self.wfile.write(json.dumps(answer).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+def _remove_stale_socket(path):
+    """Remove the socket left by a daemon which did not stop cleanly, refuse to replace a running one."""
+    if not os.path.exists(path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(path)
+        except (IOError, OSError):
+            os.remove(path)
+            return
+    raise Exception("A daemon is already listening on {path}".format(path=path))
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import os
+import json
+import socket
+import struct
+import logging
+import threading
+import collections
+import http.client
+import urllib.parse
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.docker_api")
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+# seconds to wait for an answer of the docker daemon
+DEFAULT_TIMEOUT = 60
+
+# stream types of the multiplexed output of an exec
+_STDOUT = 1
+_STDERR = 2
+
+ExecResult = collections.namedtuple("ExecResult", ["exit_code", "stdout", "stderr"])
+
+
+def default_socket():
+    """
+    Path of the socket of the docker daemon, as the docker CLI finds it.
+
+    :return: the path of DOCKER_HOST if it is a unix:// URL, otherwise DEFAULT_SOCKET
+    """
+    host = os.environ.get("DOCKER_HOST", "")
+    if host.startswith("unix://"):
+        return host[len("unix://"):]
+    return DEFAULT_SOCKET
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a unix socket."""
+
+    def __init__(self, path, timeout=DEFAULT_TIMEOUT):
+        """
+
+        :param path: path of the unix socket
+        :param timeout: seconds to wait for the connection and for each answer
+        """
+        super(UnixHTTPConnection, self).__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class DockerClient(object):
+    """
+    Client of the Docker Engine API over the local unix socket.
+
+    Each docker CLI call starts a process and a connection to the daemon. The client keeps one keep-alive connection
+    for the API calls instead, and runs the commands in the containers with exec sessions created on it: probing a
+    container does not start any process on the host.
+
+    Only the output of an exec is read on a connection of its own, since the daemon closes the connection once the
+    command is done. The client is thread safe.
+
+    with DockerClient() as docker:
+        docker.execute("postgresql", ["systemctl", "status", "postgresql"]).exit_code
+    """
+
+    def __init__(self, path=None, timeout=DEFAULT_TIMEOUT):
+        """
+
+        :param path: path of the socket of the docker daemon, see default_socket if None
+        :param timeout: seconds to wait for an answer of the docker daemon
+        """
+        self.path = path or default_socket()
+        self.timeout = timeout
+        self._connection = UnixHTTPConnection(self.path, timeout)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Close the connection to the docker daemon."""
+        with self._lock:
+            self._connection.close()
+
+    def inspect(self, container):
+        """
+        Low-level information on a container, as docker inspect.
+
+        :param container: name or id of the container
+        :return: dict, e.g. inspect(container)["State"]["Status"]
+        """
+        return self._call("GET", "/containers/{c}/json".format(c=_quote(container)))
+
+    def stop(self, container, timeout=None):
+        """
+        Stop a container, as docker stop.
+
+        :param container: name or id of the container
+        :param timeout: seconds to wait before killing the container, the default of the container if None; it must
+            be shorter than the timeout of the client
+        """
+        self._call("POST", _with_timeout("/containers/{c}/stop".format(c=_quote(container)), timeout),
+                   allowed=(304,))
+
+    def restart(self, container, timeout=None):
+        """
+        Restart a container, as docker restart.
+
+        :param container: name or id of the container
+        :param timeout: seconds to wait before killing the container, the default of the container if None
+        """
+        self._call("POST", _with_timeout("/containers/{c}/restart".format(c=_quote(container)), timeout))
+
+    def execute(self, container, command, timeout=None):
+        """
+        Run a command in a container, as docker exec.
+
+        :param container: name or id of the container
+        :param command: list of the program and its arguments
+        :param timeout: seconds to wait for the command, the timeout of the client if None
+        :return: ExecResult(exit_code, stdout, stderr), the outputs as bytes
+        """
+        exec_id = self._create_exec(container, command)
+        connection = UnixHTTPConnection(self.path, timeout or self.timeout)
+        try:
+            status, body = _request(connection, "POST", "/exec/{id}/start".format(id=exec_id),
+                                    {"Detach": False, "Tty": False})
+        finally:
+            connection.close()
+        _check(status, body, "/exec/{id}/start".format(id=exec_id))
+        stdout, stderr = demultiplex(body)
+
+        exit_code = self._call("GET", "/exec/{id}/json".format(id=exec_id))["ExitCode"]
+        return ExecResult(exit_code, stdout, stderr)
+
+    def stream(self, container, command, timeout=None):
+        """
+        Run a command in a container and read its output while it is written, e.g. to follow a log.
+
+        The command goes on running in the container if the iteration stops before its end.
+
+        :param container: name or id of the container
+        :param command: list of the program and its arguments
+        :param timeout: seconds to wait for the next output, the timeout of the client if None
+        :return: iterator of (stream, bytes), stream being 1 for stdout and 2 for stderr
+        """
+        exec_id = self._create_exec(container, command)
+        path = "/exec/{id}/start".format(id=exec_id)
+        connection = UnixHTTPConnection(self.path, timeout or self.timeout)
+        try:
+            connection.request("POST", path, json.dumps({"Detach": False, "Tty": False}).encode("utf-8"),
+                               {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            if not 200 <= response.status < 300:
+                _check(response.status, response.read(), path)
+            while True:
+                header = response.read(8)
+                if len(header) < 8:
+                    break
+                kind, size = struct.unpack(">BxxxL", header)
+                yield kind, response.read(size)
+        finally:
+            connection.close()
+
+    def _create_exec(self, container, command):
+        exec_id = self._call("POST", "/containers/{c}/exec".format(c=_quote(container)), {
+            "AttachStdin": False,
+            "AttachStdout": True,
+            "AttachStderr": True,
+            "Tty": False,
+            "Cmd": list(command)
+        })["Id"]
+        logger.debug("exec {id} in {container}: {command}".format(id=exec_id, container=container,
+                                                                   command=" ".join(command)))
+        return exec_id
+
+    def _call(self, method, path, payload=None, allowed=()):
+        """
+        Call the API on the keep-alive connection.
+
+        :param allowed: statuses accepted on top of the 2xx ones
+        :return: the decoded json answer, None if the answer is empty
+        """
+        with self._lock:
+            try:
+                status, body = _request(self._connection, method, path, payload)
+            except (ConnectionError, http.client.BadStatusLine):
+                # e.g. the daemon closed the idle connection: reconnect once
+                self._connection.close()
+                status, body = _request(self._connection, method, path, payload)
+        if status not in allowed:
+            _check(status, body, path)
+        return json.loads(body.decode("utf-8")) if body else None
+
+
+def demultiplex(stream):
+    """
+    Split the output of an exec without tty into stdout and stderr.
+
+    The output is made of frames: a header with the stream type and the size of the payload, then the payload.
+
+    :param stream: bytes returned by the docker daemon
+    :return: (stdout, stderr) as bytes
+    """
+    outputs = {_STDOUT: [], _STDERR: []}
+    offset = 0
+    while offset + 8 <= len(stream):
+        kind, size = struct.unpack(">BxxxL", stream[offset:offset + 8])
+        offset += 8
+        outputs.get(kind, outputs[_STDOUT]).append(stream[offset:offset + size])
+        offset += size
+    return b"".join(outputs[_STDOUT]), b"".join(outputs[_STDERR])
+
+
+def _request(connection, method, path, payload):
+    body = json.dumps(payload).encode("utf-8") if payload is not None else None
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+    connection.request(method, path, body, headers)
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+def _check(status, body, path):
+    if not 200 <= status < 300:
+        try:
+            message = json.loads(body.decode("utf-8"))["message"]
+        except (ValueError, KeyError, TypeError):
+            message = body.decode("utf-8", "replace")
+        raise Exception("Docker API call {path} failed with status {status}: {message}".format(
+            path=path, status=status, message=message))
+
+
+def _quote(name):
+    return urllib.parse.quote(name, safe="")
+
+
+def _with_timeout(path, timeout):
+    return path if timeout is None else "{path}?t={t}".format(path=path, t=int(timeout))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import os
+import sys
+import time
+import logging
+import subprocess
+import collections
+
+from concurrent import futures
+from xml.etree import ElementTree
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.fleet")
+
+DEFAULT_TESTS = ["tests/test_postgres_container.py"]
+
+# totals of a junit report
+_COUNTERS = ("tests", "failures", "errors", "skipped")
+
+
+def containers(config):
+    """
+    Names of the containers described by a container configuration.
+
+    The configuration either names one container:
+    {"container_name": "postgresql", "service_name": "postgresql", ...}
+    or lists several of them, each one given by its name or by the settings differing from the shared ones, the
+    settings of psql_settings being under "psql":
+    {"containers": ["postgresql-1", {"container_name": "postgresql-2", "psql": {"port": 5433}}],
+     "service_name": "postgresql", ...}
+
+    :param config: dict loaded from the configuration file
+    :return: list of container names
+    """
+    if "containers" not in config:
+        return [config["container_name"]]
+    return [entry if isinstance(entry, str) else entry["container_name"] for entry in config["containers"]]
+
+
+def container_settings(config, container=None):
+    """
+    Settings of one container of a container configuration, see containers.
+
+    :param config: dict loaded from the configuration file
+    :param container: name of the container, the first one if None; it replaces the container of a configuration
+        naming one container
+    :return: (settings, overridden psql settings) of the container
+    """
+    names = containers(config)
+    container = container or names[0]
+    if container not in names and "containers" in config:
+        raise Exception("Container {name} is not in the configuration".format(name=container))
+
+    settings = dict((key, value) for key, value in config.items() if key != "containers")
+    settings["container_name"] = container
+    psql = {}
+    for entry in config.get("containers", []):
+        if isinstance(entry, dict) and entry["container_name"] == container:
+            psql = entry.get("psql", {})
+            settings.update((key, value) for key, value in entry.items() if key != "psql")
+    return settings, psql
+
+
+class ContainerTestRunner(object):
+    """
+    Run the container tests against several containers concurrently.
+
+    Each container is tested by a pytest process of its own selecting it with --container: the tests stopping,
+    killing or restarting a service only touch their container, and the whole run lasts about as long as the
+    slowest container. The junit reports of the processes are merged into one report.
+    """
+
+    def __init__(self, config_file, psql_config_file, tests=None, jobs=None, directory=".", pytest_args=()):
+        """
+
+        :param config_file: path of the container configuration, see containers
+        :param psql_config_file: path of the psql credentials
+        :param tests: paths of the test files, DEFAULT_TESTS if None
+        :param jobs: maximum number of containers tested at the same time, all of them if None
+        :param directory: directory receiving the junit report and the output of each container
+        :param pytest_args: additional arguments of pytest
+        """
+        self.config_file = config_file
+        self.psql_config_file = psql_config_file
+        self.tests = list(tests or DEFAULT_TESTS)
+        self.jobs = jobs
+        self.directory = directory
+        self.pytest_args = list(pytest_args)
+
+    def run(self, names):
+        """
+        Test the containers.
+
+        :param names: names of the containers
+        :return: ordered dict {container: {"exit_code": ..., "duration": ..., "report": ..., "log": ...}}
+        """
+        res = collections.OrderedDict((name, None) for name in names)
+        with futures.ThreadPoolExecutor(max_workers=self.jobs or max(len(res), 1)) as executor:
+            running = dict((executor.submit(self._run_container, name), name) for name in res)
+            for future in futures.as_completed(running):
+                name = running[future]
+                res[name] = future.result()
+                logger.info("{name}: pytest exited with {code} after {t:.1f}s".format(
+                    name=name, code=res[name]["exit_code"], t=res[name]["duration"]))
+        return res
+
+    def command(self, name, report):
+        """
+        Command line of the pytest process testing one container.
+
+        :param name: name of the container
+        :param report: path of its junit report
+        :return: list of the program and its arguments
+        """
+        return [sys.executable, "-m", "pytest"] + self.tests + [
+            "--config-file", self.config_file,
+            "--psql-config-file", self.psql_config_file,
+            "--container", name,
+            "--junitxml", report,
+            # the processes would all write the same cache
+            "-p", "no:cacheprovider"
+        ] + self.pytest_args
+
+    def _run_container(self, name):
+        report = os.path.join(self.directory, "{name}.xml".format(name=name))
+        log = os.path.join(self.directory, "{name}.log".format(name=name))
+        start = time.time()
+        with open(log, "w") as output:
+            exit_code = subprocess.call(self.command(name, report), stdout=output, stderr=subprocess.STDOUT)
+        return {"exit_code": exit_code, "duration": time.time() - start, "report": report, "log": log}
+
+
+def merge_reports(reports, output):
+    """
+    Merge the junit reports of several containers into one, with a test suite per container.
+
+    The test cases are prefixed with the name of their container, a container without report, e.g. whose pytest
+    process crashed, is counted as one error.
+
+    :param reports: dict {container: path of its junit report}
+    :param output: path of the merged report
+    :return: dict of the totals: tests, failures, errors and skipped
+    """
+    totals = dict((counter, 0) for counter in _COUNTERS)
+    root = ElementTree.Element("testsuites")
+    for name, path in reports.items():
+        try:
+            suite = ElementTree.parse(path).getroot()
+        except (IOError, ElementTree.ParseError) as e:
+            logger.debug(e)
+            suite = ElementTree.Element("testsuite", tests="1", failures="0", errors="1", skipped="0")
+            case = ElementTree.SubElement(suite, "testcase", classname="pytest", name="run")
+            ElementTree.SubElement(case, "error", message="No junit report {path}".format(path=path))
+        if suite.tag == "testsuites":
+            # junit 2 reports of recent pytest versions
+            suite = suite.find("testsuite")
+        suite.set("name", name)
+        for case in suite.iter("testcase"):
+            case.set("classname", "{name}.{classname}".format(name=name, classname=case.get("classname", "")))
+        for counter in _COUNTERS:
+            totals[counter] += int(suite.get(counter, suite.get("skips", 0) if counter == "skipped" else 0))
+        root.append(suite)
+
+    for counter in _COUNTERS:
+        root.set(counter, str(totals[counter]))
+    ElementTree.ElementTree(root).write(output, encoding="utf-8", xml_declaration=True)
+    return totals
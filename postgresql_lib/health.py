@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import time
+import logging
+import subprocess
+import collections
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.health")
+
+# properties of each unit collected by snapshot
+PROPERTIES = ("Id", "ActiveState", "SubState", "Restart", "NRestarts", "MainPID")
+
+# units checked when the config does not list them
+DEFAULT_UNITS = ["postgresql", "monit"]
+
+
+def units(settings):
+    """
+    Units of a container configuration.
+
+    :param settings: container settings, with the list "units" or at least "service_name"
+    :return: list of unit names
+    """
+    if "units" in settings:
+        return list(settings["units"])
+    return [settings.get("service_name", DEFAULT_UNITS[0])] + DEFAULT_UNITS[1:]
+
+
+def show_command(names):
+    """
+    A single systemctl show printing the properties of all the units.
+
+    :param names: unit names
+    :return: list of the program and its arguments
+    """
+    command = ["systemctl", "show"]
+    for prop in PROPERTIES:
+        command.extend(["-p", prop])
+    return command + list(names)
+
+
+def parse_show(output, names):
+    """
+    Parse the output of show_command.
+
+    systemctl show prints the properties of each unit as key=value lines, the units being separated by a blank line
+    and given in the order of the command line.
+
+    :param output: text printed by systemctl show
+    :param names: unit names given to show_command
+    :return: ordered dict {unit: {property: value}}, the numeric properties as int
+    """
+    blocks = output.strip().split("\n\n")
+    if len(blocks) != len(names):
+        raise Exception("systemctl show returned {n} units instead of {expected}".format(n=len(blocks),
+                                                                                         expected=len(names)))
+    res = collections.OrderedDict()
+    for name, block in zip(names, blocks):
+        properties = {}
+        for line in block.splitlines():
+            key, _, value = line.partition("=")
+            properties[key] = int(value) if key in ("NRestarts", "MainPID") and value.isdigit() else value
+        res[name] = properties
+    return res
+
+
+def snapshot(container, names, docker=None):
+    """
+    Collect the state of the systemd units of a container with one command.
+
+    :param container: name of the container
+    :param names: unit names, e.g. units(settings)
+    :param docker: docker_api.DockerClient, the docker CLI is used if None
+    :return: HealthSnapshot
+    """
+    command = show_command(names)
+    start = time.time()
+    if docker is not None:
+        res = docker.execute(container, command)
+        if res.exit_code != 0:
+            raise Exception("systemctl show failed in {container}: {e}".format(
+                container=container, e=res.stderr.decode("utf-8", "replace").strip()))
+        output = res.stdout.decode("utf-8")
+    else:
+        output = subprocess.check_output(["docker", "exec", container] + command).decode("utf-8")
+    logger.debug("Snapshot of {container} taken in {t:.3f} seconds".format(container=container,
+                                                                          t=time.time() - start))
+    return HealthSnapshot(container, parse_show(output, names))
+
+
+class HealthSnapshot(object):
+    """State of the systemd units of a container at one point in time, see snapshot."""
+
+    def __init__(self, container, units):
+        """
+
+        :param container: name of the container
+        :param units: ordered dict {unit: {property: value}}, see parse_show
+        """
+        self.container = container
+        self.units = units
+
+    def __getitem__(self, name):
+        return self.units[name]
+
+    def is_active(self, name):
+        """True if the unit is active."""
+        return self.units[name].get("ActiveState") == "active"
+
+    def problems(self):
+        """
+        Describe the units which are not active.
+
+        :return: list of messages, empty if all the units are active
+        """
+        return ["{unit} is {active} ({sub})".format(unit=name, active=properties.get("ActiveState"),
+                                                    sub=properties.get("SubState"))
+                for name, properties in self.units.items() if not self.is_active(name)]
+
+    def as_dict(self):
+        """
+        :return: {"container": ..., "units": {unit: {property: value}}}, serialisable as json
+        """
+        return collections.OrderedDict([("container", self.container), ("units", self.units)])
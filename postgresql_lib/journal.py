@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import os
+import re
+import json
+import time
+import logging
+import subprocess
+import collections
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.journal")
+
+# journalctl priority, the entries of this priority and the more severe ones are read
+DEFAULT_PRIORITY = "err"
+
+# category of the entries matching none of the patterns
+OTHER = "other"
+
+# (category, pattern) tried in order on the message of each entry, compiled once
+DEFAULT_PATTERNS = [
+    ("connection", re.compile(r"connection (refused|reset|timed out)|failed to connect|could not connect", re.I)),
+    ("restart", re.compile(r"process is not running|trying to restart|restart(ed)? failed|failed to start", re.I)),
+    ("permission", re.compile(r"permission denied|operation not permitted|authentication failed", re.I)),
+    ("configuration", re.compile(r"syntax error|invalid (configuration|option|value)|unknown (option|directive)",
+                                 re.I)),
+    ("resource", re.compile(r"out of memory|no space left|too many (open files|connections)", re.I)),
+]
+
+# seconds added to the timeout of a follow for the exec itself
+_EXEC_TIMEOUT = 30
+
+_CURSOR_PREFIX = "-- cursor: "
+
+JournalEntry = collections.namedtuple("JournalEntry", ["timestamp", "unit", "priority", "message", "category",
+                                                       "cursor"])
+
+
+def classify(message, patterns=DEFAULT_PATTERNS):
+    """
+    Category of a log message.
+
+    :param message: text of the message
+    :param patterns: list of (category, compiled regular expression)
+    :return: category of the first matching pattern, OTHER if none matches
+    """
+    for category, pattern in patterns:
+        if pattern.search(message):
+            return category
+    return OTHER
+
+
+class JournalReader(object):
+    """
+    Read the error entries of systemd units from the journal of a container, as json.
+
+    The reader remembers the cursor of the last entry read, in memory and in cursor_file if given: each read only
+    returns the entries written since the previous one instead of reading the whole journal of the boot again.
+
+    reader = JournalReader(["monit"], cursor_file="/var/tmp/monit.cursor")
+    errors = reader.read("postgresql")
+    """
+
+    def __init__(self, units, priority=DEFAULT_PRIORITY, cursor_file=None, patterns=DEFAULT_PATTERNS):
+        """
+
+        :param units: systemd units whose entries are read
+        :param priority: least severe priority read, e.g. "err" or "warning"
+        :param cursor_file: file keeping the cursor between runs, None to keep it in memory only
+        :param patterns: list of (category, compiled regular expression) classifying the entries, see classify
+        """
+        self.units = list(units)
+        self.priority = priority
+        self.cursor_file = cursor_file
+        self.patterns = patterns
+        self.cursor = None
+        if cursor_file and os.path.exists(cursor_file):
+            with open(cursor_file) as f:
+                self.cursor = f.read().strip() or None
+
+    def command(self, since=None, follow=False):
+        """
+        journalctl command reading the entries after the cursor.
+
+        :param since: date of the oldest entry read when there is no cursor yet, e.g. the start of the container
+        :param follow: wait for new entries instead of stopping at the end of the journal
+        :return: list of the program and its arguments
+        """
+        command = ["journalctl", "--output", "json", "--no-pager", "--priority", self.priority]
+        for unit in self.units:
+            command.extend(["--unit", unit])
+        if self.cursor:
+            command.extend(["--after-cursor", self.cursor])
+        elif since is not None:
+            command.extend(["--since", str(since)])
+        else:
+            command.append("--boot")
+        if follow:
+            command.append("--follow")
+        else:
+            # the cursor is printed even when there is no entry, so the next read skips the entries filtered out
+            command.append("--show-cursor")
+        return command
+
+    def read(self, container, since=None, docker=None):
+        """
+        Read the entries written since the previous read.
+
+        :param container: name of the container
+        :param since: date of the oldest entry read when there is no cursor yet, the start of the boot if None
+        :param docker: docker_api.DockerClient, the docker CLI is used if None
+        :return: list of JournalEntry
+        """
+        entries = list(self._entries(_lines(container, self.command(since), docker)))
+        self._save()
+        logger.debug("{n} entries read from {container}".format(n=len(entries), container=container))
+        return entries
+
+    def follow(self, container, timeout, since=None, stop=None, docker=None):
+        """
+        Read the entries as they are written, until the timeout or until stop returns True.
+
+        :param container: name of the container
+        :param timeout: seconds after which the reading stops
+        :param since: date of the oldest entry read when there is no cursor yet, the start of the boot if None
+        :param stop: function called with each JournalEntry, the reading stops once it returns True; defaults to
+            stopping at the first entry
+        :param docker: docker_api.DockerClient, the docker CLI is used if None
+        :return: list of JournalEntry
+        """
+        stop = stop or (lambda entry: True)
+        # the deadline is kept in the container, where journalctl --follow never ends by itself
+        command = ["timeout", "{t:g}".format(t=timeout)] + self.command(since, follow=True)
+        lines = _lines(container, command, docker, timeout + _EXEC_TIMEOUT)
+        entries = []
+        start = time.time()
+        try:
+            for entry in self._entries(lines):
+                entries.append(entry)
+                if stop(entry):
+                    break
+        finally:
+            lines.close()
+            self._save()
+        logger.debug("{n} entries followed in {container} for {t:.3f} seconds".format(
+            n=len(entries), container=container, t=time.time() - start))
+        return entries
+
+    def _entries(self, lines):
+        for line in lines:
+            if line.startswith(_CURSOR_PREFIX):
+                self.cursor = line[len(_CURSOR_PREFIX):].strip()
+                continue
+            if not line.strip():
+                continue
+            fields = json.loads(line)
+            self.cursor = fields.get("__CURSOR", self.cursor)
+            message = _text(fields.get("MESSAGE"))
+            yield JournalEntry(
+                int(fields.get("__REALTIME_TIMESTAMP", 0)) / 1e6,
+                fields.get("_SYSTEMD_UNIT") or fields.get("UNIT"),
+                int(fields.get("PRIORITY", 6)),
+                message,
+                classify(message, self.patterns),
+                fields.get("__CURSOR")
+            )
+
+    def _save(self):
+        if self.cursor_file and self.cursor:
+            with open(self.cursor_file, "w") as f:
+                f.write(self.cursor)
+
+
+def _text(message):
+    """journalctl prints the binary messages as arrays of bytes."""
+    if isinstance(message, list):
+        return bytes(message).decode("utf-8", "replace")
+    return message or ""
+
+
+def _lines(container, command, docker=None, timeout=None):
+    """
+    Run a command in a container and yield its standard output line by line, while it is written.
+
+    :return: generator of lines as str, closing it stops reading the output
+    """
+    if docker is not None:
+        pending = b""
+        for kind, data in docker.stream(container, command, timeout):
+            if kind != 1:
+                logger.debug(data.decode("utf-8", "replace"))
+                continue
+            pending += data
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                yield line.decode("utf-8", "replace")
+        if pending:
+            yield pending.decode("utf-8", "replace")
+        return
+
+    process = subprocess.Popen(["docker", "exec", container] + command, stdout=subprocess.PIPE)
+    try:
+        for line in process.stdout:
+            yield line.decode("utf-8", "replace")
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import re
+import hashlib
+import logging
+import tempfile
+import collections
+
+from psycopg2 import sql
+from psycopg2 import extras
+
+from postgresql_lib import splitter
+from postgresql_lib import classifier
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.ledger")
+
+DEFAULT_TABLE = "postgresql_tools_ledger"
+
+SCRIPT = "script"
+STATEMENT = "statement"
+
+# characters read at once to hash a script file
+_HASH_CHUNK_SIZE = 64 * 1024
+
+# COPY data kept in memory to be sent after being hashed, beyond it is written to a temporary file
+_SPOOL_SIZE = 1024 * 1024
+
+# any constant key shared by the processes creating the ledger table
+_CREATE_LOCK = 0x6c656467
+
+# statements changing the state of the session, e.g. the search_path or the role of the statements after them: they
+# run again on each execution, even when already applied
+_SESSION_STATE = re.compile(r"(?:SET|RESET)\b|SELECT\s+(?:pg_catalog\s*\.\s*)?set_config\s*\(", re.IGNORECASE)
+
+
+class MigrationLedger(object):
+    """
+    Table recording the scripts and statements already applied to a database.
+
+    A script whose content was applied as a whole is skipped without being read again. Otherwise the statements
+    already applied are skipped and only the new ones run, e.g. the statements added at the end of a script.
+    A statement is identified by the name of its script, its text and the number of identical statements before it
+    in the script, so the same statement in another script still runs. The statements changing the state of the
+    session, SET, RESET and SELECT set_config(...), always run: the statements after them depend on it.
+
+    The ledger is stateless: it can be shared by the threads of a ParallelScriptRunner.
+    """
+
+    def __init__(self, table=DEFAULT_TABLE):
+        """
+
+        :param table: name of the ledger table, created in the database if it does not exist
+        """
+        self.table = table
+
+    def start(self, cur, script, name=None):
+        """
+        Prepare the execution of a script.
+
+        :param cur: cursor on postgresql
+        :param script: queries to execute, either a string, a bytes buffer or a file object opened in text mode
+        :param name: name of the script, e.g. its path, identifying it across its versions. The scripts without a
+            name share the same one.
+        :return: LedgerRun
+        """
+        table = self.ensure(cur)
+        scope = name_digest(name)
+        digest = script_digest(script)
+        if digest is not None:
+            digest = _scoped(scope, digest)
+            cur.execute(sql.SQL("SELECT 1 FROM {table} WHERE hash = %s").format(table=table), (digest,))
+            if cur.rowcount > 0:
+                return LedgerRun(self, table, digest, scope, applied=None)
+
+        cur.execute(sql.SQL("SELECT hash FROM {table} WHERE kind = %s AND script = %s").format(table=table),
+                    (STATEMENT, scope))
+        source = script if isinstance(script, str) or splitter.is_buffer(script) else None
+        return LedgerRun(self, table, digest, scope, applied=set(row[0] for row in cur), source=source)
+
+    def ensure(self, cur):
+        """
+        Create the ledger table if it does not exist.
+
+        :param cur: cursor on postgresql
+        :return: sql.Composable naming the table with its schema, so a script changing the search_path does not
+            hide it
+        """
+        table = self._qualified(cur)
+        if table is not None:
+            return table
+        logger.info("Creating the ledger table {table}".format(table=self.table))
+        # concurrent CREATE TABLE IF NOT EXISTS can fail, the lock is released with the transaction
+        cur.execute(sql.SQL("""SELECT pg_advisory_xact_lock(%s)
+;
+CREATE TABLE IF NOT EXISTS {table} (
+    hash char(64) PRIMARY KEY,
+    kind text NOT NULL,
+    script char(64),
+    command text,
+    duration double precision,
+    applied_at timestamp with time zone NOT NULL DEFAULT now()
+)""").format(table=sql.Identifier(self.table)), (_CREATE_LOCK,))
+        return self._qualified(cur)
+
+    def record(self, cur, rows, table=None):
+        """
+        Record applied scripts or statements.
+
+        :param cur: cursor on postgresql
+        :param rows: list of (hash, kind, hash of the name of the script, command, duration in seconds or None)
+        :param table: name of the table returned by ensure, defaults to the table looked up in the search_path
+        """
+        if not rows:
+            return
+        extras.execute_values(
+            cur,
+            sql.SQL("INSERT INTO {table} (hash, kind, script, command, duration) VALUES %s "
+                    "ON CONFLICT (hash) DO NOTHING").format(table=table or sql.Identifier(self.table)).as_string(cur),
+            rows
+        )
+
+    def _qualified(self, cur):
+        """
+        :return: sql.Composable naming the ledger table with its schema, None if it does not exist
+        """
+        cur.execute("SELECT n.nspname, c.relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+                    "WHERE c.oid = to_regclass(quote_ident(%s))", (self.table,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return sql.SQL("{schema}.{table}").format(schema=sql.Identifier(row[0]), table=sql.Identifier(row[1]))
+
+    def forget(self, con, script, name=None):
+        """
+        Forget a script and its statements, e.g. after its rollback script undid them.
+
+        :param con: connection to postgresql
+        :param script: the script, either a string, a bytes buffer or a file object opened in text mode and read from
+            its current position
+        :param name: name of the script given to start
+        """
+        scope = name_digest(name)
+        digests = [_scoped(scope, script_digest(script))]
+        digests.extend(digest for statement, digest in statement_digests(splitter.iter_statements(script), scope))
+        with con.cursor() as cur:
+            table = self.ensure(cur)
+            cur.execute(sql.SQL("DELETE FROM {table} WHERE hash = ANY(%s)").format(table=table), (digests,))
+        con.commit()
+
+
+class LedgerRun(object):
+    """Ledger state of one execution of a script, created by MigrationLedger.start."""
+
+    def __init__(self, ledger, table, digest, scope, applied, source=None):
+        """
+
+        :param ledger: MigrationLedger
+        :param table: name of the ledger table with its schema, see MigrationLedger.ensure
+        :param digest: hash of the script and of its name, None if it cannot be read twice
+        :param scope: hash of the name of the script, see name_digest
+        :param applied: hashes of the statements already applied, None if the whole script was applied
+        :param source: the script when it is a string or a bytes buffer, the COPY data hashed is read again from it
+        """
+        self.ledger = ledger
+        self.table = table
+        self.digest = digest
+        self.scope = scope
+        self.applied = applied
+        self.source = source
+        # hashes of the statements handed to the executor, in order
+        self._pending = collections.deque()
+        # number of transcript entries already recorded
+        self._recorded = 0
+
+    @property
+    def done(self):
+        """True if the whole script was already applied."""
+        return self.applied is None
+
+    def filter(self, statements):
+        """
+        Skip the statements already applied, except those changing the state of the session.
+
+        :param statements: iterator of splitter.Statement
+        :return: iterator of the splitter.Statement not applied yet
+        """
+        skipped = 0
+        for statement, digest in statement_digests(statements, self.scope, keep_copy_data=True, source=self.source):
+            if digest in self.applied and not changes_session(statement):
+                skipped += 1
+                continue
+            self._pending.append(digest)
+            yield statement
+        if skipped:
+            logger.info("Skipped {n} statements already applied".format(n=skipped))
+
+    def flush(self, cur, res):
+        """
+        Record the statements of the transcript executed since the previous flush.
+
+        :param cur: cursor on postgresql
+        :param res: transcript.Transcript of the executed queries, the recorded entries are released
+        """
+        rows = []
+        for counter in range(self._recorded + 1, res.counter + 1):
+            entry = res[counter]
+            if "status" not in entry:
+                # the failing statement
+                break
+            # only the leading keywords and names are kept, the literals may be passwords
+            rows.append((self._pending.popleft(), STATEMENT, self.scope, classifier.leading_words(entry["command"]),
+                         entry.get("duration")))
+        self.ledger.record(cur, rows, self.table)
+        self._recorded += len(rows)
+        res.release(self._recorded)
+
+    def finish(self, cur, res, duration):
+        """
+        Record the statements executed since the previous flush and the script.
+
+        :param cur: cursor on postgresql
+        :param res: transcript of the executed queries
+        :param duration: seconds spent executing the script
+        """
+        self.flush(cur, res)
+        if self.digest is not None:
+            self.ledger.record(cur, [(self.digest, SCRIPT, self.scope, None, duration)], self.table)
+
+
+def statement_digests(statements, scope=None, keep_copy_data=False, source=None):
+    """
+    Hash the statements of a script, identical statements are told apart by their number of occurrences.
+
+    The inline data of a COPY ... FROM STDIN is hashed with its statement, so that new data runs it again. The data is
+    read to be hashed: to be sent afterwards, it is read again from the script in memory or from a temporary copy.
+
+    :param statements: iterator of splitter.Statement
+    :param scope: hash of the name of the script, see name_digest, defaults to the scripts without a name
+    :param keep_copy_data: replace the COPY data read by a file object reading it again, instead of dropping it
+    :param source: the script when it is a string or a bytes buffer, None to copy the COPY data kept
+    :return: iterator of (statement, hex sha256)
+    """
+    scope = scope or name_digest(None)
+    occurrences = collections.Counter()
+    for statement in statements:
+        digest = hashlib.sha256(statement.text.encode("utf-8"))
+        if statement.copy_data is not None:
+            _hash_copy_data(statement, digest, keep_copy_data, source)
+        text = digest.hexdigest()
+        digest = hashlib.sha256("{scope}:{n}:{text}".format(scope=scope, n=occurrences[text],
+                                                            text=text).encode("ascii")).hexdigest()
+        occurrences[text] += 1
+        yield statement, digest
+
+
+def _hash_copy_data(statement, digest, keep_copy_data, source):
+    """Add the COPY data of a statement to its hash, see statement_digests."""
+    copy_data = statement.copy_data
+    spool = _SpooledCopyData() if keep_copy_data and source is None else None
+    # the end marker, so that the data cannot be taken for the end of the statement
+    digest.update(b"\n\\.\n")
+    while True:
+        chunk = copy_data.read(_HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        if spool is not None:
+            spool.write(chunk)
+        digest.update(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+    if spool is not None:
+        statement.copy_data = spool.rewind()
+    elif keep_copy_data:
+        statement.copy_data = splitter.CopyRange(source, copy_data.start, copy_data.end)
+
+
+class _SpooledCopyData(object):
+    """COPY data read from a file object to be hashed, kept to be sent, in memory up to _SPOOL_SIZE."""
+
+    def __init__(self):
+        self._spool = None
+        # number of characters read
+        self.size = 0
+
+    def write(self, chunk):
+        if self._spool is None:
+            mode = "w+" if isinstance(chunk, str) else "w+b"
+            self._spool = tempfile.SpooledTemporaryFile(max_size=_SPOOL_SIZE, mode=mode)
+        self._spool.write(chunk)
+
+    def rewind(self):
+        if self._spool is not None:
+            self._spool.seek(0)
+        return self
+
+    def read(self, size=-1):
+        if self._spool is None:
+            return ""
+        data = self._spool.read(size)
+        self.size += len(data)
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+    def drain(self):
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+
+def changes_session(statement):
+    """
+    :param statement: splitter.Statement
+    :return: True if the statement changes the state of the session: SET, RESET or SELECT set_config(...)
+    """
+    return _SESSION_STATE.match(statement.text) is not None
+
+
+def name_digest(name):
+    """
+    :param name: name of a script, None for the scripts without a name
+    :return: hex sha256 identifying the script across its versions
+    """
+    return hashlib.sha256("{name}".format(name=name or "").encode("utf-8")).hexdigest()
+
+
+def _scoped(scope, digest):
+    """Hash of a script content under the name of the script."""
+    return hashlib.sha256("{scope}:{digest}".format(scope=scope, digest=digest).encode("ascii")).hexdigest()
+
+
+def script_digest(script):
+    """
+    Hash the content of a script.
+
+    :param script: either a string, a bytes buffer encoded in utf-8 or a file object opened in text mode, read and
+        rewound if it is seekable
+    :return: hex sha256 of the script, None if the file object is not seekable
+    """
+    if isinstance(script, str):
+        return hashlib.sha256(script.encode("utf-8")).hexdigest()
+    if splitter.is_buffer(script):
+        # the same hash as the script read as a string
+        return hashlib.sha256(script).hexdigest()
+    if not script.seekable():
+        return None
+
+    digest = hashlib.sha256()
+    start = script.tell()
+    while True:
+        chunk = script.read(_HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk.encode("utf-8"))
+    script.seek(start)
+    return digest.hexdigest()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import time
+import random
+import logging
+
+import psycopg2
+from psycopg2 import errorcodes
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.locks")
+
+# number of times a statement failing on lock_timeout is retried
+DEFAULT_RETRIES = 5
+# seconds of the first backoff, doubled at each retry
+DEFAULT_BASE_DELAY = 0.1
+# upper bound of a backoff, in seconds
+DEFAULT_MAX_DELAY = 10.0
+
+_TIMEOUTS = ("lock_timeout", "statement_timeout")
+
+
+class LockRetry(object):
+    """
+    Retry of the statements failing on lock_timeout.
+
+    A statement waiting for a lock, e.g. an ALTER TABLE queued behind a long transaction, blocks every session which
+    needs the same table after it. With a short lock_timeout it gives up instead, and is retried after a backoff
+    drawn at random between 0 and base_delay * 2 ** attempt, so that the sessions it blocked meanwhile get through
+    and several migrations do not retry in step.
+    """
+
+    def __init__(self, retries=DEFAULT_RETRIES, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+        """
+
+        :param retries: maximum number of retries of a statement
+        :param base_delay: seconds of the first backoff
+        :param max_delay: upper bound of a backoff, in seconds
+        """
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt, error):
+        """
+        Wait before retrying a statement, if it failed on a lock and may be retried.
+
+        :param attempt: number of retries of the statement so far
+        :param error: exception raised by the statement
+        :return: True after waiting, False if the error must be raised
+        """
+        if attempt >= self.retries or not is_lock_timeout(error):
+            return False
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        logger.info("Lock not available, retrying in {delay:.2f}s ({attempt}/{retries})".format(
+            delay=delay, attempt=attempt + 1, retries=self.retries))
+        time.sleep(delay)
+        return True
+
+
+def is_lock_timeout(error):
+    """
+    Tell if a statement failed because a lock was not granted in time, e.g. on lock_timeout or NOWAIT.
+
+    :param error: exception raised by the statement
+    :return: True if the statement may be retried as is
+    """
+    return isinstance(error, psycopg2.Error) and error.pgcode == errorcodes.LOCK_NOT_AVAILABLE
+
+
+def set_timeouts(cur, lock_timeout=None, statement_timeout=None):
+    """
+    Set the lock and statement timeouts of the session, each applies to every statement.
+
+    :param cur: cursor on postgresql, in autocommit mode so the settings outlive the transactions
+    :param lock_timeout: maximum wait for a lock, in milliseconds or as a postgresql duration, e.g. "2s"
+    :param statement_timeout: maximum duration of a statement, in milliseconds or as a postgresql duration
+    :return: the previous values of the settings, see restore_timeouts
+    """
+    cur.execute("SELECT current_setting('lock_timeout'), current_setting('statement_timeout')")
+    previous = cur.fetchone()
+    for name, value in zip(_TIMEOUTS, (lock_timeout, statement_timeout)):
+        if value is not None:
+            cur.execute("SELECT set_config(%s, %s, false)", (name, str(value)))
+    return previous
+
+
+def restore_timeouts(con, previous):
+    """
+    Restore the timeouts of the session, e.g. before the connection is returned to a pool.
+
+    :param con: connection to postgresql, outside of a transaction
+    :param previous: values returned by set_timeouts
+    """
+    try:
+        with con:
+            with con.cursor() as cur:
+                for name, value in zip(_TIMEOUTS, previous):
+                    cur.execute("SELECT set_config(%s, %s, false)", (name, value))
+    except psycopg2.Error as e:
+        logger.debug("Cannot restore the timeouts of the session: {e}".format(e=e))
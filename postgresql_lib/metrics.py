@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import os
+import bisect
+import logging
+import tempfile
+import threading
+import socketserver
+
+from http import server
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.metrics")
+
+# upper bounds of the buckets of the statement durations, in seconds
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# upper bounds of the buckets of the connection acquisition times, in seconds
+ACQUIRE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+# kinds of rollback
+ROLLBACK_SCRIPT = "script"
+ROLLBACK_TRANSACTION = "transaction"
+
+# sqlstate label of the failures not reported by postgresql, e.g. a lost connection
+UNKNOWN_SQLSTATE = "unknown"
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+_PREFIX = "postgresql_tools_"
+
+
+class _Histogram(object):
+    """Counts of the observations per bucket, their sum and their number."""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # counts[i] is the number of observations in (bounds[i - 1], bounds[i]], the last one above every bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name):
+        cumulated = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            cumulated += count
+            yield '{name}_bucket{{le="{le}"}} {value}'.format(name=name, le=_format_bound(bound), value=cumulated)
+        yield "{name}_sum {value}".format(name=name, value=repr(self.sum))
+        yield "{name}_count {value}".format(name=name, value=self.count)
+
+
+class MetricsRegistry(object):
+    """
+    Counters and histograms of the script executions, exported in the Prometheus text format or in OpenMetrics.
+
+    A registry is given to the executor, e.g. PostgresqlScriptExecutor.run(con, script, metrics=registry), and to
+    pool.ConnectionPool. Without one nothing is measured: the executor only tests that it is None and does not
+    import this module. The registry is thread safe, so one registry is shared by the workers of a
+    parallel.ParallelScriptRunner.
+
+    registry = MetricsRegistry(textfile="/var/lib/node_exporter/postgresql_tools.prom")
+    PostgresqlScriptExecutor.run(con, script, metrics=registry)
+    registry.flush()
+
+    The metrics are postgresql_tools_statements_total, postgresql_tools_statement_duration_seconds,
+    postgresql_tools_statement_bytes_total, postgresql_tools_failures_total{sqlstate},
+    postgresql_tools_rollbacks_total{kind} and postgresql_tools_connection_acquire_seconds.
+    """
+
+    def __init__(self, textfile=None):
+        """
+
+        :param textfile: path of the file written by flush, e.g. in the directory of the textfile collector of the
+            node exporter
+        """
+        self.textfile = textfile
+        self._lock = threading.Lock()
+        self.statements = 0
+        self.bytes = 0
+        self.durations = _Histogram(DURATION_BUCKETS)
+        self.acquisitions = _Histogram(ACQUIRE_BUCKETS)
+        # sqlstate -> number of scripts which failed with it
+        self.failures = {}
+        # kind -> number of rollbacks
+        self.rollbacks = {ROLLBACK_SCRIPT: 0, ROLLBACK_TRANSACTION: 0}
+
+    def observe_statement(self, duration, size):
+        """
+        Count an executed statement.
+
+        :param duration: seconds between sending the statement and receiving its result
+        :param size: number of bytes sent
+        """
+        with self._lock:
+            self.statements += 1
+            self.bytes += size
+            self.durations.observe(duration)
+
+    def observe_failure(self, error, rolled_back=False):
+        """
+        Count a failed script by the sqlstate of its error.
+
+        :param error: exception which made the script fail, a psycopg2.Error carries the sqlstate as pgcode
+        :param rolled_back: the transaction of the script was rolled back by postgresql, none of its queries stay
+            applied
+        """
+        sqlstate = getattr(error, "pgcode", None) or UNKNOWN_SQLSTATE
+        with self._lock:
+            self.failures[sqlstate] = self.failures.get(sqlstate, 0) + 1
+            if rolled_back:
+                self.rollbacks[ROLLBACK_TRANSACTION] += 1
+
+    def observe_rollback(self):
+        """Count a rollback script run after the failure of its script."""
+        with self._lock:
+            self.rollbacks[ROLLBACK_SCRIPT] += 1
+
+    def observe_acquire(self, duration):
+        """
+        Count a connection taken out of a pool.
+
+        :param duration: seconds spent waiting for the connection, opening or checking it
+        """
+        with self._lock:
+            self.acquisitions.observe(duration)
+
+    def exposition(self, openmetrics=False):
+        """
+        :param openmetrics: use the OpenMetrics format instead of the Prometheus text format
+        :return: the metrics, a string
+        """
+        lines = []
+        with self._lock:
+            _counter(lines, "statements", "Statements executed.", [("", self.statements)], openmetrics)
+            _counter(lines, "statement_bytes", "Bytes of the statements sent, with the inline data of COPY.",
+                     [("", self.bytes)], openmetrics)
+            _counter(lines, "failures", "Scripts failed, by sqlstate of the error.",
+                     [('{{sqlstate="{s}"}}'.format(s=s), n) for s, n in sorted(self.failures.items())], openmetrics)
+            _counter(lines, "rollbacks", "Rollback scripts run and transactions rolled back.",
+                     [('{{kind="{k}"}}'.format(k=k), n) for k, n in sorted(self.rollbacks.items())], openmetrics)
+            _histogram(lines, "statement_duration_seconds", "Duration of the statements.", self.durations)
+            _histogram(lines, "connection_acquire_seconds", "Time to take a connection out of the pool.",
+                       self.acquisitions)
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """Write the metrics to the textfile, atomically so a collector never reads a partial file."""
+        if self.textfile is None:
+            return
+        directory = os.path.dirname(os.path.abspath(self.textfile))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".postgresql_tools_metrics")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.exposition())
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, self.textfile)
+        except Exception:
+            os.remove(tmp)
+            raise
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Serve the metrics over http from a background thread, until shutdown is called on the server returned.
+
+        :param port: port to listen on, 0 for any free port
+        :param host: address to listen on, only the local host by default
+        :return: the http.server.HTTPServer, its server_address gives the port
+        """
+        httpd = _Server((host, port), _MetricsHandler)
+        httpd.registry = self
+        thread = threading.Thread(target=httpd.serve_forever, name="postgresql_tools_metrics", daemon=True)
+        thread.start()
+        logger.info("Serving the metrics on http://{host}:{port}/metrics".format(host=host,
+                                                                                 port=httpd.server_address[1]))
+        return httpd
+
+
+class _Server(socketserver.ThreadingMixIn, server.HTTPServer):
+    # a slow scraper does not delay the others
+    daemon_threads = True
+
+
+class _MetricsHandler(server.BaseHTTPRequestHandler):
+    """Answer GET /metrics, in OpenMetrics when the scraper accepts it."""
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+        body = self.server.registry.exposition(openmetrics).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", "{n}".format(n=len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def _counter(lines, name, description, samples, openmetrics):
+    # OpenMetrics names the family without the _total suffix of its samples, the Prometheus text format with it
+    family = _PREFIX + name if openmetrics else _PREFIX + name + "_total"
+    lines.append("# HELP {family} {description}".format(family=family, description=description))
+    lines.append("# TYPE {family} counter".format(family=family))
+    for labels, value in samples:
+        lines.append("{prefix}{name}_total{labels} {value}".format(prefix=_PREFIX, name=name, labels=labels,
+                                                                   value=value))
+
+
+def _histogram(lines, name, description, histogram):
+    lines.append("# HELP {prefix}{name} {description}".format(prefix=_PREFIX, name=name, description=description))
+    lines.append("# TYPE {prefix}{name} histogram".format(prefix=_PREFIX, name=name))
+    lines.extend(histogram.samples(_PREFIX + name))
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import json
+import logging
+import threading
+import collections
+
+from concurrent import futures
+
+from postgresql_lib import splitter
+from postgresql_lib import script as pgscript
+from postgresql_lib import template as pgtemplate
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.parallel")
+
+DEFAULT_WORKERS = 4
+
+# status of a script/rollback pair after ParallelScriptRunner.run
+DONE = "done"
+# the script failed and its rollback script undid it
+ROLLED_BACK = "rolled back"
+# the script failed and was not undone: no rollback script, or the rollback script failed too
+FAILED = "failed"
+# a pair it depends on is not done
+SKIPPED = "skipped"
+
+
+class ScriptPair(object):
+    """A script, the script undoing it on failure, and the pairs which must be applied before."""
+
+    def __init__(self, name, script, rollback_script=None, depends_on=None, database=None, parameters=None):
+        """
+
+        :param name: unique name of the pair, used in depends_on
+        :param script: path of the sql script
+        :param rollback_script: path of the rollback sql script, run if the script fails
+        :param depends_on: names of the pairs which must be done before this one starts
+        :param database: database to connect to, defaults to the database of the connection settings
+        :param parameters: dict of the parameters of the script and rollback script when they are templates, see
+            template.ScriptTemplate
+        """
+        self.name = name
+        self.script = script
+        self.rollback_script = rollback_script
+        self.depends_on = list(depends_on or [])
+        self.database = database
+        self.parameters = parameters
+
+
+def load_manifest(path):
+    """
+    Load a manifest of script/rollback pairs.
+
+    The manifest is a json file such as:
+    {
+        "workers": 4,
+        "scripts": [
+            {"name": "keycloak", "script": "keycloak.sql", "rollback_script": "keycloak_rollback.sql"},
+            {"name": "sentry", "script": "sentry.sql", "rollback_script": "sentry_rollback.sql",
+             "depends_on": ["keycloak"], "database": "postgres"},
+            {"name": "tenant1", "script": "tenant.sql", "parameters": {"tenant": "tenant1"}}
+        ]
+    }
+
+    :param path: path of the manifest
+    :return: (list of ScriptPair, number of workers or None)
+    """
+    try:
+        with open(path) as json_data:
+            manifest = json.load(json_data)
+    except IOError as e:
+        logger.debug(e)
+        raise IOError("Manifest file {path} not found".format(path=path))
+
+    pairs = []
+    for entry in manifest.get('scripts', []):
+        try:
+            pairs.append(ScriptPair(entry['name'], entry['script'], entry.get('rollback_script'),
+                                    entry.get('depends_on'), entry.get('database'), entry.get('parameters')))
+        except KeyError as e:
+            raise Exception("Manifest {path}: missing {key} in {entry}".format(path=path, key=e, entry=entry))
+    check_dependencies(pairs)
+    return pairs, manifest.get('workers')
+
+
+def template_pairs(script, rollback_script, rows):
+    """
+    Pairs running a template script once per row of parameters.
+
+    :param script: path of the template script
+    :param rollback_script: path of the template rollback script, None if there is none
+    :param rows: list of dicts of parameters, see template.load_parameters
+    :return: list of ScriptPair, named after the name parameter of their row or its number, from 1
+    """
+    return [ScriptPair("{name}".format(name=row.get("name", i)), script, rollback_script, parameters=row)
+            for i, row in enumerate(rows, 1)]
+
+
+def check_dependencies(pairs):
+    """
+    Check that the names are unique and that the dependencies exist and have no cycle.
+
+    :param pairs: list of ScriptPair
+    """
+    names = set()
+    for pair in pairs:
+        if pair.name in names:
+            raise Exception("Script {name} is declared twice".format(name=pair.name))
+        names.add(pair.name)
+    for pair in pairs:
+        for dependency in pair.depends_on:
+            if dependency not in names:
+                raise Exception("Script {name} depends on unknown script {dependency}".format(
+                    name=pair.name, dependency=dependency))
+
+    # Kahn's algorithm: the pairs left once no pair is ready are in a cycle
+    pending = dict((pair.name, set(pair.depends_on)) for pair in pairs)
+    ready = [name for name, dependencies in pending.items() if not dependencies]
+    while ready:
+        name = ready.pop()
+        del pending[name]
+        for other, dependencies in pending.items():
+            if name in dependencies:
+                dependencies.discard(name)
+                if not dependencies:
+                    ready.append(other)
+    if pending:
+        raise Exception("Dependency cycle between scripts {names}".format(names=", ".join(sorted(pending))))
+
+
+class ParallelScriptRunner(object):
+    """
+    Run independent script/rollback pairs concurrently.
+
+    A pair starts as soon as all the pairs it depends on are done. Each running pair holds one connection borrowed
+    from the pool, so at most workers connections are in use at the same time and the connections are reused from
+    one pair to the next. A failing script is undone by its own rollback script, the pairs depending on it are
+    skipped and the other pairs go on.
+    """
+
+    def __init__(self, pool, workers=DEFAULT_WORKERS, **run_options):
+        """
+
+        :param pool: pool.ConnectionPool the connections are borrowed from
+        :param workers: maximum number of pairs running at the same time
+        :param run_options: keyword arguments passed to PostgresqlScriptExecutor.run, e.g. batch_size
+        """
+        self.pool = pool
+        self.workers = workers
+        self.run_options = run_options
+        # path -> template.ScriptTemplate, its placeholders located once for all the pairs
+        self._templates = {}
+        self._templates_lock = threading.Lock()
+
+    def run(self, pairs):
+        """
+
+        :param pairs: list of ScriptPair
+        :return: ordered dict mapping the name of each pair to {"status": ..., "transcript": ..., "error": ...}, see
+            run_pair
+        """
+        check_dependencies(pairs)
+        res = collections.OrderedDict((pair.name, {"status": SKIPPED}) for pair in pairs)
+        waiting = list(pairs)
+        finished = set()
+        running = {}
+
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while waiting or running:
+                for pair in list(waiting):
+                    if all(dependency in finished for dependency in pair.depends_on):
+                        waiting.remove(pair)
+                        running[pool.submit(self.run_pair, pair)] = pair
+
+                if not running:
+                    # the remaining pairs depend on a failed pair
+                    for pair in waiting:
+                        logger.info("Skipping {name}, a script it depends on failed".format(name=pair.name))
+                    break
+
+                done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    pair = running.pop(future)
+                    res[pair.name] = future.result()
+                    if res[pair.name]["status"] == DONE:
+                        finished.add(pair.name)
+        return res
+
+    def run_pair(self, pair):
+        """
+        Run a script on its own connection and its rollback script if it fails.
+
+        :param pair: ScriptPair
+        :return: {"status": ..., "transcript": ..., "error": ..., "rollback_transcript": ...}, the transcript of the
+            script, up to its failure, and the transcript of the rollback script if it ran successfully
+        """
+        logger.info("Running {name} from {path}".format(name=pair.name, path=pair.script))
+        res = {"status": DONE}
+        try:
+            with self.pool.connection(pair.database) as con:
+                return self._run_pair(con, pair, res)
+        except Exception as e:
+            # the connection to postgresql failed
+            logger.debug(e)
+            return {"status": FAILED, "error": "{e}".format(e=e)}
+
+    def _run_pair(self, con, pair, res):
+        try:
+            script = self._source(con, pair, pair.script)
+            res["transcript"] = pgscript.PostgresqlScriptExecutor.run(con, script, script_name=pair.name,
+                                                                      **self.run_options)
+            logger.info("{name} done".format(name=pair.name))
+            return res
+        except pgscript.ScriptExecutionError as e:
+            logger.debug(e)
+            res["error"] = "{e}".format(e=e)
+            res["transcript"] = e.transcript
+            if not e.committed:
+                # transactional mode: the failed transaction was rolled back, nothing is left to undo
+                logger.info("{name} failed and was rolled back".format(name=pair.name))
+                res["status"] = ROLLED_BACK
+                return res
+            logger.info("{name} failed, running its rollback script".format(name=pair.name))
+        except Exception as e:
+            logger.debug(e)
+            logger.info("{name} failed, running its rollback script".format(name=pair.name))
+            res["error"] = "{e}".format(e=e)
+
+        if pair.rollback_script is None:
+            res["status"] = FAILED
+            return res
+        if self.run_options.get("metrics") is not None:
+            self.run_options["metrics"].observe_rollback()
+        try:
+            rollback_script = self._source(con, pair, pair.rollback_script)
+            res["rollback_transcript"] = pgscript.PostgresqlScriptExecutor.run(con, rollback_script,
+                                                                               **self._rollback_options())
+            if self.run_options.get("ledger") is not None:
+                # the statements undone by the rollback script must run again next time
+                self.run_options["ledger"].forget(con, self._source(con, pair, pair.script), pair.name)
+            res["status"] = ROLLED_BACK
+        except Exception as e:
+            logger.debug(e)
+            logger.info("Rollback of {name} failed".format(name=pair.name))
+            res["status"] = FAILED
+        return res
+
+    def _source(self, con, pair, path):
+        """
+        Script of a pair to run.
+
+        :return: the file mapped in memory, or the template rendered with the parameters of the pair
+        """
+        if pair.parameters is None:
+            return splitter.map_file(path)
+        with self._templates_lock:
+            template = self._templates.get(path)
+            if template is None:
+                template = self._templates[path] = pgtemplate.ScriptTemplate.load(path)
+        return template.render(con, pair.parameters)
+
+    def _rollback_options(self):
+        # a rollback script always runs in full
+        options = dict(self.run_options)
+        options.pop("ledger", None)
+        return options
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import time
+import logging
+import threading
+import contextlib
+import collections
+
+import psycopg2
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.pool")
+
+DEFAULT_MAXCONN = 4
+# seconds an unused connection stays open
+DEFAULT_IDLE_TIMEOUT = 300
+# connections unused for more than this number of seconds are checked before being handed out
+DEFAULT_CHECK_INTERVAL = 5
+
+
+class ConnectionPool(object):
+    """
+    Thread safe pool of connections to postgresql, reused across scripts and rollback scripts.
+
+    Connections are kept per database. A connection unused for check_interval seconds is checked with SELECT 1
+    before being handed out and replaced if it is broken; connections unused for idle_timeout seconds are closed,
+    keeping minconn of them open.
+
+    with ConnectionPool(host="127.0.0.1", user="postgres", password="1234") as pool:
+        with pool.connection() as con:
+            PostgresqlScriptExecutor.run(con, script)
+    """
+
+    def __init__(self, minconn=0, maxconn=DEFAULT_MAXCONN, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 check_interval=DEFAULT_CHECK_INTERVAL, metrics=None, **connect_kwargs):
+        """
+
+        :param minconn: number of connections to the default database opened at once and kept open
+        :param maxconn: maximum number of connections open at the same time, over all the databases
+        :param idle_timeout: seconds after which an unused connection is closed
+        :param check_interval: seconds after which an unused connection is checked before being handed out
+        :param metrics: metrics.MetricsRegistry measuring the time taken by getconn
+        :param connect_kwargs: arguments of psycopg2.connect, e.g. host, port, user, password, dbname
+        """
+        if maxconn < 1 or minconn > maxconn:
+            raise ValueError("Invalid pool size: minconn={min}, maxconn={max}".format(min=minconn, max=maxconn))
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.metrics = metrics
+        self.connect_kwargs = connect_kwargs
+
+        self._lock = threading.Condition()
+        # database -> deque of (connection, time it was returned), most recently returned last
+        self._idle = collections.defaultdict(collections.deque)
+        self._size = 0
+        self._closed = False
+
+        for _ in range(minconn):
+            self._idle[None].append((self._connect(None), time.time()))
+            self._size += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.closeall()
+
+    @contextlib.contextmanager
+    def connection(self, database=None, timeout=None):
+        """
+        Borrow a connection, given back to the pool at the end of the with block.
+
+        :param database: database to connect to, defaults to the dbname given to the pool
+        :param timeout: seconds to wait for a connection when maxconn are in use, forever if None
+        """
+        con = self.getconn(database, timeout)
+        try:
+            yield con
+        finally:
+            self.putconn(con, database)
+
+    def getconn(self, database=None, timeout=None):
+        """
+        Take a connection out of the pool, opening one if none is available.
+
+        :param database: database to connect to, defaults to the dbname given to the pool
+        :param timeout: seconds to wait for a connection when maxconn are in use, forever if None
+        :return: a psycopg2 connection, to give back with putconn
+        """
+        if self.metrics is None:
+            return self._getconn(database, timeout)
+        start = time.time()
+        con = self._getconn(database, timeout)
+        self.metrics.observe_acquire(time.time() - start)
+        return con
+
+    def _getconn(self, database, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise Exception("Connection pool is closed")
+                self._evict_idle()
+
+                idle = self._idle.get(database)
+                if idle:
+                    con, since = idle.pop()
+                    break
+                if self._size < self.maxconn or self._close_other_idle(database):
+                    # reserve the slot, the connection is opened outside of the lock
+                    self._size += 1
+                    con = None
+                    break
+
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise Exception("No connection to postgresql available after {t} seconds".format(t=timeout))
+                self._lock.wait(remaining)
+
+        if con is None:
+            try:
+                return self._connect(database)
+            except Exception:
+                self._release_slot()
+                raise
+
+        if time.time() - since >= self.check_interval and not self._is_healthy(con):
+            logger.info("Replacing a broken connection to postgresql")
+            self._close(con)
+            try:
+                return self._connect(database)
+            except Exception:
+                self._release_slot()
+                raise
+        return con
+
+    def putconn(self, con, database=None, close=False):
+        """
+        Give a connection back to the pool.
+
+        :param con: connection returned by getconn
+        :param database: database given to getconn
+        :param close: close the connection instead of keeping it
+        """
+        if not close and not con.closed:
+            try:
+                # abort any transaction left open and restore the default session settings
+                con.reset()
+            except psycopg2.Error as e:
+                logger.debug(e)
+                close = True
+
+        if close or con.closed or self._closed:
+            self._close(con)
+            self._release_slot()
+            return
+
+        with self._lock:
+            self._idle[database].append((con, time.time()))
+            self._lock.notify()
+
+    def closeall(self):
+        """Close every idle connection, connections in use are closed when they are given back."""
+        with self._lock:
+            self._closed = True
+            for idle in self._idle.values():
+                while idle:
+                    self._close(idle.pop()[0])
+                    self._size -= 1
+            self._lock.notify_all()
+
+    def _connect(self, database):
+        kwargs = dict(self.connect_kwargs)
+        if database is not None:
+            kwargs["dbname"] = database
+        logger.debug("Opening a connection to postgresql database {db}".format(db=kwargs.get("dbname")))
+        return psycopg2.connect(**kwargs)
+
+    @staticmethod
+    def _close(con):
+        try:
+            con.close()
+        except psycopg2.Error as e:
+            logger.debug(e)
+
+    @staticmethod
+    def _is_healthy(con):
+        if con.closed:
+            return False
+        try:
+            with con.cursor() as cur:
+                cur.execute("SELECT 1")
+            con.rollback()
+            return True
+        except psycopg2.Error as e:
+            logger.debug(e)
+            return False
+
+    def _release_slot(self):
+        with self._lock:
+            self._size -= 1
+            self._lock.notify()
+
+    def _evict_idle(self):
+        """Close the connections unused for idle_timeout seconds, keeping minconn connections. Lock held."""
+        limit = time.time() - self.idle_timeout
+        for idle in self._idle.values():
+            # the least recently returned connections are first
+            while idle and idle[0][1] < limit and self._size > self.minconn:
+                self._close(idle.popleft()[0])
+                self._size -= 1
+
+    def _close_other_idle(self, database):
+        """Close an idle connection to another database to make room for database. Lock held."""
+        for other, idle in self._idle.items():
+            if other != database and idle:
+                self._close(idle.popleft()[0])
+                self._size -= 1
+                return True
+        return False
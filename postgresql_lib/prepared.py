@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import re
+import logging
+import itertools
+import collections
+
+import psycopg2
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.prepared")
+
+DEFAULT_SIZE = 100
+
+# statements postgresql can prepare, GRANT and the other utility statements cannot
+_PREPARABLE = {"SELECT", "INSERT", "UPDATE", "DELETE", "VALUES", "WITH"}
+
+# the numbers after them are column positions, not values
+_POSITIONAL = {"ORDER", "GROUP"}
+
+# keywords a string literal value may follow. After any other word, e.g. INTERVAL '1 day' or DATE '2018-01-01', the
+# string belongs to a typed literal, which cannot be a parameter
+_VALUE_KEYWORDS = {"SELECT", "DISTINCT", "ALL", "WHERE", "AND", "OR", "NOT", "LIKE", "ILIKE", "TO", "ESCAPE",
+                   "BETWEEN", "WHEN", "THEN", "ELSE", "FROM", "RETURNING", "HAVING", "ON"}
+
+# integer literals of up to 9 digits fit in an integer: the type postgresql infers for their parameter accepts the
+# other values of the same template. A decimal, e.g. 1.5 after 2, would be cast to the type of the first one.
+_INTEGER = re.compile(r"\d{1,9}$")
+
+_TOKEN = re.compile(
+    r"""(?P<string>'(?:[^']|'')*')"""
+    r"""|(?P<ident>"(?:[^"]|"")*")"""
+    r"""|(?P<comment>--[^\n]*|/\*.*?\*/)"""
+    r"""|(?P<dollar>\$(?:[^\W\d][\w$]*)?\$|\$\d)"""
+    r"""|(?P<word>[^\W\d][\w$]*)"""
+    r"""|(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)""",
+    re.DOTALL
+)
+
+# names of the prepared statements, unique in the process so that pooled connections never see a name twice
+_names = itertools.count(1)
+
+
+def normalize(text):
+    """
+    Split a statement into a template, its literals replaced by $1, $2, ..., and the literals.
+
+    Only the string and integer literals of SELECT, INSERT, UPDATE, DELETE, VALUES and WITH statements are replaced:
+    postgresql infers the type of a parameter from its first statement and casts the next values to it, so the
+    decimal and large numbers, and the strings of typed literals such as INTERVAL '1 day', stay in the template.
+    Statements with dollar quotes, escape or bit strings, or placeholders of their own are not normalised.
+
+    :param text: statement text
+    :return: (template, list of the literals as written in the statement), None if the statement cannot be prepared
+    """
+    literals = []
+    words = set()
+    first = None
+    previous = None
+    for m in _TOKEN.finditer(text):
+        kind = m.lastgroup
+        if kind == "dollar":
+            return None
+        if kind == "word":
+            if text[m.end():m.end() + 1] == "'":
+                # E'...', B'...', X'...': the prefix belongs to the literal
+                return None
+            word = m.group().upper()
+            first = first or word
+            words.add(word)
+        elif kind == "string":
+            if previous is None or previous.lastgroup != "word" or text[previous.end():m.start()].strip() \
+                    or previous.group().upper() in _VALUE_KEYWORDS:
+                literals.append(m)
+        elif kind == "number":
+            if _INTEGER.match(m.group()):
+                literals.append(m)
+        if kind != "comment":
+            previous = m
+    if first not in _PREPARABLE:
+        return None
+    if words & _POSITIONAL:
+        # ORDER BY 1 is not ORDER BY $1, the numbers stay in the text
+        literals = [m for m in literals if m.lastgroup == "string"]
+
+    parts = []
+    pos = 0
+    for n, m in enumerate(literals, 1):
+        parts.append(text[pos:m.start()])
+        parts.append("${n}".format(n=n))
+        pos = m.end()
+    parts.append(text[pos:])
+    return "".join(parts), [m.group() for m in literals]
+
+
+class PreparedStatementCache(object):
+    """
+    Prepared statements of the templates of the statements run on a connection, see normalize.
+
+    A template is prepared the second time it is seen, so statements run once cost no extra round trip; its next
+    occurrences run with EXECUTE and skip the parsing and planning on the server. At most size templates stay
+    prepared, the least recently used one is deallocated to make room for a new one. The templates postgresql
+    refuses to prepare are remembered and run as they are.
+
+    The cache must be used in autocommit mode: a failed PREPARE would abort the current transaction.
+    """
+
+    def __init__(self, cur, size=DEFAULT_SIZE):
+        """
+
+        :param cur: cursor on postgresql, in autocommit mode
+        :param size: maximum number of prepared statements kept on the server
+        """
+        self.cur = cur
+        self.size = size
+        # template -> name of its prepared statement, least recently used first
+        self._prepared = collections.OrderedDict()
+        # templates seen once, not prepared yet
+        self._seen = collections.OrderedDict()
+        # templates postgresql refused to prepare
+        self._refused = collections.OrderedDict()
+        self.prepares = 0
+        self.executions = 0
+        self.evictions = 0
+
+    def query(self, text):
+        """
+        Query to send for a statement, preparing its template if it is seen for the second time.
+
+        :param text: statement text
+        :return: EXECUTE of the prepared template of the statement, or the statement itself
+        """
+        normalized = normalize(text)
+        if normalized is None:
+            return text
+        template, params = normalized
+        if template in self._refused:
+            return text
+
+        name = self._prepared.get(template)
+        if name is not None:
+            self._prepared.move_to_end(template)
+        elif template not in self._seen:
+            _remember(self._seen, template, self.size)
+            return text
+        else:
+            del self._seen[template]
+            name = self._prepare(template)
+            if name is None:
+                return text
+
+        self.executions += 1
+        if not params:
+            return "EXECUTE {name}".format(name=name)
+        return "EXECUTE {name}({params})".format(name=name, params=", ".join(params))
+
+    def close(self):
+        """Deallocate the prepared statements."""
+        while self._prepared:
+            self._deallocate(self._prepared.popitem(last=False)[1])
+        logger.debug("{p} statements prepared, {e} executions, {v} evicted".format(
+            p=self.prepares, e=self.executions, v=self.evictions))
+
+    def _prepare(self, template):
+        if len(self._prepared) >= self.size:
+            self._deallocate(self._prepared.popitem(last=False)[1])
+            self.evictions += 1
+        name = "postgresql_tools_{n}".format(n=next(_names))
+        try:
+            self.cur.execute("PREPARE {name} AS {template}".format(name=name, template=template))
+        except psycopg2.Error as e:
+            logger.debug("Cannot prepare {template}: {e}".format(template=template, e=e))
+            _remember(self._refused, template, self.size)
+            return None
+        self._prepared[template] = name
+        self.prepares += 1
+        return name
+
+    def _deallocate(self, name):
+        try:
+            self.cur.execute("DEALLOCATE {name}".format(name=name))
+        except psycopg2.Error as e:
+            logger.debug("Cannot deallocate {name}: {e}".format(name=name, e=e))
+
+
+def _remember(templates, template, size):
+    """Add a template to a bounded ordered dict, forgetting the oldest one when it is full."""
+    if len(templates) >= size:
+        templates.popitem(last=False)
+    templates[template] = None
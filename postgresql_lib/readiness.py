@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import time
+import socket
+import struct
+import logging
+import subprocess
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.readiness")
+
+# first and longest delay between two checks, in seconds
+DEFAULT_INITIAL_DELAY = 0.005
+DEFAULT_MAX_DELAY = 0.5
+
+# result of probe
+READY = "ready"
+# the server is starting up or shutting down
+STARTING = "starting"
+DOWN = "down"
+
+# seconds given to docker exec on top of the timeout of the checks
+_EXEC_TIMEOUT = 30
+
+_PROTOCOL_VERSION = 196608
+# SQLSTATE cannot_connect_now
+_CANNOT_CONNECT_NOW = "57P03"
+
+
+def delays(initial=DEFAULT_INITIAL_DELAY, maximum=DEFAULT_MAX_DELAY):
+    """
+    Exponential backoff.
+
+    :param initial: first delay, in seconds
+    :param maximum: longest delay, in seconds
+    :return: endless iterator of delays, doubling from initial up to maximum
+    """
+    delay = initial
+    while True:
+        yield delay
+        delay = min(delay * 2, maximum)
+
+
+def wait_until(check, timeout, initial=DEFAULT_INITIAL_DELAY, maximum=DEFAULT_MAX_DELAY, description="condition"):
+    """
+    Call check with exponential backoff until it returns True or the deadline is reached.
+
+    :param check: function without arguments returning True when ready
+    :param timeout: seconds after which the waiting stops
+    :param initial: first delay between two checks, in seconds
+    :param maximum: longest delay between two checks, in seconds
+    :param description: what is waited for, for the logs
+    :return: True if check returned True before the deadline
+    """
+    start = time.time()
+    deadline = start + timeout
+    for delay in delays(initial, maximum):
+        if check():
+            logger.info("{what} after {t:.3f} seconds".format(what=description, t=time.time() - start))
+            return True
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            logger.info("No {what} after {t} seconds".format(what=description, t=timeout))
+            return False
+        time.sleep(min(delay, remaining))
+
+
+def probe(host, port=5432, user="postgres", timeout=1.0):
+    """
+    Check whether postgresql accepts connections, as pg_isready, with a startup message of the wire protocol.
+
+    No credential is needed: the server is ready as soon as it answers with an authentication request.
+
+    :param host: IP/Hostname running postgresql
+    :param port: port of postgresql
+    :param user: user named in the startup message
+    :param timeout: seconds to wait for the connection and the answer
+    :return: READY, STARTING or DOWN
+    """
+    parameters = "user\0{user}\0database\0postgres\0\0".format(user=user).encode("utf-8")
+    startup = struct.pack("!ii", 8 + len(parameters), _PROTOCOL_VERSION) + parameters
+    try:
+        sock = socket.create_connection((host, port), timeout)
+    except (OSError, socket.timeout) as e:
+        logger.debug(e)
+        return DOWN
+    try:
+        sock.sendall(startup)
+        answer = _read_message(sock)
+    except (OSError, socket.timeout) as e:
+        logger.debug(e)
+        return DOWN
+    finally:
+        sock.close()
+
+    if answer is None:
+        return DOWN
+    kind, body = answer
+    if kind == b"E" and _error_code(body) == _CANNOT_CONNECT_NOW:
+        return STARTING
+    # an authentication request, or any other error such as too many connections: the server is up
+    return READY
+
+
+def wait_for_postgresql(host, port=5432, timeout=60, user="postgres"):
+    """
+    Wait until postgresql accepts connections.
+
+    :param host: IP/Hostname running postgresql
+    :param port: port of postgresql
+    :param timeout: seconds after which the waiting stops
+    :param user: user named in the startup message
+    :return: True if postgresql accepts connections before the deadline
+    """
+    return wait_until(lambda: probe(host, port, user) == READY, timeout,
+                      description="postgresql on {host}:{port} ready".format(host=host, port=port))
+
+
+def unit_state(container, unit, docker=None):
+    """
+    State of a systemd unit in a container, used to detect a restart with wait_for_unit.
+
+    :param container: name of the container
+    :param unit: name of the systemd unit
+    :param docker: docker_api.DockerClient, the docker CLI is used if None
+    :return: the ActiveState and ActiveEnterTimestampMonotonic properties, as printed by systemctl show
+    """
+    if docker is not None:
+        return docker.execute(container, _show_command(unit)).stdout.decode("utf-8").strip()
+    return subprocess.check_output(["docker", "exec", container] + _show_command(unit)).decode("utf-8").strip()
+
+
+def wait_for_unit(container, unit, timeout, previous=None, initial=DEFAULT_INITIAL_DELAY,
+                  maximum=DEFAULT_MAX_DELAY, docker=None):
+    """
+    Wait until a systemd unit of a container is active.
+
+    The checks run in a single docker exec, looping inside the container with exponential backoff, instead of one
+    docker exec per check.
+
+    :param container: name of the container
+    :param unit: name of the systemd unit
+    :param timeout: seconds after which the waiting stops
+    :param previous: unit_state before the unit was stopped or killed: an active unit which was not restarted
+        since, e.g. not yet killed, is not ready
+    :param initial: first delay between two checks, in seconds
+    :param maximum: longest delay between two checks, in seconds
+    :param docker: docker_api.DockerClient, the docker CLI is used if None
+    :return: True if the unit is active before the deadline
+    """
+    sleeps = []
+    total = 0
+    for delay in delays(initial, maximum):
+        if total >= timeout:
+            break
+        delay = min(delay, timeout - total)
+        sleeps.append("{d:g}".format(d=delay))
+        total += delay
+
+    check = '[ "${s#*ActiveState=active}" != "$s" ] && [ "$s" != "$previous" ] && exit 0'
+    script = ('previous="$1"; for d in {sleeps}; do s="$({show})"; {check}; sleep $d; done; '
+              's="$({show})"; {check}; exit 1').format(sleeps=" ".join(sleeps), show=" ".join(_show_command(unit)),
+                                                       check=check)
+    command = ["sh", "-c", script, "sh", previous or ""]
+    start = time.time()
+    try:
+        if docker is not None:
+            ready = docker.execute(container, command, timeout=timeout + _EXEC_TIMEOUT).exit_code == 0
+        else:
+            ready = subprocess.call(["docker", "exec", container] + command, timeout=timeout + _EXEC_TIMEOUT) == 0
+    except (subprocess.TimeoutExpired, socket.timeout) as e:
+        logger.debug(e)
+        ready = False
+    logger.info("{unit} {state} after {t:.3f} seconds".format(unit=unit, state="active" if ready else "not active",
+                                                              t=time.time() - start))
+    return ready
+
+
+def _show_command(unit):
+    return ["systemctl", "show", "-p", "ActiveState", "-p", "ActiveEnterTimestampMonotonic", unit]
+
+
+def _read_message(sock):
+    """
+    Read the first message sent by the server.
+
+    :return: (type byte, body) or None if the connection was closed
+    """
+    header = _read_exactly(sock, 5)
+    if header is None:
+        return None
+    kind, length = struct.unpack("!ci", header)
+    body = _read_exactly(sock, length - 4)
+    return kind, body if body is not None else b""
+
+
+def _read_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def _error_code(body):
+    """SQLSTATE of an ErrorResponse body, made of fields: a type byte followed by a null terminated string."""
+    for field in body.split(b"\0"):
+        if field[:1] == b"C":
+            return field[1:].decode("ascii", "replace")
+    return None
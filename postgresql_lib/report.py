@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import json
+import heapq
+import logging
+import collections
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.report")
+
+DEFAULT_SLOWEST = 10
+
+# characters of a query shown in the summary
+_SUMMARY_WIDTH = 80
+
+
+def records(transcript, script=None):
+    """
+    Flatten a transcript into report records.
+
+    :param transcript: transcript returned by PostgresqlScriptExecutor.run
+    :param script: name of the script, added to each record if not None
+    :return: iterator of ordered dicts {"script": ..., "counter": ..., "command": ..., "status": ..., ...}
+    """
+    for counter, entry in transcript.items():
+        yield record(counter, entry, script)
+
+
+def rollback_name(script):
+    """
+    :param script: name of a script
+    :return: name of its rollback script in the report records, as the rollback script files are named
+    """
+    return "{script}.rollback".format(script=script)
+
+
+def record(counter, entry, script=None):
+    """
+    Report record of a transcript entry, e.g. from the sink of PostgresqlScriptExecutor.run.
+
+    :param counter: counter of the query in the transcript
+    :param entry: transcript entry of the query
+    :param script: name of the script, added to the record if not None
+    :return: ordered dict {"script": ..., "counter": ..., "command": ..., "status": ..., ...}
+    """
+    res = collections.OrderedDict()
+    if script is not None:
+        res["script"] = script
+    res["counter"] = counter
+    res.update(entry)
+    return res
+
+
+def write_report(f, entries):
+    """
+    Write report records as JSON Lines, one json object per line.
+
+    :param f: file object opened in text mode
+    :param entries: iterator of records, see records
+    """
+    for record in entries:
+        f.write(json.dumps(record))
+        f.write("\n")
+
+
+def slowest(entries, count=DEFAULT_SLOWEST):
+    """
+    Find the slowest queries.
+
+    :param entries: iterator of records, see records
+    :param count: number of queries returned
+    :return: list of the count records with the longest duration, slowest first
+    """
+    return heapq.nlargest(count, (record for record in entries if "duration" in record),
+                          key=lambda record: record["duration"])
+
+
+def summary(entries, count=DEFAULT_SLOWEST):
+    """
+    Describe the slowest queries.
+
+    :param entries: iterator of records, see records
+    :param count: number of queries listed
+    :return: list of lines
+    """
+    res = Summary(count)
+    for record in entries:
+        res.add(record)
+    return res.lines()
+
+
+class Summary(object):
+    """
+    Running summary of the queries: only the count slowest records are kept, so records can be added as the queries
+    are executed without keeping the transcript.
+    """
+
+    def __init__(self, count=DEFAULT_SLOWEST):
+        """
+
+        :param count: number of queries listed
+        """
+        self.count = count
+        self.queries = 0
+        self.total = 0.0
+        # min-heap of (duration, order, record) of the slowest records
+        self._slowest = []
+
+    def add(self, record):
+        """
+        Add a record, see records.
+
+        :param record: report record, skipped if its query failed
+        """
+        if "duration" not in record:
+            return
+        self.queries += 1
+        self.total += record["duration"]
+        item = (record["duration"], -self.queries, record)
+        if len(self._slowest) < self.count:
+            heapq.heappush(self._slowest, item)
+        elif self.count > 0 and item[:2] > self._slowest[0][:2]:
+            heapq.heapreplace(self._slowest, item)
+
+    def lines(self):
+        """
+        :return: list of lines describing the slowest queries, slowest first
+        """
+        lines = ["{n} queries in {total:.3f}s, slowest:".format(n=self.queries, total=self.total)]
+        for duration, order, record in sorted(self._slowest, key=lambda item: item[:2], reverse=True):
+            command = " ".join(record["command"].split())
+            if len(command) > _SUMMARY_WIDTH:
+                command = command[:_SUMMARY_WIDTH - 3] + "..."
+            lines.append("{duration:9.3f}s (server {server:.3f}s){batched} {where}#{counter} {command}".format(
+                duration=record["duration"],
+                server=record.get("server_duration", record["duration"]),
+                batched=" in a batch of {n}".format(n=record["batched"]) if "batched" in record else "",
+                where="{script} ".format(script=record["script"]) if "script" in record else "",
+                counter=record["counter"],
+                command=command
+            ))
+        return lines
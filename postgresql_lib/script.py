@@ -14,11 +14,19 @@
 # DEALINGS IN THE SOFTWARE.
 #
 
+import time
 import logging
-import collections
 
+import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 
+from postgresql_lib import bulk
+from postgresql_lib import cache as pgcache
+from postgresql_lib import splitter
+from postgresql_lib import locks as pglocks
+from postgresql_lib import prepared as pgprepared
+from postgresql_lib import transcript as pgtranscript
+
 # logging
 logging.basicConfig(
     format='%(asctime)s %'
@@ -27,35 +35,492 @@ logging.basicConfig(
 )
 logger = logging.getLogger("postgres_tools.postgresql_lib.script")
 
+# upper bound of the size of the queries sent in one round trip when batching
+DEFAULT_BATCH_BYTES = 1024 * 1024
+
+# number of empty queries sent to measure the network round trip
+RTT_PROBES = 3
+
+# name of the savepoint set before each batch in transactional mode
+_SAVEPOINT = "postgresql_tools_block"
+
+
+class ScriptExecutionError(Exception):
+    """Failure of a script, with the queries executed before it."""
+
+    def __init__(self, message, transcript=None, committed=True):
+        """
+
+        :param message: description of the failure
+        :param transcript: transcript of the queries executed before the failure
+        :param committed: False when the failure left no change behind, so no rollback script is needed
+        """
+        super(ScriptExecutionError, self).__init__(message)
+        self.transcript = transcript
+        self.committed = committed
+
+
 class PostgresqlScriptExecutor(object):
     @staticmethod
-    def run(con, script):
+    def run(con, script, chunk_size=splitter.DEFAULT_CHUNK_SIZE, batch_size=1, batch_bytes=DEFAULT_BATCH_BYTES,
+            insert_rows=1, transactional=False, ledger=None, prepared=0, sink=None, retain=True, lock_timeout=None,
+            statement_timeout=None, lock_retries=pglocks.DEFAULT_RETRIES, statement_cache=None, metrics=None,
+            hooks=None, script_name=None, measure_rtt=False):
         """
 
         :param con: connection to postgresql
-        :param script: list of queries to execute
-        :param rollback_script: list of queries to execute for rollback
-        :return: transcript of the executed queries
+        :param script: queries to execute, either a string, a bytes buffer encoded in utf-8, e.g. a file mapped with
+            splitter.map_file, or a file object opened in text mode
+        :param chunk_size: number of characters read at once when the script is a file object
+        :param batch_size: maximum number of queries sent in one round trip, 1 disables batching
+        :param batch_bytes: maximum size of the queries sent in one round trip
+        :param insert_rows: maximum number of consecutive single row INSERT of constants into the same table sent
+            as one multi-row INSERT, 1 disables the grouping, see bulk.coalesce_inserts
+        :param transactional: run the script in a single transaction, rolled back if a query fails. The queries
+            which cannot run inside a transaction block, e.g. CREATE DATABASE or VACUUM, commit the queries before
+            them and run in autocommit mode.
+        :param ledger: ledger.MigrationLedger recording the applied queries, the queries already applied are skipped
+        :param script_name: name of the script in the ledger, e.g. its path, identifying it across its versions
+        :param prepared: number of statement templates kept prepared, 0 disables the preparation. The string and
+            number literals of the DML queries are replaced by parameters, the templates seen twice are prepared and
+            their next occurrences run with EXECUTE, see prepared.PreparedStatementCache. Only the queries executed
+            one by one in autocommit mode, i.e. when batch_size is 1 and transactional is False, are prepared.
+        :param sink: function called with the counter and the entry of each query once executed, e.g. to write a
+            report while the script runs, see transcript.Transcript
+        :param retain: keep the entries passed to the sink in the transcript returned. With a ledger, the entries
+            are kept until recorded.
+        :param lock_timeout: maximum wait of each query for a lock, in milliseconds or as a postgresql duration,
+            e.g. "2s". A query waiting for a lock blocks every later query on the same table, e.g. from the live
+            traffic: with a lock_timeout it gives up and is retried after a jittered exponential backoff, see
+            locks.LockRetry. In transactional mode, each query retried is preceded by a savepoint.
+        :param statement_timeout: maximum duration of each query, in milliseconds or as a postgresql duration
+        :param lock_retries: maximum number of retries of a query failing on lock_timeout, 0 disables the retries
+        :param statement_cache: cache.StatementCache of the parsed scripts, a script already parsed is not scanned
+            again
+        :param metrics: metrics.MetricsRegistry counting the queries, their duration and size, and the failure of the
+            script by sqlstate
+        :param hooks: tracing.StatementHooks called before and after each query, e.g. tracing.SpanEmitter. Without
+            hooks, the executor only tests that they are None.
+        :param measure_rtt: measure the network round trip with a few empty queries before the script, to report the
+            time spent by postgresql on each query as its server_duration. Off by default: the probes would cost
+            more than a short script, e.g. a template run once per row.
+        :return: transcript.Transcript of the executed queries, mapping 1, 2, ... to {"command": ..., "status": ...,
+            "duration": ..., "rowcount": ..., "bytes": ...}, "server_duration": ... with measure_rtt, and
+            "retries": ..., "lock_wait": ... for the queries retried
+        :raise ScriptExecutionError: if a query fails
         """
-        res = collections.OrderedDict()
-        counter = 0
+        res = pgtranscript.Transcript(script, sink, retain, metrics, hooks)
+        # restored once the script is executed, e.g. for a connection given back to a pool
+        previous = (con.isolation_level, con.autocommit)
         con.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        # in autocommit mode, every query executed before a failure stays applied
+        committed = not transactional
+        retry = pglocks.LockRetry(lock_retries) if lock_timeout is not None and lock_retries > 0 else None
+        timeouts = None
         try:
+            if lock_timeout is not None or statement_timeout is not None:
+                with con.cursor() as cur:
+                    timeouts = pglocks.set_timeouts(cur, lock_timeout, statement_timeout)
+            if transactional:
+                con.autocommit = False
             with con:
                 with con.cursor() as cur:
-                    # execute the sql script query by query
-                    list_commands = script.split(";\n")
-                    for command in list_commands:
-                        if command and not command.isspace():
-                            counter += 1
-                            res[counter] = {}
-                            res[counter]["command"] = "{command}".format(command=command)
-                            cur.execute(command)
-                            logger.info(command)
-                            res[counter]["status"] = "{status}".format(status=cur.statusmessage)
+                    start = time.time()
+                    ledger_run = None
+                    if ledger is not None:
+                        ledger_run = ledger.start(cur, script, script_name)
+                        if ledger_run.done:
+                            logger.info("Script already applied, skipping it")
+                            return res
+                        res.hold = True
+
+                    if measure_rtt:
+                        res.rtt = _round_trip(cur)
+
+                    # execute the sql script query by query, as they are read
+                    if statement_cache is not None:
+                        statements = statement_cache.iter_statements(script, chunk_size)
+                    else:
+                        statements = splitter.iter_statements(script, chunk_size)
+                    if ledger_run is not None:
+                        statements = ledger_run.filter(statements)
+                    if insert_rows > 1:
+                        statements = bulk.coalesce_inserts(statements, insert_rows)
+                    cache = None
+                    if prepared > 0:
+                        if transactional or batch_size > 1:
+                            logger.warning("Prepared statements are only used for queries executed one by one in "
+                                           "autocommit mode")
+                        else:
+                            cache = pgprepared.PreparedStatementCache(cur, prepared)
+                    try:
+                        if transactional:
+                            for batch in batches(statements, batch_size, batch_bytes):
+                                if _execute_in_transaction(con, cur, batch, res, ledger_run, retry):
+                                    committed = True
+                        elif batch_size > 1:
+                            for batch in batches(statements, batch_size, batch_bytes):
+                                _execute_batch(cur, batch, res, retry=retry)
+                        else:
+                            for statement in statements:
+                                _execute(cur, statement, res, cache=cache, retry=retry)
+                    except Exception as e:
+                        res.fail(e)
+                        if ledger_run is not None and not transactional:
+                            # the queries executed before the failure stay applied
+                            _flush_ledger(cur, res, ledger_run)
+                        raise
+                    finally:
+                        res.close()
+                        if cache is not None:
+                            cache.close()
+
+                    if ledger_run is not None:
+                        ledger_run.finish(cur, res, time.time() - start)
             con.commit()
         except Exception as e:
-            raise Exception("Unexpected failure when executing the script: {e}".format(e=e))
+            if metrics is not None:
+                # the transaction block of a transactional script is rolled back by postgresql, unless a query which
+                # cannot run inside a transaction committed it
+                metrics.observe_failure(e, not committed)
+            raise ScriptExecutionError("Unexpected failure when executing the script: {e}".format(e=e), res,
+                                       committed)
+        finally:
+            if timeouts is not None:
+                pglocks.restore_timeouts(con, timeouts)
+            _restore_session(con, previous)
 
         return res
 
+    @staticmethod
+    def run_file(con, path, **options):
+        """
+        Run a script file mapped in memory: its statements are located in the page cache and only decoded when they
+        are sent, so a large script starts executing at once without being copied in the heap.
+
+        :param con: connection to postgresql
+        :param path: path of the script, encoded in utf-8
+        :param options: keyword arguments of run, e.g. batch_size
+        :return: transcript of the executed queries, its commands are read from the mapped file
+        """
+        return PostgresqlScriptExecutor.run(con, splitter.map_file(path), **options)
+
+    @staticmethod
+    def run_pooled(pool, script, database=None, **options):
+        """
+        Run a script on a connection borrowed from a pool.
+
+        :param pool: pool.ConnectionPool
+        :param script: queries to execute, either a string or a file object opened in text mode
+        :param database: database to connect to, defaults to the database of the pool
+        :param options: keyword arguments of run, e.g. batch_size
+        :return: transcript of the executed queries
+        """
+        with pool.connection(database) as con:
+            return PostgresqlScriptExecutor.run(con, script, **options)
+
+
+def _execute(cur, statement, res, savepoint=False, cache=None, retry=None):
+    """
+    Execute a single query and add it to the transcript.
+
+    :param cur: cursor on postgresql
+    :param statement: splitter.Statement or bulk.InsertGroup to execute
+    :param res: transcript of the executed queries
+    :param savepoint: set a savepoint before a bulk.InsertGroup, see _execute_batch, or before a query which may be
+        retried
+    :param cache: prepared.PreparedStatementCache running the query with EXECUTE when its template is prepared
+    :param retry: locks.LockRetry retrying the query when it fails on lock timeout. COPY ... FROM STDIN is not
+        retried, its inline data is read as it is sent.
+    """
+    if isinstance(statement, bulk.InsertGroup):
+        _execute_insert_group(cur, statement, res, savepoint, retry)
+        return
+
+    command = statement.text
+    counter = res.add(statement)
+    if statement.copy_data is None and retry is not None:
+        _execute_retried(cur, statement, res, counter, savepoint, cache, retry)
+        return
+    start = time.time()
+    if statement.copy_data is not None:
+        # stream the inline data of COPY ... FROM STDIN, psycopg2 reports no status message for it
+        cur.copy_expert(command, statement.copy_data)
+        duration = time.time() - start
+        logger.info(command)
+        res.complete(counter, "COPY {rows}".format(rows=cur.rowcount), duration, cur.rowcount,
+                     query_size(command) + statement.copy_data.size)
+        return
+    query = cache.query(command) if cache is not None else command
+    cur.execute(query)
+    duration = time.time() - start
+    logger.info(command)
+    res.complete(counter, cur.statusmessage, duration, cur.rowcount, query_size(query))
+
+
+def _execute_retried(cur, statement, res, counter, savepoint, cache, retry):
+    """
+    Execute a query added to the transcript, retrying it while it fails on lock timeout.
+
+    :param cur: cursor on postgresql
+    :param statement: splitter.Statement to execute
+    :param res: transcript of the executed queries
+    :param counter: counter of the query in the transcript
+    :param savepoint: set a savepoint before the query and roll back to it before a retry, needed inside a
+        transaction block
+    :param cache: prepared.PreparedStatementCache, see _execute
+    :param retry: locks.LockRetry
+    """
+    command = statement.text
+    query = cache.query(command) if cache is not None else command
+    attempt = 0
+    first = time.time()
+    while True:
+        start = time.time()
+        try:
+            cur.execute(_with_savepoint(query) if savepoint else query)
+            break
+        except psycopg2.Error as e:
+            if savepoint:
+                cur.execute("ROLLBACK TO SAVEPOINT {name}".format(name=_SAVEPOINT))
+            if not retry.backoff(attempt, e):
+                raise
+            attempt += 1
+    duration = time.time() - start
+    logger.info(command)
+    res.complete(counter, cur.statusmessage, duration, cur.rowcount, query_size(query), retries=attempt,
+                 waited=start - first)
+
+
+def batches(statements, batch_size, batch_bytes):
+    """
+    Group consecutive statements which can be sent together in one round trip.
+
+    A batch runs in a single implicit transaction, so statements refused inside a transaction block are sent alone.
+    Postgresql only reports the status of the last query of a batch: every other query of the batch must have a
+    command tag known in advance, see classifier.command_tag. Both are known beforehand for the statements of a
+    cache.StatementCache.
+
+    :param statements: iterator of splitter.Statement and bulk.InsertGroup
+    :param batch_size: maximum number of statements per batch
+    :param batch_bytes: maximum size of the statements of a batch
+    :return: iterator of lists of (statement, command tag)
+    """
+    batch = []
+    size = 0
+    for statement in statements:
+        if isinstance(statement, bulk.InsertGroup) or statement.copy_data is not None \
+                or not pgcache.is_transaction_safe(statement):
+            if batch:
+                yield batch
+                batch = []
+                size = 0
+            yield [(statement, None)]
+            continue
+
+        tag = pgcache.command_tag(statement)
+        batch.append((statement, tag))
+        size += len(statement.text)
+        if tag is None or len(batch) >= batch_size or size >= batch_bytes:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+
+def _execute_in_transaction(con, cur, batch, res, ledger_run=None, retry=None):
+    """
+    Execute a batch of queries inside the transaction of the script.
+
+    A query which cannot run inside a transaction block commits the transaction and runs in autocommit mode, the
+    next queries start a new transaction.
+
+    :param con: connection to postgresql, not in autocommit mode
+    :param cur: cursor on postgresql
+    :param batch: list of (statement, command tag) built by batches
+    :param res: transcript of the executed queries
+    :param ledger_run: ledger.LedgerRun of the script, its queries are recorded in the committed transaction
+    :param retry: locks.LockRetry retrying the queries failing on lock timeout, from a savepoint
+    :return: True if the transaction was committed
+    """
+    statement = batch[0][0]
+    if len(batch) > 1 or isinstance(statement, bulk.InsertGroup) or statement.copy_data is not None \
+            or pgcache.is_transaction_safe(statement):
+        _execute_batch(cur, batch, res, savepoint=True, retry=retry)
+        return False
+
+    logger.info("Committing the queries executed so far, {command} cannot run inside a transaction".format(
+        command=statement.text))
+    if ledger_run is not None:
+        ledger_run.flush(cur, res)
+    con.commit()
+    con.autocommit = True
+    try:
+        _execute(cur, statement, res, retry=retry)
+    finally:
+        if ledger_run is not None:
+            # recorded in autocommit mode, as the query itself
+            _flush_ledger(cur, res, ledger_run)
+        con.autocommit = False
+    return True
+
+
+def _restore_session(con, previous):
+    """
+    Restore the transaction settings a connection had before run set them, outside of a transaction.
+
+    :param con: connection to postgresql
+    :param previous: (isolation level, autocommit) of the connection before the script
+    """
+    try:
+        con.isolation_level, con.autocommit = previous
+    except psycopg2.Error as e:
+        logger.debug("Cannot restore the transaction settings of the connection: {e}".format(e=e))
+
+
+def _flush_ledger(cur, res, ledger_run):
+    """Record the queries applied before a failure, without hiding the failure."""
+    try:
+        ledger_run.flush(cur, res)
+    except psycopg2.Error as e:
+        logger.debug("Cannot record the applied queries in the ledger: {e}".format(e=e))
+
+
+def _execute_batch(cur, batch, res, savepoint=False, retry=None):
+    """
+    Execute a batch of queries in one round trip and add them to the transcript.
+
+    If the batch fails, none of its queries was applied and they are replayed one by one, so the transcript and the
+    error are the same as without batching.
+
+    :param cur: cursor on postgresql
+    :param batch: list of (statement, command tag) built by batches
+    :param res: transcript of the executed queries
+    :param savepoint: set a savepoint before the batch, in the same round trip, and roll back to it before
+        replaying the queries. Needed inside a transaction block, which a failed query aborts.
+    :param retry: locks.LockRetry retrying the queries failing on lock timeout, once replayed one by one
+    """
+    if len(batch) == 1:
+        _execute(cur, batch[0][0], res, savepoint, retry=retry)
+        return
+
+    query = batch_query(batch)
+    start = time.time()
+    try:
+        cur.execute(_with_savepoint(query) if savepoint else query)
+    except psycopg2.Error as e:
+        if savepoint:
+            cur.execute("ROLLBACK TO SAVEPOINT {name}".format(name=_SAVEPOINT))
+        logger.debug("Batch of {n} queries failed, replaying them one by one: {e}".format(n=len(batch), e=e))
+        for statement, tag in batch:
+            _execute(cur, statement, res, savepoint, retry=retry)
+        return
+
+    complete_batch(cur, batch, res, time.time() - start)
+
+
+def _execute_insert_group(cur, group, res, savepoint=False, retry=None):
+    """
+    Execute a group of single row INSERT as one multi-row INSERT and add each of them to the transcript.
+
+    If the multi-row INSERT fails, none of its rows was inserted and the statements are replayed one by one, so the
+    transcript and the error are the same as without grouping.
+
+    :param cur: cursor on postgresql
+    :param group: bulk.InsertGroup to execute
+    :param res: transcript of the executed queries
+    :param savepoint: set a savepoint before the INSERT, see _execute_batch
+    :param retry: locks.LockRetry retrying the statements failing on lock timeout, once replayed one by one
+    """
+    start = time.time()
+    try:
+        cur.execute(_with_savepoint(group.text) if savepoint else group.text)
+    except psycopg2.Error as e:
+        if savepoint:
+            cur.execute("ROLLBACK TO SAVEPOINT {name}".format(name=_SAVEPOINT))
+        logger.debug("INSERT of {n} rows failed, replaying them one by one: {e}".format(n=len(group.rows), e=e))
+        for statement in group.statements:
+            _execute(cur, statement, res, savepoint, retry=retry)
+        return
+
+    complete_insert_group(cur, group, res, time.time() - start)
+
+
+def _with_savepoint(query):
+    """Prefix a query with a savepoint, the status message stays the one of the query."""
+    return "SAVEPOINT {name}\n;\n{query}".format(name=_SAVEPOINT, query=query)
+
+
+def batch_query(batch):
+    """
+    :param batch: list of (statement, command tag) built by batches
+    :return: the queries of the batch, sent in one round trip
+    """
+    # a newline before the separator keeps it out of a trailing -- comment
+    return "\n;\n".join(statement.text for statement, tag in batch)
+
+
+def complete_batch(cur, batch, res, duration):
+    """
+    Add the queries of a batch executed in one round trip to the transcript, also used by the asyncio executor.
+
+    :param cur: cursor which executed the batch
+    :param batch: list of (statement, command tag) built by batches
+    :param res: transcript of the executed queries
+    :param duration: seconds spent executing the batch
+    """
+    last = len(batch) - 1
+    for i, (statement, tag) in enumerate(batch):
+        command = statement.text
+        counter = res.add(statement)
+        logger.info(command)
+        if i < last:
+            # postgresql only reports the row count of the last query
+            res.complete(counter, tag, duration, -1, query_size(command), len(batch))
+        else:
+            res.complete(counter, cur.statusmessage, duration, cur.rowcount, query_size(command), len(batch))
+
+
+def complete_insert_group(cur, group, res, duration):
+    """
+    Add the statements of a group executed as one multi-row INSERT to the transcript, also used by the asyncio
+    executor.
+
+    :param cur: cursor which executed the INSERT
+    :param group: bulk.InsertGroup
+    :param res: transcript of the executed queries
+    :param duration: seconds spent executing the INSERT
+    """
+    if cur.rowcount == len(group.statements):
+        status = "INSERT 0 1"
+        rowcount = 1
+    else:
+        # e.g. a trigger skipped rows, the count of a single statement is unknown
+        status = cur.statusmessage
+        rowcount = -1
+    for statement in group.statements:
+        counter = res.add(statement)
+        logger.info(statement.text)
+        res.complete(counter, status, duration, rowcount, query_size(statement.text), len(group.statements))
+
+
+def query_size(command):
+    """Number of bytes sent for a query."""
+    return len(command.encode("utf-8"))
+
+
+def _round_trip(cur):
+    """
+    Measure the network round trip to postgresql.
+
+    :param cur: cursor on postgresql
+    :return: shortest duration of an empty query, in seconds
+    """
+    durations = []
+    for _ in range(RTT_PROBES):
+        start = time.time()
+        cur.execute("SELECT 1")
+        durations.append(time.time() - start)
+    return min(durations)
+
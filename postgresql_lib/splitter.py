@@ -0,0 +1,566 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import re
+import mmap
+import logging
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.splitter")
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class _Syntax(object):
+    """
+    Patterns and symbols of the lexer, for scripts in strings or in bytes buffers.
+
+    In a bytes buffer the script is utf-8: the bytes of a multi-byte character are never ascii, so the lexer does
+    not need to decode the script and the bytes >= 0x80 are letters of identifiers and dollar quote tags.
+    """
+
+    def __init__(self, kind):
+        """
+
+        :param kind: str or bytes
+        """
+        def symbol(text):
+            return text.encode("ascii") if kind is bytes else text
+
+        def pattern(text, flags=0):
+            return re.compile(symbol(text), flags)
+
+        if kind is bytes:
+            letter, word = r"(?:[^\W\d]|[\x80-\xff])", r"[\w\x80-\xff]"
+        else:
+            letter, word = r"[^\W\d]", r"\w"
+
+        # characters that may change the lexer state outside of quotes and comments
+        self.special = pattern(r"""[;'"$()]|--|/\*|(?<!{word}|\$)[eE]'""".format(word=word))
+        self.dollar_tag = pattern(r"\$(?:{letter}{word}*)?\$".format(letter=letter, word=word))
+        self.dollar_partial = pattern(r"\$(?:{letter}{word}*)?\Z".format(letter=letter, word=word))
+        self.identifier = pattern(r"{word}|\$".format(word=word))
+        self.block_comment = pattern(r"/\*|\*/")
+        self.escape_string = pattern(r"[\\']")
+        self.non_space = pattern(r"\S")
+        # matched at the start of a statement
+        self.copy_from_stdin = pattern(r"COPY\b.*\bFROM\s+STDIN\b", re.IGNORECASE | re.DOTALL)
+        self.newline = symbol("\n")
+        self.backslash = symbol("\\")
+        self.quote = symbol("'")
+        self.double_quote = symbol('"')
+        self.end_marker = symbol("\\.")
+        self.comment_start = symbol("/*")
+        self.empty = symbol("")
+
+
+_TEXT = _Syntax(str)
+_BYTES = _Syntax(bytes)
+
+
+class Statement(object):
+    """
+    One sql statement of a script, with its position in the source.
+
+    For a COPY ... FROM STDIN statement followed by inline data, as written by pg_dump, copy_data is a file object
+    streaming the data lines, up to the \\. end marker. It must be read before the next statement is requested,
+    the data left unread is skipped.
+    """
+
+    __slots__ = ("offset", "text", "copy_data")
+
+    def __init__(self, offset, text, copy_data=None):
+        self.offset = offset
+        self.text = text
+        self.copy_data = copy_data
+
+    def __repr__(self):
+        return "Statement(offset={offset}, text={text!r})".format(offset=self.offset, text=self.text)
+
+
+class BufferStatement(Statement):
+    """
+    Statement of a script in a bytes buffer, e.g. a file mapped with map_file.
+
+    The statement is only located in the buffer, by its byte offset and end; its text is decoded from the buffer the
+    first time it is used, usually when it is sent to postgresql.
+    """
+
+    __slots__ = ("buffer", "end", "_text")
+
+    def __init__(self, buffer, offset, end, copy_data=None):
+        self.buffer = buffer
+        self.offset = offset
+        self.end = end
+        self.copy_data = copy_data
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = self.buffer[self.offset:self.end].decode("utf-8")
+        return self._text
+
+
+class CopyData(object):
+    """
+    File object reading the inline data of a COPY ... FROM STDIN statement from the script, as str or as bytes for a
+    script in a bytes buffer.
+    """
+
+    def __init__(self, split):
+        self._split = split
+        self._syntax = split._syntax
+        self._done = False
+        # number of characters read
+        self.size = 0
+        # True when the next character read starts a line
+        self._bol = True
+        split._skip_copy_line()
+        # offsets of the data in the source, end is known once the end marker is reached
+        self.start = split._base + split._start
+        self.end = None
+
+    def read(self, size=-1):
+        """
+
+        :param size: maximum number of characters returned, all the data left if negative
+        :return: the next characters of the data, an empty string when the end marker is reached
+        """
+        if size is None or size < 0:
+            chunks = []
+            while True:
+                chunk = self.read(DEFAULT_CHUNK_SIZE)
+                if not chunk:
+                    return self._syntax.empty.join(chunks)
+                chunks.append(chunk)
+        if self._done:
+            return self._syntax.empty
+        data = self._split._read_copy_data(size, self._bol)
+        if data is None:
+            self._done = True
+            self.end = self._split._copy_end
+            return self._syntax.empty
+        self._bol = data.endswith(self._syntax.newline)
+        self.size += len(data)
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+    def drain(self):
+        """Skip the data left unread."""
+        while self.read(DEFAULT_CHUNK_SIZE):
+            pass
+
+
+class CopyRange(object):
+    """
+    File object reading the inline COPY data of a statement from a script in memory, once its offsets are known, see
+    CopyData.
+    """
+
+    def __init__(self, source, start, end):
+        """
+
+        :param source: the script, a string or a bytes buffer
+        :param start: offset of the data in the script
+        :param end: offset of the end marker line
+        """
+        self._source = source
+        self._pos = start
+        self.start = start
+        self.end = end
+        # number of characters read
+        self.size = 0
+
+    def read(self, size=-1):
+        end = self.end if size is None or size < 0 else min(self.end, self._pos + size)
+        data = self._source[self._pos:end]
+        self._pos = end
+        self.size += len(data)
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+    def drain(self):
+        self._pos = self.end
+
+
+class StatementSplitter(object):
+    """
+    Incremental lexer cutting a sql script into statements.
+
+    The source is read by chunks of chunk_size characters and only the statement being scanned is kept in memory,
+    so the memory used does not depend on the size of the script. Semicolons inside quoted strings, quoted
+    identifiers, E'' escape strings, $tag$ dollar quoted bodies, parentheses and -- or /* */ comments do not end a
+    statement. Comments preceding a statement and empty statements are dropped.
+
+    As in psql, a semicolon inside parentheses does not end a statement, e.g. in CREATE RULE ... DO (...; ...): a
+    script ending inside parentheses raises an exception naming the unbalanced parenthesis, instead of sending the
+    statements after it as one.
+    """
+
+    def __init__(self, source, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+
+        :param source: the script, either a string, a bytes buffer encoded in utf-8, e.g. a file mapped with
+            map_file, or a file object opened in text mode
+        :param chunk_size: number of characters read from the file object at once
+        """
+        self._syntax = _TEXT
+        if isinstance(source, str):
+            self._read = None
+            self._buf = source
+            self._eof = True
+        elif is_buffer(source):
+            # the statements are emitted as BufferStatement, with offsets in bytes
+            self._syntax = _BYTES
+            self._read = None
+            self._buf = source
+            self._eof = True
+        else:
+            self._read = source.read
+            self._buf = ""
+            self._eof = False
+        self._chunk_size = chunk_size
+        # offset of self._buf[0] in the source
+        self._base = 0
+        # start of the statement being scanned in self._buf
+        self._start = 0
+        # offset in the source of the end of the last COPY data read
+        self._copy_end = None
+
+    def __iter__(self):
+        return self._statements()
+
+    def _fill(self):
+        """
+        Append a chunk of the source to the buffer, dropping the statements already emitted.
+
+        :return: the number of characters dropped from the head of the buffer
+        """
+        chunk = self._read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return 0
+        shift = self._start
+        self._buf = self._buf[shift:] + chunk
+        self._base += shift
+        self._start = 0
+        return shift
+
+    def _statements(self):
+        syntax = self._syntax
+        pos = 0
+        depth = 0
+        # offset in the source of the outermost parenthesis left open
+        opened = None
+        started = False
+
+        while True:
+            buf = self._buf
+            m = syntax.special.search(buf, pos)
+            if m is None:
+                if self._eof:
+                    break
+                # the last character may be the first half of "--", "/*" or "E'"
+                pos = max(pos, len(buf) - 1) - self._fill()
+                continue
+
+            i = m.start()
+            token = m.group()
+            if syntax is _BYTES:
+                token = token.decode("ascii")
+            if not started and i > self._start and syntax.non_space.search(buf, self._start, i):
+                started = True
+
+            if token == ";":
+                if depth == 0:
+                    if started:
+                        statement = self._emit(i)
+                        self._start = i + 1
+                        if syntax.copy_from_stdin.match(buf, statement.offset - self._base, i):
+                            statement.copy_data = CopyData(self)
+                            yield statement
+                            statement.copy_data.drain()
+                        else:
+                            yield statement
+                    else:
+                        self._start = i + 1
+                    pos = self._start
+                    started = False
+                else:
+                    pos = i + 1
+                continue
+
+            if token == "(":
+                if depth == 0:
+                    opened = self._base + i
+                depth += 1
+                pos = i + 1
+            elif token == ")":
+                depth = max(depth - 1, 0)
+                pos = i + 1
+            elif token == "'":
+                pos = self._skip_quoted(i + 1, syntax.quote)
+            elif token == '"':
+                pos = self._skip_quoted(i + 1, syntax.double_quote)
+            elif token == "--":
+                pos = self._skip_line_comment(i + 2)
+            elif token == "/*":
+                pos = self._skip_block_comment(i + 2)
+            elif token == "$":
+                pos = self._skip_dollar_quoted(i)
+            else:
+                pos = self._skip_escape_string(i + 2)
+
+            if token in ("--", "/*") and not started:
+                # drop comments preceding a statement
+                self._start = pos
+            elif token not in ("--", "/*"):
+                started = True
+
+        if depth > 0:
+            raise Exception("Unbalanced parenthesis at offset {opened}, the statement starting at offset {start} "
+                            "is not closed at the end of the script".format(opened=opened,
+                                                                            start=self._base + self._start))
+        if started or syntax.non_space.search(self._buf, self._start):
+            yield self._emit(len(self._buf))
+
+    def _emit(self, end):
+        """
+        Build the statement spanning self._buf[self._start:end].
+
+        :param end: index of the terminating semicolon, or of the end of the buffer
+        :return: the statement, stripped of surrounding whitespace
+        """
+        buf = self._buf
+        start = self._syntax.non_space.search(buf, self._start, end).start()
+        while buf[end - 1:end].isspace():
+            end -= 1
+        if self._syntax is _BYTES:
+            return BufferStatement(buf, start, end)
+        return Statement(self._base + start, buf[start:end])
+
+    def _skip_copy_line(self):
+        """Skip the end of the line of a COPY ... FROM STDIN statement, the data starts on the next line."""
+        while True:
+            j = self._buf.find(self._syntax.newline, self._start)
+            if j >= 0:
+                self._start = j + 1
+                return
+            if self._eof:
+                self._start = len(self._buf)
+                return
+            self._fill()
+
+    def _read_copy_data(self, size, bol):
+        """
+        Read inline COPY data from the buffer, stopping before the line starting with the \\. end marker.
+
+        :param size: maximum number of characters returned, all the data in the buffer if negative
+        :param bol: True if self._start is at the beginning of a line
+        :return: the data read, or None once the end marker line has been consumed
+        """
+        while True:
+            buf = self._buf
+            start = self._start
+            if len(buf) - start < 2 and not self._eof:
+                self._fill()
+                continue
+
+            if bol and buf[start:start + 2] == self._syntax.end_marker or start == len(buf):
+                # skip the end marker line
+                j = buf.find(self._syntax.newline, start)
+                if j < 0 and not self._eof:
+                    self._fill()
+                    continue
+                self._copy_end = self._base + start
+                self._start = len(buf) if j < 0 else j + 1
+                return None
+
+            end = len(buf) if size is None or size < 0 else min(len(buf), start + size)
+            j = buf.find(self._syntax.newline + self._syntax.end_marker, start, min(len(buf), end + 2))
+            if j >= 0:
+                end = j + 1
+            elif not self._eof:
+                # the end marker may straddle the end of the buffer
+                end = min(end, len(buf) - 2)
+                if end <= start:
+                    self._fill()
+                    continue
+            self._start = end
+            return buf[start:end]
+
+    def _skip_quoted(self, pos, quote):
+        """
+        Skip a string or identifier where the quote is escaped by doubling it.
+
+        :param pos: index just after the opening quote
+        :param quote: the quote character
+        :return: index just after the closing quote
+        """
+        while True:
+            buf = self._buf
+            j = buf.find(quote, pos)
+            if j < 0 or j + 1 == len(buf):
+                if self._eof:
+                    return len(buf)
+                if j >= 0:
+                    pos = j
+                else:
+                    pos = len(buf)
+                pos -= self._fill()
+                continue
+            if buf[j + 1:j + 2] == quote:
+                pos = j + 2
+                continue
+            return j + 1
+
+    def _skip_escape_string(self, pos):
+        """
+        Skip an E'' string where a backslash escapes the next character.
+
+        :param pos: index just after the opening quote
+        :return: index just after the closing quote
+        """
+        while True:
+            buf = self._buf
+            m = self._syntax.escape_string.search(buf, pos)
+            if m is None or m.end() == len(buf):
+                if self._eof:
+                    return len(buf)
+                pos = m.start() if m is not None else len(buf)
+                pos -= self._fill()
+                continue
+            j = m.start()
+            if buf[j:j + 1] == self._syntax.backslash or buf[j + 1:j + 2] == self._syntax.quote:
+                pos = j + 2
+                continue
+            return j + 1
+
+    def _skip_line_comment(self, pos):
+        """
+        Skip a -- comment.
+
+        :param pos: index just after the dashes
+        :return: index just after the end of the line
+        """
+        while True:
+            buf = self._buf
+            j = buf.find(self._syntax.newline, pos)
+            if j >= 0:
+                return j + 1
+            if self._eof:
+                return len(buf)
+            pos = len(buf) - self._fill()
+
+    def _skip_block_comment(self, pos):
+        """
+        Skip a /* */ comment, which may be nested.
+
+        :param pos: index just after the opening /*
+        :return: index just after the closing */
+        """
+        depth = 1
+        while True:
+            buf = self._buf
+            m = self._syntax.block_comment.search(buf, pos)
+            if m is None:
+                if self._eof:
+                    return len(buf)
+                # the last character may be the first half of "/*" or "*/"
+                pos = max(pos, len(buf) - 1) - self._fill()
+                continue
+            depth += 1 if m.group() == self._syntax.comment_start else -1
+            pos = m.end()
+            if depth == 0:
+                return pos
+
+    def _skip_dollar_quoted(self, pos):
+        """
+        Skip a $tag$ dollar quoted string.
+
+        :param pos: index of the dollar sign
+        :return: index just after the closing tag, or just after the dollar sign if it does not open a dollar quote
+        """
+        syntax = self._syntax
+        buf = self._buf
+        if pos > 0 and syntax.identifier.match(buf, pos - 1):
+            # part of an identifier such as foo$bar
+            return pos + 1
+
+        m = syntax.dollar_tag.match(buf, pos)
+        while m is None:
+            if self._eof or not syntax.dollar_partial.match(buf, pos):
+                # a positional parameter such as $1
+                return pos + 1
+            pos -= self._fill()
+            buf = self._buf
+            m = syntax.dollar_tag.match(buf, pos)
+
+        tag = m.group()
+        body = m.end()
+        while True:
+            buf = self._buf
+            j = buf.find(tag, body)
+            if j >= 0:
+                return j + len(tag)
+            if self._eof:
+                return len(buf)
+            # the closing tag may straddle the end of the buffer
+            body = max(body, len(buf) - len(tag) + 1) - self._fill()
+
+
+def iter_statements(source, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Iterate over the statements of a sql script.
+
+    :param source: the script, either a string, a bytes buffer encoded in utf-8 or a file object opened in text mode
+    :param chunk_size: number of characters read from the file object at once
+    :return: iterator of Statement, BufferStatement for a bytes buffer
+    """
+    return iter(StatementSplitter(source, chunk_size))
+
+
+def is_buffer(source):
+    """True if a script is a bytes buffer, see map_file."""
+    return isinstance(source, (bytes, bytearray, mmap.mmap))
+
+
+def map_file(path):
+    """
+    Map a script file in memory, read only.
+
+    The pages of the file are read by the kernel when the statements are scanned and stay in the page cache instead
+    of being copied in the heap: a large script starts executing at once. The file can be closed once mapped.
+
+    :param path: path of the script, encoded in utf-8
+    :return: mmap of the file, an empty bytes for an empty file which cannot be mapped
+    """
+    with open(path, "rb") as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return b""
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import re
+import csv
+import json
+import logging
+
+from psycopg2 import sql
+
+from postgresql_lib import splitter
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.template")
+
+# :"name" and :'name' placeholders, as psql variables, and the tokens which may hide one: strings, quoted
+# identifiers, dollar quoted bodies and comments. A :: cast to a quoted type is not a placeholder.
+_TOKEN = re.compile(
+    r"""(?<!:):(?:"(?P<identifier>[^\W\d]\w*)"|'(?P<literal>[^\W\d]\w*)')"""
+    r"""|(?<![\w$])[eE]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*'|"(?:[^"]|"")*"|\$(?P<tag>(?:[^\W\d]\w*)?)\$.*?\$(?P=tag)\$"""
+    r"""|--[^\n]*|/\*.*?\*/""",
+    re.DOTALL
+)
+
+# the COPY ... FROM STDIN data of a template is kept in memory to be rendered for each row, templates are
+# provisioning scripts: larger data belongs in a script of its own, which streams it
+MAX_COPY_DATA = 16 * 1024 * 1024
+
+# characters read at once from the COPY data
+_COPY_CHUNK_SIZE = 64 * 1024
+
+
+class ScriptTemplate(object):
+    """
+    Script whose identifiers and literals are given by parameters, e.g. one provisioning script for every tenant.
+
+    :"name" is replaced by the parameter name quoted as an identifier and :'name' by the parameter quoted as a
+    literal, with psycopg2.sql, so a parameter cannot change the structure of a statement. The placeholders in
+    strings, comments and COPY ... FROM STDIN data are left as is.
+
+    CREATE USER :"tenant" WITH PASSWORD :'password';
+    CREATE DATABASE :"tenant" OWNER :"tenant";
+
+    The placeholders are located once, rendering the template for a row of parameters only joins its parts. The
+    rendered script differs per row, so the executor splits it again: only the scan for the placeholders is saved.
+    The COPY data is kept in memory, at most MAX_COPY_DATA characters (bytes for a mapped file) per statement.
+    """
+
+    def __init__(self, source):
+        """
+
+        :param source: the template, either a string, a bytes buffer encoded in utf-8 or a file object opened in text
+            mode
+        """
+        # list of (parts, copy data), parts alternate text and (kind, name) placeholders
+        self._statements = []
+        self.names = set()
+        for statement in splitter.iter_statements(source):
+            data = self._read_copy_data(statement) if statement.copy_data is not None else None
+            self._statements.append((self._compile(statement.text), data))
+
+    @staticmethod
+    def load(path):
+        """
+        :param path: path of the template, encoded in utf-8
+        :return: ScriptTemplate
+        """
+        return ScriptTemplate(splitter.map_file(path))
+
+    def render(self, con, parameters):
+        """
+        Script of the template for a row of parameters.
+
+        :param con: connection to postgresql, giving the encoding of the literals
+        :param parameters: dict mapping the name of each placeholder to its value
+        :return: the script, a string
+        """
+        missing = self.names.difference(parameters)
+        if missing:
+            raise Exception("Missing template parameters: {names}".format(names=", ".join(sorted(missing))))
+        res = []
+        for parts, data in self._statements:
+            res.append(sql.Composed([self._compose(part, parameters) for part in parts]).as_string(con))
+            # on a line of its own, the statement may end with a -- comment
+            res.append("\n;\n")
+            if data is not None:
+                res.append(data)
+                res.append("\\.\n")
+        return "".join(res)
+
+    @staticmethod
+    def _read_copy_data(statement):
+        chunks = []
+        size = 0
+        while True:
+            chunk = statement.copy_data.read(_COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > MAX_COPY_DATA:
+                raise Exception("The COPY data of the template statement at offset {offset} exceeds {limit} "
+                                "characters, load it with a script of its own".format(offset=statement.offset,
+                                                                                     limit=MAX_COPY_DATA))
+            chunks.append(chunk)
+        # a mapped file gives bytes, decoded at once so that no character is cut between two chunks
+        data = chunks[0][:0].join(chunks) if chunks else ""
+        return data.decode("utf-8") if isinstance(data, bytes) else data
+
+    def _compile(self, text):
+        parts = []
+        pos = 0
+        for m in _TOKEN.finditer(text):
+            name = m.group("identifier") or m.group("literal")
+            if name is None:
+                continue
+            parts.append(text[pos:m.start()])
+            parts.append((sql.Identifier if m.group("identifier") else sql.Literal, name))
+            self.names.add(name)
+            pos = m.end()
+        parts.append(text[pos:])
+        return parts
+
+    @staticmethod
+    def _compose(part, parameters):
+        if isinstance(part, str):
+            return sql.SQL(part)
+        kind, name = part
+        value = parameters[name]
+        if kind is sql.Identifier:
+            return sql.Identifier("{value}".format(value=value))
+        return sql.Literal(value)
+
+
+def load_parameters(path):
+    """
+    Load the rows of parameters of a template.
+
+    A .csv file has the names of the parameters in its first line and a row per line. Any other file is json, a list
+    of objects such as [{"tenant": "plop1", "password": "plop1"}, {"tenant": "plop2", "password": "plop2"}].
+
+    :param path: path of the parameters
+    :return: list of dicts
+    """
+    try:
+        with open(path, newline="") as f:
+            if path.lower().endswith(".csv"):
+                rows = [dict(row) for row in csv.DictReader(f)]
+            else:
+                rows = json.load(f)
+    except IOError as e:
+        logger.debug(e)
+        raise IOError("Parameters file {path} not found".format(path=path))
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise Exception("Parameters file {path} must contain a list of objects".format(path=path))
+    return rows
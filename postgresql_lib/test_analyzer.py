@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import pytest
+import psycopg2
+import analyzer
+
+
+@pytest.mark.usefixtures('psql_settings', scope='class')
+class TestAnalyzer():
+    """Class to test the dry-run analyzer analyzer.py."""
+
+    def test_classify(self):
+        """Test to check the category, lock and risk level of the statements."""
+
+        expected = [
+            ("CREATE TABLE t (a int)", analyzer.DDL, None, analyzer.LOW),
+            ("GRANT SELECT ON t TO someone", analyzer.PRIVILEGE, None, analyzer.LOW),
+            ("CREATE USER someone", analyzer.PRIVILEGE, None, analyzer.LOW),
+            ("ALTER TABLE t ADD COLUMN b int", analyzer.DDL, "ACCESS EXCLUSIVE", analyzer.MEDIUM),
+            ("ALTER TABLE t ALTER COLUMN a TYPE bigint", analyzer.DDL, "ACCESS EXCLUSIVE", analyzer.HIGH),
+            ("ALTER TABLE t ADD COLUMN c uuid DEFAULT gen_random_uuid()", analyzer.DDL, "ACCESS EXCLUSIVE",
+             analyzer.HIGH),
+            ("ALTER TABLE t ADD CONSTRAINT c CHECK (a > 0)", analyzer.DDL, "ACCESS EXCLUSIVE", analyzer.HIGH),
+            ("ALTER TABLE t ADD CONSTRAINT c CHECK (a > 0) NOT VALID", analyzer.DDL, "ACCESS EXCLUSIVE",
+             analyzer.MEDIUM),
+            ("ALTER TABLE t VALIDATE CONSTRAINT c", analyzer.DDL, "SHARE UPDATE EXCLUSIVE", analyzer.LOW),
+            ("CREATE INDEX i ON t (a)", analyzer.DDL, "SHARE", analyzer.HIGH),
+            ("CREATE UNIQUE INDEX CONCURRENTLY i ON t (a)", analyzer.DDL, "SHARE UPDATE EXCLUSIVE", analyzer.MEDIUM),
+            ("VACUUM (FULL, ANALYZE) t", analyzer.MAINTENANCE, "ACCESS EXCLUSIVE", analyzer.HIGH),
+            ("VACUUM t", analyzer.MAINTENANCE, "SHARE UPDATE EXCLUSIVE", analyzer.LOW),
+            ("LOCK TABLE t IN SHARE MODE", analyzer.OTHER, "SHARE", analyzer.HIGH),
+            ("UPDATE t SET a = 1", analyzer.DML, "ROW EXCLUSIVE", analyzer.MEDIUM),
+            ("DELETE FROM t WHERE a = 1", analyzer.DML, "ROW EXCLUSIVE", analyzer.LOW),
+            ("COMMIT", analyzer.TRANSACTION, None, analyzer.LOW),
+        ]
+        for text, category, lock, level in expected:
+            res = analyzer.analyze_statement(text)
+            assert (res.category, res.lock, res.level) == (category, lock, level), text
+
+        res = analyzer.analyze_statement('CREATE INDEX CONCURRENTLY i ON "My Schema".t (a)', 3)
+        assert res.relation == '"My Schema".t' and not res.transactional
+        assert res.as_dict()["counter"] == 3 and "plan_cost" not in res.as_dict()
+
+    def test_script(self):
+        """Test to check that a script is analysed statement by statement and summarised by risk level."""
+
+        res = list(analyzer.analyze_script("CREATE TABLE t (a int);\nCREATE INDEX i ON t (a);\nSELECT 1;"))
+        assert [analysis.counter for analysis in res] == [1, 2, 3]
+        assert analyzer.summary(res) == ["3 statements: 1 high, 0 medium, 2 low",
+                                         "run outside peak load, 1 statements block the tables they use: #2"]
+        assert "CREATE INDEX i ON t (a)" in res[1].describe()
+
+    def test_explain(self, psql_settings):
+        """Test to check that the DML statements are explained and the size of the locked tables is read."""
+
+        config = psql_settings
+        with psycopg2.connect(host=config['host'], user=config['user'], password=config['password'],
+                              port=config.get('port', 5432)) as con:
+            con.autocommit = True
+            with con.cursor() as cur:
+                cur.execute("CREATE TABLE test_analyzer (a int)")
+                try:
+                    cur.execute("INSERT INTO test_analyzer SELECT generate_series(1, 1000)")
+                    cur.execute("ANALYZE test_analyzer")
+                    res = list(analyzer.analyze_script("DELETE FROM test_analyzer WHERE a < 10;\n"
+                                                       "CREATE INDEX test_analyzer_a ON test_analyzer (a);\n"
+                                                       "SELECT * FROM missing_table;", cur))
+                    assert res[0].plan_cost > 0 and res[0].plan_rows > 0
+                    assert res[1].relation_rows == 1000 and res[1].relation_size > 0
+                    assert res[2].plan_cost is None and "missing_table" in res[2].error
+
+                    # nothing was executed
+                    cur.execute("SELECT count(*) FROM test_analyzer")
+                    assert cur.fetchone()[0] == 1000
+                    cur.execute("SELECT to_regclass('test_analyzer_a')")
+                    assert cur.fetchone()[0] is None
+                finally:
+                    cur.execute("DROP TABLE test_analyzer")
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import asyncio
+import parallel
+import pytest
+import logging
+import metrics
+import async_script
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.test_async_script")
+logger.setLevel(logging.INFO)
+
+
+@pytest.mark.usefixtures('psql_settings', scope='class')
+class TestAsyncScript():
+    """Class to test the asyncio executor async_script.py."""
+
+    def test_transcript(self, psql_settings):
+        """Test to check that the transcript is the same as the one of the synchronous executor."""
+
+        script_create = "CREATE USER test_async_script;\nCREATE TABLE test_async_script (a int);\n" \
+                        "INSERT INTO test_async_script VALUES (1);\nINSERT INTO test_async_script VALUES (2);"
+        script_drop = "DROP TABLE test_async_script;\nDROP USER test_async_script;"
+        config = psql_settings
+
+        async def run():
+            con = await async_script.connect(host=config['host'], user=config['user'], password=config['password'])
+            try:
+                created = await async_script.AsyncPostgresqlScriptExecutor.run(con, script_create, batch_size=10,
+                                                                               insert_rows=10)
+                dropped = await async_script.AsyncPostgresqlScriptExecutor.run(con, script_drop)
+            finally:
+                con.close()
+            return created, dropped
+
+        created, dropped = asyncio.get_event_loop().run_until_complete(run())
+
+        assert list(created) == [1, 2, 3, 4]
+        assert [created[counter]["status"] for counter in created] == \
+            ["CREATE ROLE", "CREATE TABLE", "INSERT 0 1", "INSERT 0 1"]
+        assert created[3]["command"] == "INSERT INTO test_async_script VALUES (1)"
+        assert [dropped[counter]["status"] for counter in dropped] == ["DROP TABLE", "DROP ROLE"]
+
+    def test_failure(self, psql_settings):
+        """Test to check that a failing script raises a ScriptExecutionError with the queries executed before it."""
+
+        config = psql_settings
+        registry = metrics.MetricsRegistry()
+
+        async def run():
+            con = await async_script.connect(host=config['host'], user=config['user'], password=config['password'])
+            try:
+                await async_script.AsyncPostgresqlScriptExecutor.run(con, "SELECT 1;\nSELECT 1/0;", metrics=registry)
+            finally:
+                con.close()
+
+        with pytest.raises(async_script.pgscript.ScriptExecutionError) as e:
+            asyncio.get_event_loop().run_until_complete(run())
+
+        assert e.value.committed
+        assert e.value.transcript[1]["status"] == "SELECT 1"
+        assert e.value.__cause__.pgcode == "22012"
+        # counted as the failures of the synchronous executor in autocommit mode
+        assert registry.failures == {"22012": 1}
+        assert registry.rollbacks[metrics.ROLLBACK_TRANSACTION] == 0
+
+    def test_run_all(self, psql_settings):
+        """Test to check that a failing target is rolled back without stopping the other targets."""
+
+        config = psql_settings
+        target = dict(host=config['host'], user=config['user'], password=config['password'])
+        # a temporary table is private to the connection of each target
+        script = "CREATE TEMP TABLE test_async_script (a int);\nINSERT INTO test_async_script VALUES (1);"
+        failing_script = script + "\nCREATE invalid_syntax;"
+        rollback_script = "DROP TABLE IF EXISTS test_async_script;"
+        unreachable = dict(target, port=1)
+
+        async def run():
+            res = await async_script.AsyncPostgresqlScriptExecutor.run_all(
+                [target, target, unreachable], script, rollback_script, concurrency=2)
+            res.extend(await async_script.AsyncPostgresqlScriptExecutor.run_all(
+                [target], failing_script, rollback_script))
+            return res
+
+        res = asyncio.get_event_loop().run_until_complete(run())
+
+        assert [r["status"] for r in res] == [parallel.DONE, parallel.DONE, parallel.FAILED, parallel.ROLLED_BACK]
+        assert "invalid_syntax" in res[3]["error"]
+        assert [entry.get("status") for entry in res[3]["transcript"].values()] == ["CREATE TABLE", "INSERT 0 1",
+                                                                                   None]
+        assert [entry["status"] for entry in res[3]["rollback_transcript"].values()] == ["DROP TABLE"]
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import bulk
+import script
+import splitter
+import psycopg2
+import pytest
+
+
+@pytest.mark.usefixtures('psql_settings', scope='class')
+class TestBulk():
+    """Class to test the INSERT grouping of bulk.py."""
+
+    def test_single_row_insert(self):
+        """Test to check that only plain single row inserts are recognised."""
+
+        assert bulk.split_single_row_insert("INSERT INTO s.t (a, b) VALUES (1, 'x)')") == \
+            ("INSERT INTO s.t (a, b) VALUES", "(1, 'x)')")
+        assert bulk.split_single_row_insert("insert into t values (-1.5e3, $$)$$, E'\\'', NULL, DEFAULT)") == \
+            ("INSERT INTO t VALUES", "(-1.5e3, $$)$$, E'\\'', NULL, DEFAULT)")
+        assert bulk.split_single_row_insert("INSERT INTO t VALUES (f(1), $$)$$)") is None
+        assert bulk.split_single_row_insert("INSERT INTO t VALUES (1) RETURNING a") is None
+        assert bulk.split_single_row_insert("INSERT INTO t VALUES (1), (2)") is None
+        assert bulk.split_single_row_insert("INSERT INTO t VALUES (1) ON CONFLICT DO NOTHING") is None
+        assert bulk.split_single_row_insert("INSERT INTO t SELECT 1") is None
+        assert bulk.split_single_row_insert("UPDATE t SET a = 1") is None
+
+    def test_coalesce(self):
+        """Test to check that runs of inserts into the same table and columns are grouped."""
+
+        script = "INSERT INTO t VALUES (1);\nINSERT INTO t VALUES (2);\nINSERT INTO t VALUES (3);\n" \
+                 "INSERT INTO t (a) VALUES (4);\nINSERT INTO u VALUES (5);\nINSERT INTO u VALUES (6);\nSELECT 1;"
+
+        items = list(bulk.coalesce_inserts(splitter.iter_statements(script), rows=2))
+
+        assert [item.text for item in items] == [
+            "INSERT INTO t VALUES (1),\n(2)",
+            "INSERT INTO t VALUES (3)",
+            "INSERT INTO t (a) VALUES (4)",
+            "INSERT INTO u VALUES (5),\n(6)",
+            "SELECT 1",
+        ]
+        assert [statement.text for statement in items[0].statements] == \
+            ["INSERT INTO t VALUES (1)", "INSERT INTO t VALUES (2)"]
+
+    def test_constant_row(self):
+        """Test to check that only the rows of constants, possibly cast, can be grouped."""
+
+        assert bulk.is_constant_row("(1, 'a', TRUE, DATE '2018-01-01', '{1,2}'::int[], 1.5::numeric(10, 2))")
+        assert bulk.is_constant_row("(timestamp with time zone '2018-01-01 00:00' /* typed */, "
+                                    "'x'::pg_catalog.text)")
+        assert not bulk.is_constant_row("((SELECT count(*) FROM t) + 1, 'b')")
+        assert not bulk.is_constant_row("(nextval('s'), 'b')")
+        assert not bulk.is_constant_row("(now())")
+        assert not bulk.is_constant_row("(current_timestamp)")
+        assert not bulk.is_constant_row("(1 + 1)")
+        assert not bulk.is_constant_row("(1, )")
+        assert not bulk.is_constant_row("()")
+
+    def test_run_grouped(self, psql_settings):
+        """Test to check that the rows of constants are inserted together and the subqueries one by one."""
+
+        config = psql_settings
+        constants = "INSERT INTO test_bulk VALUES (1, 'a');\nINSERT INTO test_bulk VALUES (2, 'b');\n" \
+                    "INSERT INTO test_bulk VALUES (3::int, 'c');"
+        subqueries = "INSERT INTO test_bulk VALUES (1, 'a');\n" \
+                     "INSERT INTO test_bulk VALUES ((SELECT count(*) FROM test_bulk) + 1, 'b');\n" \
+                     "INSERT INTO test_bulk VALUES ((SELECT count(*) FROM test_bulk) + 1, 'c');"
+
+        with psycopg2.connect(host=config['host'], user=config['user'], password=config['password'],
+                              port=config.get('port', 5432)) as con:
+            script.PostgresqlScriptExecutor.run(con, "CREATE TABLE test_bulk (id int, name text);")
+            try:
+                grouped = script.PostgresqlScriptExecutor.run(con, constants, insert_rows=10)
+                script.PostgresqlScriptExecutor.run(con, "TRUNCATE test_bulk;")
+                single = script.PostgresqlScriptExecutor.run(con, subqueries, insert_rows=10)
+                with con.cursor() as cur:
+                    cur.execute("SELECT id, name FROM test_bulk ORDER BY name")
+                    rows = cur.fetchall()
+            finally:
+                script.PostgresqlScriptExecutor.run(con, "DROP TABLE test_bulk;")
+        con.close()
+
+        assert [grouped[counter].get("batched") for counter in grouped] == [3, 3, 3]
+        assert [single[counter].get("batched") for counter in single] == [None, None, None]
+        assert rows == [(1, "a"), (2, "b"), (3, "c")]
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import os
+import cache
+import script
+import pytest
+import psycopg2
+import splitter
+import tempfile
+import threading
+
+SCRIPT = "CREATE TABLE test_cache (a int, b text);\n-- data\nCOPY test_cache FROM STDIN;\n1\tone;\n\\.\n" \
+         "INSERT INTO test_cache VALUES (2, 'two;2');\nVACUUM test_cache;\nSELECT count(*) FROM test_cache"
+
+
+def statements(iterator):
+    return [(statement.offset, statement.text, statement.copy_data.read() if statement.copy_data else None)
+            for statement in iterator]
+
+
+@pytest.mark.usefixtures('psql_settings', scope='class')
+class TestCache():
+    """Class to test the parsed script cache cache.py."""
+
+    def test_replay(self):
+        """Test to check that the statements replayed from the cache are the statements of the splitter."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            for source in (SCRIPT, SCRIPT.encode("utf-8")):
+                expected = statements(splitter.iter_statements(source))
+                statement_cache = cache.StatementCache(directory)
+                assert statements(statement_cache.iter_statements(source)) == expected
+                assert statements(statement_cache.iter_statements(source)) == expected
+                assert (statement_cache.hits, statement_cache.misses) == (1, 1)
+
+                replayed = list(statement_cache.iter_statements(source))
+                assert [cache.is_transaction_safe(statement) for statement in replayed] == \
+                    [True, True, True, False, True]
+                assert cache.command_tag(replayed[0]) == "CREATE TABLE"
+
+                # another process reads the file instead of parsing the script
+                assert statements(cache.StatementCache(directory).iter_statements(source)) == expected
+            assert len(os.listdir(directory)) == 2
+
+    def test_eviction(self):
+        """Test to check that the memory and the directory of the cache stay within their sizes."""
+
+        sources = ["SELECT {i};\nSELECT {i} + 1;".format(i=i) for i in range(10)]
+        with tempfile.TemporaryDirectory() as directory:
+            size = len(cache.StatementCache().parse(sources[0]).dumps())
+            statement_cache = cache.StatementCache(directory, memory_size=100, disk_size=3 * size)
+            for source in sources:
+                statement_cache.parse(source)
+            assert statement_cache._size <= 100 and len(os.listdir(directory)) == 3
+
+            # a damaged file is parsed again
+            for name in os.listdir(directory):
+                with open(os.path.join(directory, name), "wb") as f:
+                    f.write(b"damaged")
+            statement_cache.clear()
+            assert statements(statement_cache.iter_statements(sources[-1])) == \
+                statements(splitter.iter_statements(sources[-1]))
+
+    def test_concurrent(self, monkeypatch):
+        """Test to check that a script asked by several threads at the same time is parsed once."""
+
+        parsed = []
+        parse = cache._parse
+        monkeypatch.setattr(cache, "_parse", lambda source: parsed.append(source) or parse(source))
+        statement_cache = cache.StatementCache()
+        threads = [threading.Thread(target=statement_cache.parse, args=(SCRIPT,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(parsed) == 1 and statement_cache.hits == 7
+
+    def test_run(self, psql_settings):
+        """Test to check that a script run from the cache gives the same transcript."""
+
+        config = psql_settings
+        statement_cache = cache.StatementCache()
+        with psycopg2.connect(host=config['host'], user=config['user'], password=config['password'],
+                              port=config.get('port', 5432)) as con:
+            for _ in range(2):
+                res = script.PostgresqlScriptExecutor.run(con, SCRIPT.encode("utf-8"), batch_size=10,
+                                                          statement_cache=statement_cache)
+                assert [res[counter]["status"] for counter in res] == \
+                    ["CREATE TABLE", "COPY 1", "INSERT 0 1", "VACUUM", "SELECT 1"]
+                assert res[2]["bytes"] == len("COPY test_cache FROM STDIN") + len("1\tone;\n")
+                script.PostgresqlScriptExecutor.run(con, "DROP TABLE test_cache;")
+            assert statement_cache.hits == 1
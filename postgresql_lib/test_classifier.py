@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import classifier
+
+
+class TestClassifier():
+    """Class to test the statement classifier classifier.py."""
+
+    def test_transaction_safe(self):
+        """Test to check that statements refused in a transaction block are detected."""
+
+        assert classifier.is_transaction_safe("CREATE USER plop1 WITH PASSWORD 'plop1'")
+        assert classifier.is_transaction_safe("create index i on t (a)")
+        assert not classifier.is_transaction_safe("CREATE DATABASE plop1")
+        assert not classifier.is_transaction_safe("vacuum analyze t")
+        assert not classifier.is_transaction_safe("CREATE UNIQUE INDEX CONCURRENTLY i ON t (a)")
+        assert not classifier.is_transaction_safe("COMMIT")
+        # comments are skipped
+        assert not classifier.is_transaction_safe("CREATE /*x*/ DATABASE plop1")
+        assert not classifier.is_transaction_safe("CREATE /* a /* nested */ comment */ -- line\nDATABASE plop1")
+
+    def test_command_tag(self):
+        """Test to check that only tags independent of the data are predicted."""
+
+        assert classifier.command_tag("CREATE USER plop1") == "CREATE ROLE"
+        assert classifier.command_tag("DROP GROUP g") == "DROP ROLE"
+        assert classifier.command_tag("GRANT ALL ON DATABASE plop1 TO plop1") == "GRANT"
+        assert classifier.command_tag("create or replace function f() returns int as $$ select 1 $$") == \
+            "CREATE FUNCTION"
+        assert classifier.command_tag('CREATE TEMP TABLE "s".t (a int)') == "CREATE TABLE"
+        assert classifier.command_tag("CREATE TABLE t AS SELECT 1") is None
+        assert classifier.command_tag("CREATE TABLE t (a, b) AS SELECT 1, 2") is None
+        assert classifier.command_tag("CREATE TABLE t (a int GENERATED ALWAYS AS (1) STORED) WITH (fillfactor=70)") \
+            == "CREATE TABLE"
+        assert classifier.command_tag("GRANT ra TO rb") == "GRANT ROLE"
+        assert classifier.command_tag("REVOKE ADMIN OPTION FOR ra FROM rb") == "REVOKE ROLE"
+        assert classifier.command_tag('GRANT SELECT (a) ON t TO "on"') == "GRANT"
+        assert classifier.command_tag("REVOKE ALL ON SCHEMA s FROM rb") == "REVOKE"
+        assert classifier.command_tag("COMMENT /* GRANT */ ON TABLE t IS 'x'") == "COMMENT"
+        assert classifier.command_tag("INSERT INTO t VALUES (1)") is None
+        assert classifier.command_tag("SELECT 1") is None
+
+    def test_leading_words(self):
+        """Test to check that the comments and string literals are not keywords."""
+
+        assert classifier.leading_words("CREATE /* x */ USER plop1 -- y\nWITH PASSWORD 'secret word'") == \
+            "CREATE USER PLOP1 WITH PASSWORD"
+        assert classifier.leading_words('ALTER TABLE "my table" ADD COLUMN a int', 5) == "ALTER TABLE MY TABLE ADD"
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import os
+import pool
+import ledger
+import time
+import pytest
+import client
+import daemon
+import tempfile
+import threading
+
+
+@pytest.mark.usefixtures('psql_settings', scope='class')
+class TestDaemon():
+    """Class to test the daemon daemon.py and its client client.py."""
+
+    def test_requests(self, psql_settings):
+        """Test to check that the scripts sent by the client run on the connections kept by the daemon."""
+
+        config = psql_settings
+        with tempfile.TemporaryDirectory() as directory:
+            paths = {}
+            for name, text in [("create", "CREATE USER test_daemon;"), ("drop", "DROP USER test_daemon;"),
+                               ("select", "SELECT 1;"),
+                               ("invalid", "CREATE USER test_daemon;\nCREATE invalid_syntax;")]:
+                paths[name] = os.path.join(directory, name + ".sql")
+                with open(paths[name], "w") as f:
+                    f.write(text)
+            path = os.path.join(directory, "daemon.sock")
+
+            with pool.ConnectionPool(minconn=1, maxconn=2, host=config['host'], user=config['user'],
+                                     password=config['password'], port=config.get('port', 5432)) as connections:
+                server = daemon.ScriptDaemon(connections, path, workers=2)
+                thread = threading.Thread(target=server.serve_forever)
+                thread.start()
+                try:
+                    while not os.path.exists(path):
+                        time.sleep(0.01)
+                    assert os.stat(path).st_mode & 0o777 == 0o600
+
+                    res = client.request({"scripts": [
+                        {"name": "create", "script": paths["create"]},
+                        {"name": "drop", "script": paths["drop"], "depends_on": ["create"]}]}, path)
+                    assert res["status"] == "done"
+                    assert res["scripts"]["create"] == {"status": "done", "queries": 1}
+                    assert len(res["summary"]) == 3
+
+                    res = client.request({"scripts": [{"name": "invalid", "script": paths["invalid"],
+                                                       "rollback_script": paths["drop"]}],
+                                          "options": {"transactional": True}, "slowest": 0}, path)
+                    assert res["status"] == "rolled back" and "invalid_syntax" in res["scripts"]["invalid"]["error"]
+                    assert "summary" not in res
+
+                    res = client.request({"scripts": [{"script": paths["create"]}]}, path)
+                    assert res["status"] == "failed" and "name" in res["error"]
+
+                    # true records the scripts in the default ledger table
+                    for queries in (1, 0):
+                        res = client.request({"scripts": [{"name": "select", "script": paths["select"]}],
+                                              "ledger": True}, path)
+                        assert res["scripts"]["select"] == {"status": "done", "queries": queries}
+                    with connections.connection() as con:
+                        with con.cursor() as cur:
+                            cur.execute("DROP TABLE {table}".format(table=ledger.DEFAULT_TABLE))
+                        con.commit()
+
+                    # a second daemon cannot take the socket
+                    with pytest.raises(Exception):
+                        daemon.ScriptDaemon(connections, path).serve_forever()
+                finally:
+                    server.shutdown()
+                    thread.join()
+                assert not os.path.exists(path)
+
+            with pytest.raises(Exception):
+                client.request({"scripts": []}, path)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import os
+import json
+import time
+import struct
+import pytest
+import tempfile
+import threading
+import subprocess
+import socketserver
+import http.server
+import docker_api
+
+
+class FakeDockerDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Stand-in for the docker daemon on a unix socket, running the commands of the exec sessions on the host.
+
+    with FakeDockerDaemon() as daemon:
+        docker_api.DockerClient(daemon.path).execute("any", ["true"])
+    """
+
+    daemon_threads = True
+
+    def __init__(self, status="running"):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "docker.sock")
+        self.status = status
+        self.connections = 0
+        self.requests = []
+        self.execs = {}
+        socketserver.UnixStreamServer.__init__(self, self.path, FakeDockerHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+        self.server_close()
+        self.directory.cleanup()
+
+
+class FakeDockerHandler(http.server.BaseHTTPRequestHandler):
+    """Endpoints of the Docker Engine API used by docker_api.DockerClient."""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        http.server.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(("GET", self.path))
+        parts = self.path.split("/")
+        if parts[1] == "containers":
+            if parts[2] == "missing":
+                return self.answer(404, {"message": "No such container: missing"})
+            return self.answer(200, {"Name": "/" + parts[2], "State": {"Status": self.server.status},
+                                     "Config": {"ExposedPorts": {"5432/tcp": {}}}})
+        return self.answer(200, {"ExitCode": self.server.execs[parts[2]]["ExitCode"], "Running": False})
+
+    def do_POST(self):
+        self.server.requests.append(("POST", self.path))
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+        parts = self.path.split("/")
+        if parts[1] == "containers" and parts[3] == "exec":
+            exec_id = str(len(self.server.execs))
+            self.server.execs[exec_id] = {"Cmd": payload["Cmd"], "ExitCode": None}
+            return self.answer(201, {"Id": exec_id})
+        if parts[1] == "exec":
+            # as the docker daemon: the connection is hijacked and closed at the end of the command
+            process = subprocess.Popen(self.server.execs[parts[2]]["Cmd"], stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE)
+            self.wfile.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/vnd.docker.multiplexed-stream\r\n\r\n")
+            self.wfile.flush()
+            try:
+                # stdout is sent while it is written, stderr at the end
+                for data in iter(lambda: os.read(process.stdout.fileno(), 4096), b""):
+                    self.frame(1, data)
+                self.frame(2, process.stderr.read())
+            except BrokenPipeError:
+                # the client stopped reading
+                process.kill()
+            self.server.execs[parts[2]]["ExitCode"] = process.wait()
+            process.stdout.close()
+            process.stderr.close()
+            self.close_connection = True
+            return
+        # stop and restart
+        self.send_response(204)
+        self.end_headers()
+
+    def frame(self, kind, data):
+        if data:
+            self.wfile.write(struct.pack(">BxxxL", kind, len(data)) + data)
+            self.wfile.flush()
+
+    def answer(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestDockerApi():
+    """Class to test the client of the Docker Engine API docker_api.py."""
+
+    def test_execute(self):
+        """Test to check that the exit code and both outputs of a command are returned."""
+
+        with FakeDockerDaemon() as daemon:
+            with docker_api.DockerClient(daemon.path) as docker:
+                res = docker.execute("postgresql", ["sh", "-c", "echo out; echo err >&2; exit 3"])
+                assert res == (3, b"out\n", b"err\n")
+
+                res = docker.execute("postgresql", ["true"])
+                assert res == (0, b"", b"")
+
+    def test_keep_alive(self):
+        """Test to check that the API calls share one connection, only the exec outputs use their own."""
+
+        with FakeDockerDaemon() as daemon:
+            with docker_api.DockerClient(daemon.path) as docker:
+                for i in range(5):
+                    assert docker.inspect("postgresql")["State"]["Status"] == "running"
+                assert daemon.connections == 1
+
+                docker.execute("postgresql", ["true"])
+                docker.restart("postgresql", timeout=3)
+                assert ("POST", "/containers/postgresql/restart?t=3") in daemon.requests
+                # the keep-alive connection and the one of the exec output
+                assert daemon.connections == 2
+
+                with pytest.raises(Exception, match="No such container"):
+                    docker.inspect("missing")
+
+    def test_stream(self):
+        """Test to check that the output of a command is read while it is written."""
+
+        with FakeDockerDaemon() as daemon:
+            with docker_api.DockerClient(daemon.path) as docker:
+                frames = docker.stream("postgresql", ["sh", "-c", "echo first; sleep 5; echo second"])
+                start = time.time()
+                assert next(frames) == (1, b"first\n")
+                assert time.time() - start < 4
+                frames.close()
+
+    def test_demultiplex(self):
+        """Test to check that the frames of stdout and stderr are told apart."""
+
+        stream = struct.pack(">BxxxL", 1, 3) + b"abc" + struct.pack(">BxxxL", 2, 1) + b"e" + \
+            struct.pack(">BxxxL", 1, 2) + b"de"
+        assert docker_api.demultiplex(stream) == (b"abcde", b"e")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import os
+import time
+import pytest
+import tempfile
+import collections
+import fleet
+
+from xml.etree import ElementTree
+
+CONFTEST = """
+import pytest
+
+def pytest_addoption(parser):
+    for option in ("--config-file", "--psql-config-file", "--container"):
+        parser.addoption(option, action="store")
+
+@pytest.fixture()
+def container(pytestconfig):
+    return pytestconfig.getoption("container")
+"""
+
+TESTS = """
+import time
+
+def test_sleep(container):
+    time.sleep(1)
+
+def test_container(container):
+    assert container != "broken"
+"""
+
+
+class TestFleet():
+    """Class to test the container test runner fleet.py."""
+
+    def test_container_settings(self):
+        """Test to check that each container gets the shared settings and its own ones."""
+
+        config = {"container_name": "postgresql", "service_name": "postgresql"}
+        assert fleet.containers(config) == ["postgresql"]
+        assert fleet.container_settings(config) == (config, {})
+        assert fleet.container_settings(config, "other")[0]["container_name"] == "other"
+
+        config = {"containers": ["pg-1", {"container_name": "pg-2", "psql_timeout": 5, "psql": {"port": 5433}}],
+                  "service_name": "postgresql", "psql_timeout": 75}
+        assert fleet.containers(config) == ["pg-1", "pg-2"]
+        assert fleet.container_settings(config) == (
+            {"container_name": "pg-1", "service_name": "postgresql", "psql_timeout": 75}, {})
+        assert fleet.container_settings(config, "pg-2") == (
+            {"container_name": "pg-2", "service_name": "postgresql", "psql_timeout": 5}, {"port": 5433})
+        with pytest.raises(Exception, match="pg-3"):
+            fleet.container_settings(config, "pg-3")
+
+    def test_run(self):
+        """Test to check that the containers are tested concurrently and that their reports are merged."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            for name, content in (("conftest.py", CONFTEST), ("test_fake.py", TESTS)):
+                with open(os.path.join(directory, name), "w") as f:
+                    f.write(content)
+            runner = fleet.ContainerTestRunner("dev.json", "psql.json", [os.path.join(directory, "test_fake.py")],
+                                               directory=directory, pytest_args=["-q", "--rootdir", directory])
+            names = ["pg-1", "broken", "pg-3"]
+            start = time.time()
+            res = runner.run(names)
+            elapsed = time.time() - start
+
+            assert list(res) == names
+            assert [res[name]["exit_code"] for name in names] == [0, 1, 0]
+            # the processes overlap
+            assert elapsed < sum(res[name]["duration"] for name in names)
+
+            reports = collections.OrderedDict((name, res[name]["report"]) for name in names)
+            reports["crashed"] = os.path.join(directory, "missing.xml")
+            output = os.path.join(directory, "report.xml")
+            totals = fleet.merge_reports(reports, output)
+            assert totals == {"tests": 7, "failures": 1, "errors": 1, "skipped": 0}
+
+            root = ElementTree.parse(output).getroot()
+            assert [suite.get("name") for suite in root] == names + ["crashed"]
+            failed = [case.get("classname") for case in root.iter("testcase") if case.find("failure") is not None]
+            assert len(failed) == 1 and failed[0].startswith("broken.")
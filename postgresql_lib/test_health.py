@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import pytest
+import health
+import docker_api
+
+SHOW = """Id=postgresql.service
+ActiveState=active
+SubState=running
+Restart=no
+NRestarts=0
+MainPID=42
+
+Id=monit.service
+ActiveState=activating
+SubState=auto-restart
+Restart=always
+NRestarts=3
+MainPID=0
+"""
+
+
+class ShowClient(object):
+    """Client answering every command with the output of systemctl show, recording the commands."""
+
+    def __init__(self):
+        self.commands = []
+
+    def execute(self, container, command, timeout=None):
+        self.commands.append(command)
+        return docker_api.ExecResult(0, SHOW.encode("utf-8"), b"")
+
+
+class TestHealth():
+    """Class to test the snapshot of the systemd units health.py."""
+
+    def test_snapshot(self):
+        """Test to check that the properties of all the units are collected with one command."""
+
+        client = ShowClient()
+        snapshot = health.snapshot("postgresql", ["postgresql", "monit"], client)
+
+        assert len(client.commands) == 1
+        assert client.commands[0][-2:] == ["postgresql", "monit"]
+        assert snapshot["postgresql"]["MainPID"] == 42
+        assert snapshot["monit"]["Restart"] == "always"
+        assert snapshot["monit"]["NRestarts"] == 3
+        assert snapshot.is_active("postgresql")
+        assert not snapshot.is_active("monit")
+        assert snapshot.problems() == ["monit is activating (auto-restart)"]
+        assert list(snapshot.as_dict()["units"]) == ["postgresql", "monit"]
+
+        with pytest.raises(Exception, match="2 units instead of 3"):
+            health.parse_show(SHOW, ["postgresql", "monit", "sshd"])
+
+    def test_units(self):
+        """Test to check the units of a container configuration."""
+
+        assert health.units({"service_name": "postgres"}) == ["postgres", "monit"]
+        assert health.units({"service_name": "postgres", "units": ["postgres"]}) == ["postgres"]
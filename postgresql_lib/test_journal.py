@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import os
+import time
+import tempfile
+import journal
+import docker_api
+
+from test_docker_api import FakeDockerDaemon
+
+# journalctl printing two entries, only the second one after the cursor of the first one, and following forever
+JOURNALCTL = """#!/bin/sh
+first='{"__CURSOR": "c1", "__REALTIME_TIMESTAMP": "1500000000000000", "_SYSTEMD_UNIT": "monit.service", "PRIORITY": "3", "MESSAGE": "connection refused by 127.0.0.1:5432"}'
+second='{"__CURSOR": "c2", "__REALTIME_TIMESTAMP": "1500000001000000", "_SYSTEMD_UNIT": "monit.service", "PRIORITY": "3", "MESSAGE": [98, 97, 100]}'
+case "$*" in
+    *--after-cursor\\ c2*) ;;
+    *--after-cursor\\ c1*) echo "$second" ;;
+    *) echo "$first"; echo "$second" ;;
+esac
+case "$*" in
+    *--follow*) exec sleep 30 ;;
+    *--show-cursor*) echo "-- cursor: c2" ;;
+esac
+"""
+
+
+class TestJournal():
+    """Class to test the journal reader journal.py."""
+
+    def test_classify(self):
+        """Test to check that the messages are classified by the first matching pattern."""
+
+        assert journal.classify("'postgresql' process is not running") == "restart"
+        assert journal.classify("FATAL: password authentication failed for user x") == "permission"
+        assert journal.classify("everything is fine") == journal.OTHER
+
+    def test_read(self, monkeypatch):
+        """Test to check that the cursor is kept between two runs and that only the new entries are read."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "journalctl"), "w") as f:
+                f.write(JOURNALCTL)
+            os.chmod(os.path.join(directory, "journalctl"), 0o755)
+            monkeypatch.setenv("PATH", directory + os.pathsep + os.environ["PATH"])
+            cursor_file = os.path.join(directory, "cursor")
+
+            with FakeDockerDaemon() as daemon:
+                with docker_api.DockerClient(daemon.path) as docker:
+                    entries = journal.JournalReader(["monit"], cursor_file=cursor_file).read(
+                        "postgresql", docker=docker)
+                    assert [entry.message for entry in entries] == ["connection refused by 127.0.0.1:5432", "bad"]
+                    assert entries[0] == (1500000000.0, "monit.service", 3, "connection refused by 127.0.0.1:5432",
+                                          "connection", "c1")
+
+                    # another run starts from the cursor saved by the first one
+                    reader = journal.JournalReader(["monit"], cursor_file=cursor_file)
+                    assert reader.cursor == "c2"
+                    assert reader.read("postgresql", docker=docker) == []
+
+                    # the first entry stops following, long before journalctl ends
+                    reader.cursor = None
+                    start = time.time()
+                    entries = reader.follow("postgresql", 20, docker=docker)
+                    assert [entry.cursor for entry in entries] == ["c1"]
+                    assert time.time() - start < 10
+                    assert reader.cursor == "c1"
+
+    def test_command(self):
+        """Test to check that the journal is read after the cursor, otherwise since a date or the boot."""
+
+        reader = journal.JournalReader(["monit", "postgresql"])
+        command = reader.command()
+        assert command[:3] == ["journalctl", "--output", "json"]
+        assert "--boot" in command and "--show-cursor" in command
+        assert command.count("--unit") == 2
+
+        assert "--since" in reader.command(since="2018-01-01 00:00:00")
+        reader.cursor = "c1"
+        command = reader.command(since="2018-01-01 00:00:00", follow=True)
+        assert command[-3:] == ["--after-cursor", "c1", "--follow"]
+        assert "--since" not in command
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import io
+import script
+import ledger
+import pytest
+import logging
+import psycopg2
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.test_ledger")
+logger.setLevel(logging.INFO)
+
+
+@pytest.mark.usefixtures('psql_settings', scope='class')
+class TestLedger():
+    """Class to test the migration ledger ledger.py."""
+
+    def test_skip_applied(self, psql_settings):
+        """Test to check that applied scripts and statements are skipped and only the new statements run."""
+
+        script_v1 = "CREATE TABLE test_ledger (a int);\nINSERT INTO test_ledger VALUES (1);\n" \
+                    "INSERT INTO test_ledger VALUES (1);"
+        script_v2 = script_v1 + "\nINSERT INTO test_ledger VALUES (1);\nINSERT INTO test_ledger VALUES (2);"
+        config = psql_settings
+        migrations = ledger.MigrationLedger("test_ledger_table")
+
+        try:
+            with psycopg2.connect(host=config['host'], user=config['user'], password=config['password']) as con:
+                for transactional in (False, True):
+                    res = script.PostgresqlScriptExecutor.run(con, script_v1, ledger=migrations,
+                                                              transactional=transactional)
+                    assert len(res) == 3
+
+                    # the file is hashed, then rewound and read again
+                    res = script.PostgresqlScriptExecutor.run(con, io.StringIO(script_v1), ledger=migrations,
+                                                              transactional=transactional)
+                    assert len(res) == 0
+
+                    res = script.PostgresqlScriptExecutor.run(con, script_v2, ledger=migrations,
+                                                              transactional=transactional, insert_rows=10)
+                    assert [res[counter]["command"] for counter in res] == \
+                        ["INSERT INTO test_ledger VALUES (1)", "INSERT INTO test_ledger VALUES (2)"]
+
+                    with con.cursor() as cur:
+                        cur.execute("SELECT count(*) FROM test_ledger")
+                        assert cur.fetchone()[0] == 4
+                    script.PostgresqlScriptExecutor.run(con, "DROP TABLE test_ledger;\nDROP TABLE test_ledger_table;")
+
+        except Exception as e:
+            logger.debug(e)
+            if con:
+                con.rollback()
+            pytest.fail("Error {error}".format(error=e))
+        finally:
+            if con:
+                con.close()
+                logger.info("closed connection to postgresql")
+
+    def test_scoped_statements(self, psql_settings):
+        """Test to check that the statements of another script are not skipped and that a delta run sets the
+        session state again."""
+
+        script_v1 = "CREATE SCHEMA test_ledger_schema;\nSET search_path TO test_ledger_schema;\n" \
+                    "CREATE TABLE test_ledger (a int);"
+        script_v2 = script_v1 + "\nCREATE TABLE test_ledger_delta (a int);"
+        shared = "CREATE TABLE IF NOT EXISTS test_ledger_shared (a int);\nINSERT INTO test_ledger_shared VALUES (1);"
+        config = psql_settings
+        migrations = ledger.MigrationLedger("test_ledger_table")
+
+        try:
+            with psycopg2.connect(host=config['host'], user=config['user'], password=config['password']) as con:
+                script.PostgresqlScriptExecutor.run(con, script_v1, ledger=migrations, script_name="schema.sql")
+            con.close()
+
+            # a new session, whose search_path is the default one
+            with psycopg2.connect(host=config['host'], user=config['user'], password=config['password']) as con:
+                res = script.PostgresqlScriptExecutor.run(con, script_v2, ledger=migrations, script_name="schema.sql")
+                assert [res[counter]["command"] for counter in res] == \
+                    ["SET search_path TO test_ledger_schema", "CREATE TABLE test_ledger_delta (a int)"]
+                with con.cursor() as cur:
+                    cur.execute("SELECT to_regclass('test_ledger_schema.test_ledger_delta') IS NOT NULL")
+                    assert cur.fetchone()[0]
+                    cur.execute("RESET search_path")
+                # run gives the connection back out of autocommit mode, as it was opened
+                con.commit()
+
+                for name in ("first.sql", "second.sql"):
+                    res = script.PostgresqlScriptExecutor.run(con, shared, ledger=migrations, script_name=name)
+                    assert len(res) == 2
+                # the same script under the same name is skipped
+                res = script.PostgresqlScriptExecutor.run(con, shared, ledger=migrations, script_name="first.sql")
+                assert len(res) == 0
+                with con.cursor() as cur:
+                    cur.execute("SELECT count(*) FROM test_ledger_shared")
+                    assert cur.fetchone()[0] == 2
+                script.PostgresqlScriptExecutor.run(con, "DROP SCHEMA test_ledger_schema CASCADE;\n"
+                                                         "DROP TABLE test_ledger_shared;\n"
+                                                         "DROP TABLE test_ledger_table;")
+
+        except Exception as e:
+            logger.debug(e)
+            if con:
+                con.rollback()
+            pytest.fail("Error {error}".format(error=e))
+        finally:
+            if con:
+                con.close()
+                logger.info("closed connection to postgresql")
+
+    def test_resume_after_failure(self, psql_settings):
+        """Test to check that a script failing in autocommit mode resumes after its last applied statement."""
+
+        failing = "CREATE TABLE test_ledger (a int);\nINSERT INTO test_ledger VALUES ('x');"
+        fixed = "CREATE TABLE test_ledger (a int);\nINSERT INTO test_ledger VALUES (1);"
+        config = psql_settings
+        migrations = ledger.MigrationLedger("test_ledger_table")
+
+        try:
+            with psycopg2.connect(host=config['host'], user=config['user'], password=config['password']) as con:
+                with pytest.raises(script.ScriptExecutionError):
+                    script.PostgresqlScriptExecutor.run(con, failing, ledger=migrations)
+
+                res = script.PostgresqlScriptExecutor.run(con, fixed, ledger=migrations)
+                assert [res[counter]["status"] for counter in res] == ["INSERT 0 1"]
+
+                # after a rollback script, the script runs again in full
+                script.PostgresqlScriptExecutor.run(con, "DROP TABLE test_ledger;")
+                migrations.forget(con, fixed)
+                res = script.PostgresqlScriptExecutor.run(con, fixed, ledger=migrations)
+                assert len(res) == 2
+                script.PostgresqlScriptExecutor.run(con, "DROP TABLE test_ledger;\nDROP TABLE test_ledger_table;")
+
+        except Exception as e:
+            logger.debug(e)
+            if con:
+                con.rollback()
+            pytest.fail("Error {error}".format(error=e))
+        finally:
+            if con:
+                con.close()
+                logger.info("closed connection to postgresql")
+
+    def test_copy_data(self, psql_settings):
+        """Test to check that a COPY ... FROM STDIN runs again when its data changes, and only then."""
+
+        create = "CREATE TABLE test_ledger (a int);\nCOPY test_ledger FROM STDIN;\n"
+        config = psql_settings
+        migrations = ledger.MigrationLedger("test_ledger_table")
+
+        try:
+            with psycopg2.connect(host=config['host'], user=config['user'], password=config['password']) as con:
+                script.PostgresqlScriptExecutor.run(con, create + "1\n\\.\n", ledger=migrations)
+
+                # the data is sent once hashed, read again from the string or from a copy of the file
+                for data in ("1\n2\n", "1\n2\n3\n"):
+                    for source in (str, io.StringIO):
+                        res = script.PostgresqlScriptExecutor.run(con, source(create + data + "\\.\n"),
+                                                                  ledger=migrations)
+                        assert [res[counter]["command"] for counter in res] == \
+                            ([] if source is io.StringIO else ["COPY test_ledger FROM STDIN"])
+                    script.PostgresqlScriptExecutor.run(con, "INSERT INTO test_ledger VALUES (0);")
+
+                with con.cursor() as cur:
+                    cur.execute("SELECT a FROM test_ledger ORDER BY a")
+                    assert [row[0] for row in cur] == [0, 0, 1, 1, 1, 2, 2, 3]
+
+                res = script.PostgresqlScriptExecutor.run(con, io.StringIO(create + "4\n\\.\n"), ledger=migrations)
+                assert [res[counter]["status"] for counter in res] == ["COPY 1"]
+                script.PostgresqlScriptExecutor.run(con, "DROP TABLE test_ledger;\nDROP TABLE test_ledger_table;")
+
+        except Exception as e:
+            logger.debug(e)
+            if con:
+                con.rollback()
+            pytest.fail("Error {error}".format(error=e))
+        finally:
+            if con:
+                con.close()
+                logger.info("closed connection to postgresql")
+
+    def test_quoted_table(self, psql_settings):
+        """Test to check that a ledger table whose name must be quoted is found again."""
+
+        config = psql_settings
+        migrations = ledger.MigrationLedger("Test Ledger.Table")
+
+        try:
+            with psycopg2.connect(host=config['host'], user=config['user'], password=config['password']) as con:
+                res = script.PostgresqlScriptExecutor.run(con, "SELECT 1;", ledger=migrations)
+                assert len(res) == 1
+                res = script.PostgresqlScriptExecutor.run(con, "SELECT 1;", ledger=migrations)
+                assert len(res) == 0
+                script.PostgresqlScriptExecutor.run(con, 'DROP TABLE "Test Ledger.Table";')
+
+        except Exception as e:
+            logger.debug(e)
+            if con:
+                con.rollback()
+            pytest.fail("Error {error}".format(error=e))
+        finally:
+            if con:
+                con.close()
+                logger.info("closed connection to postgresql")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import pool
+import script
+import metrics
+import parallel
+import pytest
+import logging
+import urllib.request
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.test_metrics")
+logger.setLevel(logging.INFO)
+
+
+@pytest.mark.usefixtures('psql_settings', scope='class')
+class TestMetrics():
+    """Class to test the metrics of the executions metrics.py."""
+
+    def test_exposition(self):
+        """Test to check the counters and the cumulative buckets in both formats."""
+
+        registry = metrics.MetricsRegistry()
+        registry.observe_statement(0.002, 10)
+        registry.observe_statement(0.2, 20)
+        registry.observe_statement(100.0, 30)
+        registry.observe_failure(Exception("lost connection"))
+        registry.observe_rollback()
+
+        lines = registry.exposition().splitlines()
+        assert "# TYPE postgresql_tools_statements_total counter" in lines
+        assert "postgresql_tools_statements_total 3" in lines
+        assert "postgresql_tools_statement_bytes_total 60" in lines
+        assert 'postgresql_tools_failures_total{sqlstate="unknown"} 1' in lines
+        assert 'postgresql_tools_rollbacks_total{kind="script"} 1' in lines
+        assert 'postgresql_tools_rollbacks_total{kind="transaction"} 0' in lines
+        assert 'postgresql_tools_statement_duration_seconds_bucket{le="0.001"} 0' in lines
+        assert 'postgresql_tools_statement_duration_seconds_bucket{le="0.0025"} 1' in lines
+        assert 'postgresql_tools_statement_duration_seconds_bucket{le="0.25"} 2' in lines
+        assert 'postgresql_tools_statement_duration_seconds_bucket{le="60.0"} 2' in lines
+        assert 'postgresql_tools_statement_duration_seconds_bucket{le="+Inf"} 3' in lines
+        assert "postgresql_tools_statement_duration_seconds_count 3" in lines
+        assert "postgresql_tools_connection_acquire_seconds_count 0" in lines
+
+        lines = registry.exposition(openmetrics=True).splitlines()
+        assert "# TYPE postgresql_tools_statements counter" in lines
+        assert "postgresql_tools_statements_total 3" in lines
+        assert lines[-1] == "# EOF"
+
+    def test_run(self, psql_settings, tmpdir):
+        """Test to check the metrics of a pool and of scripts succeeding and failing, exported to a file and over
+        http."""
+
+        create = tmpdir.join("create.sql")
+        create.write("CREATE USER test_metrics;\nCOMMENT ON ROLE test_metrics IS 'metrics';")
+        broken = tmpdir.join("broken.sql")
+        broken.write("CREATE invalid_syntax;")
+        broken_rollback = tmpdir.join("broken_rollback.sql")
+        broken_rollback.write("DROP USER test_metrics;")
+        textfile = tmpdir.join("postgresql_tools.prom")
+        config = psql_settings
+
+        registry = metrics.MetricsRegistry(str(textfile))
+        with pool.ConnectionPool(maxconn=1, host=config['host'], user=config['user'], password=config['password'],
+                                 port=config.get('port', 5432), metrics=registry) as connections:
+            pairs = [parallel.ScriptPair("create", str(create)),
+                     parallel.ScriptPair("broken", str(broken), str(broken_rollback), ["create"])]
+            res = parallel.ParallelScriptRunner(connections, workers=1, metrics=registry).run(pairs)
+            with connections.connection() as con:
+                with pytest.raises(script.ScriptExecutionError):
+                    script.PostgresqlScriptExecutor.run(con, "SELECT 1;\nSELECT 1/0;", transactional=True,
+                                                        metrics=registry)
+                # VACUUM commits the queries before it, the failure does not roll the script back
+                with pytest.raises(script.ScriptExecutionError):
+                    script.PostgresqlScriptExecutor.run(con, "SELECT 1;\nVACUUM pg_class;\nSELECT 1/0;",
+                                                        transactional=True, metrics=registry)
+        registry.flush()
+
+        assert [res[name]["status"] for name in res] == [parallel.DONE, parallel.ROLLED_BACK]
+        # the two statements of create, the rollback script and the queries before the failure of the transactional
+        # scripts
+        assert registry.statements == 6
+        assert registry.failures == {"42601": 1, "22012": 2}
+        assert registry.rollbacks == {metrics.ROLLBACK_SCRIPT: 1, metrics.ROLLBACK_TRANSACTION: 1}
+        assert registry.acquisitions.count == 3
+        assert textfile.read() == registry.exposition()
+
+        httpd = registry.serve(0)
+        try:
+            url = "http://127.0.0.1:{port}/metrics".format(port=httpd.server_address[1])
+            with urllib.request.urlopen(url) as response:
+                assert response.read().decode("utf-8") == registry.exposition()
+            request = urllib.request.Request(url, headers={"Accept": "application/openmetrics-text"})
+            with urllib.request.urlopen(request) as response:
+                assert response.headers["Content-Type"] == metrics.OPENMETRICS_CONTENT_TYPE
+                assert response.read().decode("utf-8").endswith("# EOF\n")
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import pool
+import parallel
+import pytest
+import logging
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.test_parallel")
+logger.setLevel(logging.INFO)
+
+
+@pytest.mark.usefixtures('psql_settings', scope='class')
+class TestParallel():
+    """Class to test the concurrent script runner parallel.py."""
+
+    def test_dependencies(self):
+        """Test to check that unknown dependencies and cycles are refused."""
+
+        parallel.check_dependencies([parallel.ScriptPair("a", "a.sql"), parallel.ScriptPair("b", "b.sql", None, ["a"])])
+
+        with pytest.raises(Exception):
+            parallel.check_dependencies([parallel.ScriptPair("a", "a.sql", None, ["c"])])
+        with pytest.raises(Exception):
+            parallel.check_dependencies([parallel.ScriptPair("a", "a.sql", None, ["b"]),
+                                         parallel.ScriptPair("b", "b.sql", None, ["a"])])
+
+    def test_rollback_per_pair(self, psql_settings, tmpdir):
+        """Test to check that a failing pair is rolled back alone and that its dependents are skipped."""
+
+        create = tmpdir.join("create.sql")
+        create.write("CREATE USER test_parallel;")
+        drop = tmpdir.join("drop.sql")
+        drop.write("DROP USER test_parallel;")
+        broken = tmpdir.join("broken.sql")
+        broken.write("CREATE USER test_parallel_broken;\nCREATE invalid_syntax;")
+        broken_rollback = tmpdir.join("broken_rollback.sql")
+        broken_rollback.write("DROP USER test_parallel_broken;")
+        config = psql_settings
+
+        pairs = [
+            parallel.ScriptPair("create", str(create)),
+            parallel.ScriptPair("broken", str(broken), str(broken_rollback)),
+            parallel.ScriptPair("after_broken", str(create), None, ["broken"]),
+            parallel.ScriptPair("drop", str(drop), None, ["create"]),
+        ]
+        with pool.ConnectionPool(maxconn=2, host=config['host'], user=config['user'],
+                                 password=config['password']) as connections:
+            res = parallel.ParallelScriptRunner(connections, workers=2).run(pairs)
+
+        assert [res[name]["status"] for name in res] == \
+            [parallel.DONE, parallel.ROLLED_BACK, parallel.SKIPPED, parallel.DONE]
+        # the transcript of the failed script is kept next to the one of its rollback script
+        assert [entry.get("status") for entry in res["broken"]["transcript"].values()] == ["CREATE ROLE", None]
+        assert [entry["status"] for entry in res["broken"]["rollback_transcript"].values()] == ["DROP ROLE"]
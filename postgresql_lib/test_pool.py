@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import pool
+import pytest
+import logging
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.test_pool")
+logger.setLevel(logging.INFO)
+
+
+@pytest.mark.usefixtures('psql_settings', scope='class')
+class TestPool():
+    """Class to test the connection pool pool.py."""
+
+    def test_reuse(self, psql_settings):
+        """Test to check that a connection given back is handed out again instead of opening a new one."""
+
+        config = psql_settings
+        with pool.ConnectionPool(maxconn=1, host=config['host'], user=config['user'],
+                                 password=config['password']) as connections:
+            with connections.connection() as con:
+                first = con
+            with connections.connection() as con:
+                assert con is first
+
+            # maxconn connections are in use
+            with connections.connection():
+                with pytest.raises(Exception):
+                    connections.getconn(timeout=0.1)
+
+    def test_broken_and_idle(self, psql_settings):
+        """Test to check that broken connections are replaced and idle connections closed."""
+
+        config = psql_settings
+        with pool.ConnectionPool(maxconn=1, check_interval=0, host=config['host'], user=config['user'],
+                                 password=config['password']) as connections:
+            with connections.connection() as con:
+                first = con
+            # simulate a connection dropped while idle in the pool
+            first.close()
+            with connections.connection() as con:
+                assert con is not first
+                with con.cursor() as cur:
+                    cur.execute("SELECT 1")
+                    assert cur.fetchone() == (1,)
+
+        with pool.ConnectionPool(maxconn=1, idle_timeout=0, host=config['host'], user=config['user'],
+                                 password=config['password']) as connections:
+            with connections.connection() as con:
+                first = con
+            with connections.connection() as con:
+                assert con is not first
+            assert first.closed
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import script
+import pytest
+import decimal
+import prepared
+import psycopg2
+
+
+@pytest.mark.usefixtures('psql_settings', scope='class')
+class TestPrepared():
+    """Class to test the prepared statements prepared.py."""
+
+    def test_normalize(self):
+        """Test to check that the literals of the DML statements are replaced by parameters."""
+
+        assert prepared.normalize("INSERT INTO t VALUES (1, 'it''s', -2.5e3, NULL) -- 'not' 3") == \
+            ("INSERT INTO t VALUES ($1, $2, -2.5e3, NULL) -- 'not' 3", ["1", "'it''s'"])
+        # typed literals, decimals and integers too large for an integer stay in the template
+        assert prepared.normalize("SELECT now() - INTERVAL '1 day', 'x', 1.5, 10000000000 WHERE a LIKE 'y'") == \
+            ("SELECT now() - INTERVAL '1 day', $1, 1.5, 10000000000 WHERE a LIKE $2", ["'x'", "'y'"])
+        assert prepared.normalize('UPDATE "t1" SET a = 2 WHERE "b 3" = \'x\'') == \
+            ('UPDATE "t1" SET a = $1 WHERE "b 3" = $2', ["2", "'x'"])
+        # the numbers of ORDER BY and GROUP BY are column positions
+        assert prepared.normalize("SELECT a, 'x' FROM t ORDER BY 1") == ("SELECT a, $1 FROM t ORDER BY 1", ["'x'"])
+
+        # utility statements cannot be prepared
+        assert prepared.normalize("GRANT SELECT ON t TO u") is None
+        assert prepared.normalize("SELECT E'a\\nb'") is None
+        assert prepared.normalize("SELECT $$x$$") is None
+
+    def test_run(self, psql_settings):
+        """Test to check that repeated statements run prepared, with the same transcript."""
+
+        config = psql_settings
+        statements = ["CREATE TEMP TABLE test_prepared (a int, b text);"]
+        statements.extend("INSERT INTO test_prepared VALUES ({i}, 'row {i}');".format(i=i) for i in range(20))
+        # cannot be prepared: run as it is
+        statements.extend("INSERT INTO test_prepared VALUES ({i}, 'x' || {i});".format(i=i) for i in range(3))
+        statements.append("SELECT count(*) FROM test_prepared WHERE b LIKE 'row %';")
+
+        with psycopg2.connect(host=config['host'], user=config['user'], password=config['password'],
+                              port=config.get('port', 5432)) as con:
+            res = script.PostgresqlScriptExecutor.run(con, "\n".join(statements), prepared=2)
+            assert [res[counter]["status"] for counter in res] == \
+                ["CREATE TABLE"] + ["INSERT 0 1"] * 23 + ["SELECT 1"]
+            # the EXECUTE sent is shorter than the INSERT
+            assert res[22]["bytes"] < len(statements[21])
+
+            with con.cursor() as cur:
+                cur.execute("SELECT count(*) FROM test_prepared")
+                assert cur.fetchone()[0] == 23
+                # deallocated at the end of the script
+                cur.execute("SELECT count(*) FROM pg_prepared_statements WHERE name LIKE 'postgresql_tools_%'")
+                assert cur.fetchone()[0] == 0
+
+                cache = prepared.PreparedStatementCache(cur, size=1)
+                for text in ("SELECT 1 AS a", "SELECT 2 AS a", "SELECT 1 AS b", "SELECT 2 AS b", "SELECT 3 AS a"):
+                    cur.execute(cache.query(text))
+                # the second template evicts the first one, which is seen again as a new one
+                assert cache.prepares == 2 and cache.evictions == 1 and cache.executions == 2
+                cur.execute("SELECT count(*) FROM pg_prepared_statements WHERE name LIKE 'postgresql_tools_%'")
+                assert cur.fetchone()[0] == 1
+                cache.close()
+
+                # a decimal after an integer in the same place is not cast to an integer
+                cache = prepared.PreparedStatementCache(cur)
+                values = []
+                for text in ("SELECT count(*) * 2 FROM test_prepared WHERE a < 3",
+                             "SELECT count(*) * 3 FROM test_prepared WHERE a < 2",
+                             "SELECT count(*) * 1.5 FROM test_prepared WHERE a < 2.4",
+                             "SELECT count(*) * 2.5 FROM test_prepared WHERE a < 1.5",
+                             "SELECT count(*) FROM test_prepared WHERE a < 3 AND now() - INTERVAL '1 day' < now()",
+                             "SELECT count(*) FROM test_prepared WHERE a < 4 AND now() - INTERVAL '1 day' < now()"):
+                    cur.execute(cache.query(text))
+                    values.append(cur.fetchone()[0])
+                assert values == [12, 12, decimal.Decimal("9.0"), decimal.Decimal("10.0"), 6, 7]
+                # the typed literal stays in the template, which postgresql does not refuse
+                assert cache.prepares == 2 and cache.executions == 2 and not cache._refused
+                cache.close()
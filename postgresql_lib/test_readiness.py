@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import time
+import socket
+import struct
+import pytest
+import itertools
+import threading
+import readiness
+
+
+def starting_server():
+    """Listening socket answering a startup message as a postgresql which is starting up."""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(5)
+    body = b"SFATAL\0C57P03\0Mthe database system is starting up\0\0"
+    error = b"E" + struct.pack("!i", 4 + len(body)) + body
+
+    def serve():
+        con, _ = server.accept()
+        con.recv(1024)
+        con.sendall(error)
+        con.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server
+
+
+@pytest.mark.usefixtures('psql_settings', scope='class')
+class TestReadiness():
+    """Class to test the readiness checks readiness.py."""
+
+    def test_probe(self, psql_settings):
+        """Test to check that the wire protocol probe tells a ready, a starting and a stopped server apart."""
+
+        config = psql_settings
+        assert readiness.probe(config['host'], config.get('port', 5432)) == readiness.READY
+
+        server = starting_server()
+        port = server.getsockname()[1]
+        try:
+            assert readiness.probe("127.0.0.1", port) == readiness.STARTING
+        finally:
+            server.close()
+
+        # nothing listens on the port of the closed server
+        assert readiness.probe("127.0.0.1", port) == readiness.DOWN
+
+    def test_backoff(self):
+        """Test to check that the checks start after milliseconds and that the deadline is kept."""
+
+        assert list(itertools.islice(readiness.delays(0.005, 0.04), 6)) == [0.005, 0.01, 0.02, 0.04, 0.04, 0.04]
+
+        calls = []
+        start = time.time()
+        assert readiness.wait_until(lambda: calls.append(time.time()) or len(calls) == 3, 10)
+        # 5 ms and 10 ms between the checks
+        assert time.time() - start < 0.5
+
+        start = time.time()
+        assert not readiness.wait_until(lambda: False, 0.2)
+        assert 0.2 <= time.time() - start < 0.5
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import io
+import json
+import report
+import collections
+
+TRANSCRIPT = collections.OrderedDict([
+    (1, {"command": "CREATE TABLE t (a int)", "status": "CREATE TABLE", "duration": 0.002, "rowcount": -1,
+         "bytes": 22}),
+    (2, {"command": "SELECT pg_sleep(1)", "status": "SELECT 1", "duration": 1.001, "rowcount": 1, "bytes": 18}),
+    (3, {"command": "INSERT INTO t VALUES (1)", "status": "INSERT 0 1", "duration": 0.001, "rowcount": 1,
+         "bytes": 24, "batched": 2}),
+    (4, {"command": "CREATE invalid_syntax"}),
+])
+
+
+class TestReport():
+    """Class to test the transcript report report.py."""
+
+    def test_json_lines(self):
+        """Test to check that each query of the transcript is written on its own line."""
+
+        f = io.StringIO()
+        report.write_report(f, report.records(TRANSCRIPT, "keycloak"))
+
+        lines = [json.loads(line) for line in f.getvalue().splitlines()]
+        assert [line["counter"] for line in lines] == [1, 2, 3, 4]
+        assert lines[1]["script"] == "keycloak"
+        assert lines[1]["duration"] == 1.001
+
+    def test_slowest(self):
+        """Test to check that the summary lists the slowest queries first and skips the failed query."""
+
+        records = list(report.records(TRANSCRIPT))
+
+        assert [record["counter"] for record in report.slowest(records, 2)] == [2, 1]
+        lines = report.summary(records, 2)
+        assert lines[0] == "3 queries in 1.004s, slowest:"
+        assert "SELECT pg_sleep(1)" in lines[1]
+        assert len(lines) == 3
+
+    def test_running_summary(self):
+        """Test to check that the running summary gives the same lines as the summary of the whole transcript."""
+
+        summary = report.Summary(2)
+        for counter, entry in TRANSCRIPT.items():
+            summary.add(report.record(counter, entry))
+        assert summary.lines() == report.summary(report.records(TRANSCRIPT), 2)
+        assert summary.queries == 3
@@ -13,10 +13,13 @@
 # DEALINGS IN THE SOFTWARE.
 #
 
+import os
 import script
 import pytest
 import logging
 import psycopg2
+import tempfile
+import threading
 
 # logging
 logging.basicConfig(
@@ -99,3 +102,172 @@ class TestScript():
             con.close()
             logger.info("Closed connection to postgresql")
 
+    def test_batching(self, psql_settings):
+        """Test to check that batched queries report the same transcript as queries sent one by one."""
+
+        script_create = "CREATE USER test_script;\nCREATE TABLE test_script (a int);\nGRANT SELECT ON test_script TO test_script;\n" \
+                        "INSERT INTO test_script VALUES (1);\nCOMMENT ON TABLE test_script IS 'batched';"
+        script_drop = "DROP TABLE test_script;\nDROP USER test_script;"
+        config = psql_settings
+
+        try:
+            logger.info("Connecting to postgres with user {user}".format(user=config['user']))
+
+            with psycopg2.connect(host=config['host'], user=config['user'], password=config['password']) as con:
+                res = script.PostgresqlScriptExecutor().run(con, script_create, batch_size=10, measure_rtt=True)
+                assert [res[counter]["status"] for counter in res] == \
+                    ["CREATE ROLE", "CREATE TABLE", "GRANT", "INSERT 0 1", "COMMENT"]
+                # the duration of a round trip is shared by its queries
+                assert res[1]["batched"] == 4 and res[5].get("batched") is None
+                assert res[1]["duration"] == res[4]["duration"]
+                assert 0 <= res[4]["server_duration"] <= res[4]["duration"]
+                assert res[4]["rowcount"] == 1 and res[4]["bytes"] == len("INSERT INTO test_script VALUES (1)")
+
+                res = script.PostgresqlScriptExecutor().run(con, script_drop, batch_size=10)
+                assert [res[counter]["status"] for counter in res] == ["DROP TABLE", "DROP ROLE"]
+                # the round trip is only measured on demand
+                assert "server_duration" not in res[1]
+
+        except Exception as e:
+            logger.debug(e)
+            if con:
+                con.rollback()
+            pytest.fail("Error {error}".format(error=e))
+        finally:
+            if con:
+                con.close()
+                logger.info("closed connection to postgresql")
+
+    def test_batched_tags(self, psql_settings):
+        """Test to check that the statuses predicted for a batch are those postgresql returns one by one."""
+
+        sql = "CREATE ROLE test_script_a;\nCREATE ROLE test_script_b;\nGRANT test_script_a TO test_script_b;\n" \
+              "GRANT ALL ON SCHEMA public TO test_script_b;\nREVOKE ALL ON SCHEMA public FROM test_script_b;\n" \
+              "REVOKE test_script_a FROM test_script_b;\nCREATE TABLE test_script_ctas (a) AS SELECT 1;\n" \
+              "DROP TABLE test_script_ctas;\nDROP ROLE test_script_b;\nDROP ROLE test_script_a;"
+        config = psql_settings
+
+        with psycopg2.connect(host=config['host'], user=config['user'], password=config['password'],
+                              port=config.get('port', 5432)) as con:
+            batched = script.PostgresqlScriptExecutor.run(con, sql, batch_size=20)
+            single = script.PostgresqlScriptExecutor.run(con, sql)
+        con.close()
+
+        assert [batched[counter]["status"] for counter in batched] == \
+            [single[counter]["status"] for counter in single]
+        assert single[3]["status"] == "GRANT ROLE" and single[7]["status"] == "SELECT 1"
+
+    def test_transactional(self, psql_settings):
+        """Test to check that a failing script leaves nothing behind in transactional mode."""
+
+        script_create = "CREATE USER test_script;\nCREATE TABLE test_script (a int);\n" \
+                        "INSERT INTO test_script VALUES (1);\nINSERT INTO test_script VALUES ('x');"
+        script_vacuum = "CREATE TABLE test_script (a int);\nVACUUM test_script;\nCREATE invalid_syntax;"
+        config = psql_settings
+
+        try:
+            logger.info("Connecting to postgres with user {user}".format(user=config['user']))
+
+            with psycopg2.connect(host=config['host'], user=config['user'], password=config['password']) as con:
+                for batch_size in (1, 10):
+                    with pytest.raises(script.ScriptExecutionError) as e:
+                        script.PostgresqlScriptExecutor().run(con, script_create, batch_size=batch_size,
+                                                              insert_rows=10, transactional=True)
+                    assert not e.value.committed
+                    transcript = e.value.transcript
+                    # the failing query is last, without status
+                    assert [transcript[counter].get("status") for counter in transcript] == \
+                        ["CREATE ROLE", "CREATE TABLE", "INSERT 0 1", None]
+
+                    with con.cursor() as cur:
+                        cur.execute("SELECT 1 FROM pg_roles WHERE rolname='test_script'")
+                        assert cur.rowcount == 0
+
+                # VACUUM cannot run inside a transaction, the table created before it is committed
+                with pytest.raises(script.ScriptExecutionError) as e:
+                    script.PostgresqlScriptExecutor().run(con, script_vacuum, transactional=True)
+                assert e.value.committed
+                script.PostgresqlScriptExecutor().run(con, "DROP TABLE test_script;")
+
+                # the transaction settings of the connection are restored
+                con.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE
+                for transactional in (False, True):
+                    script.PostgresqlScriptExecutor().run(con, "SELECT 1;", transactional=transactional)
+                    assert not con.autocommit
+                    assert con.isolation_level == psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE
+
+        except Exception as e:
+            logger.debug(e)
+            if con:
+                con.rollback()
+            pytest.fail("Error {error}".format(error=e))
+        finally:
+            if con:
+                con.close()
+                logger.info("closed connection to postgresql")
+
+    def test_run_file(self, psql_settings):
+        """Test to check that a mapped script file runs as the same script in a string, COPY data included."""
+
+        script_file = "CREATE TEMP TABLE test_script (a int, b text);\nCOPY test_script FROM STDIN;\n1\tone\n\\.\n" \
+                      "INSERT INTO test_script VALUES (2, 'two;2');\nSELECT count(*) FROM test_script;\n"
+        config = psql_settings
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "script.sql")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(script_file)
+
+            with psycopg2.connect(host=config['host'], user=config['user'], password=config['password'],
+                                  port=config.get('port', 5432)) as con:
+                res = script.PostgresqlScriptExecutor.run_file(con, path)
+                assert [res[counter]["status"] for counter in res] == \
+                    ["CREATE TABLE", "COPY 1", "INSERT 0 1", "SELECT 1"]
+                # the commands are read from the mapped file
+                assert res[3]["command"] == "INSERT INTO test_script VALUES (2, 'two;2')"
+
+                with con.cursor() as cur:
+                    cur.execute("SELECT b FROM test_script ORDER BY a")
+                    assert [row[0] for row in cur] == ["one", "two;2"]
+
+    def test_lock_timeout(self, psql_settings):
+        """Test to check that a query failing on lock timeout is retried, and its wait reported in the transcript."""
+
+        config = psql_settings
+        connect = dict(host=config['host'], user=config['user'], password=config['password'],
+                       port=config.get('port', 5432))
+
+        with psycopg2.connect(**connect) as con, psycopg2.connect(**connect) as blocker:
+            script.PostgresqlScriptExecutor().run(con, "CREATE TABLE test_script (a int);")
+            try:
+                for transactional in (False, True):
+                    with blocker.cursor() as cur:
+                        cur.execute("LOCK TABLE test_script IN ACCESS EXCLUSIVE MODE")
+                    # the lock is released while the query retries
+                    release = threading.Timer(0.3, blocker.rollback)
+                    release.start()
+                    res = script.PostgresqlScriptExecutor().run(con, "SELECT 1;\nINSERT INTO test_script VALUES (1);",
+                                                                transactional=transactional, lock_timeout=50,
+                                                                lock_retries=50)
+                    release.join()
+                    assert res[2]["status"] == "INSERT 0 1"
+                    assert res[2]["retries"] > 0 and res[2]["lock_wait"] >= 0.2
+                    assert "retries" not in res[1]
+
+                # without enough retries the query fails
+                with blocker.cursor() as cur:
+                    cur.execute("LOCK TABLE test_script IN ACCESS EXCLUSIVE MODE")
+                with pytest.raises(script.ScriptExecutionError):
+                    script.PostgresqlScriptExecutor().run(con, "INSERT INTO test_script VALUES (2);", lock_timeout=50,
+                                                          lock_retries=1)
+                blocker.rollback()
+
+                with con.cursor() as cur:
+                    cur.execute("SELECT count(*) FROM test_script")
+                    assert cur.fetchone()[0] == 2
+                    # the timeouts of the session are restored
+                    cur.execute("SHOW lock_timeout")
+                    assert cur.fetchone()[0] == "0"
+            finally:
+                blocker.rollback()
+                script.PostgresqlScriptExecutor().run(con, "DROP TABLE test_script;")
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import io
+import os
+import pytest
+import splitter
+import logging
+import tempfile
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.test_splitter")
+logger.setLevel(logging.INFO)
+
+SCRIPT = """-- provisioning; of plop1
+CREATE USER plop1 WITH PASSWORD 'pl;op''1';
+/* outer /* nested; */ still a comment; */ CREATE DATABASE plop1;
+CREATE FUNCTION f() RETURNS int AS $body$ BEGIN RETURN 1; END; $body$ LANGUAGE plpgsql;
+CREATE FUNCTION g() RETURNS text AS $$ SELECT 'a;b' $$ LANGUAGE sql;
+SELECT E'it\\'s; here', "we;ird""id", foo$bar FROM t WHERE x = $1;;
+;
+GRANT ALL ON DATABASE plop1 TO plop1
+"""
+
+EXPECTED = [
+    "CREATE USER plop1 WITH PASSWORD 'pl;op''1'",
+    "CREATE DATABASE plop1",
+    "CREATE FUNCTION f() RETURNS int AS $body$ BEGIN RETURN 1; END; $body$ LANGUAGE plpgsql",
+    "CREATE FUNCTION g() RETURNS text AS $$ SELECT 'a;b' $$ LANGUAGE sql",
+    "SELECT E'it\\'s; here', \"we;ird\"\"id\", foo$bar FROM t WHERE x = $1",
+    "GRANT ALL ON DATABASE plop1 TO plop1",
+]
+
+
+class TestSplitter():
+    """Class to test the sql statement splitter splitter.py."""
+
+    def test_split_string(self):
+        """Test to check that semicolons in quotes, dollar quotes and comments do not end a statement."""
+
+        statements = list(splitter.iter_statements(SCRIPT))
+
+        assert [statement.text for statement in statements] == EXPECTED
+        for statement in statements:
+            assert SCRIPT[statement.offset:statement.offset + len(statement.text)] == statement.text
+
+    def test_split_chunks(self):
+        """Test to check that tokens cut by the chunk boundaries are lexed as in a single buffer."""
+
+        expected = [(statement.offset, statement.text) for statement in splitter.iter_statements(SCRIPT)]
+
+        for chunk_size in range(1, 48):
+            statements = splitter.iter_statements(io.StringIO(SCRIPT), chunk_size)
+            assert [(statement.offset, statement.text) for statement in statements] == expected
+
+    def test_buffer_stays_small(self):
+        """Test to check that the buffer only holds the statement being scanned, whatever the script size."""
+
+        script = io.StringIO("INSERT INTO t VALUES (1, 'x');\n" * 100000)
+        split = splitter.StatementSplitter(script, chunk_size=4096)
+
+        count = 0
+        for statement in split:
+            count += 1
+            assert len(split._buf) <= 4096 + len(statement.text) + 1
+
+        assert count == 100000
+
+    def test_unterminated(self):
+        """Test to check that an unterminated quote is sent as is, for postgresql to report the error."""
+
+        statements = list(splitter.iter_statements("SELECT 1;\nSELECT 'oops;\nSELECT 2;"))
+
+        assert [statement.text for statement in statements] == ["SELECT 1", "SELECT 'oops;\nSELECT 2;"]
+
+    def test_unbalanced_parenthesis(self):
+        """Test to check that an unbalanced parenthesis raises instead of merging the statements after it."""
+
+        rule = "CREATE RULE r AS ON INSERT TO t DO ALSO (SELECT 1; SELECT 2);\nSELECT 3;"
+        assert [statement.text for statement in splitter.iter_statements(rule)] == \
+            ["CREATE RULE r AS ON INSERT TO t DO ALSO (SELECT 1; SELECT 2)", "SELECT 3"]
+
+        script = "SELECT 1;\nSELECT (1;\nSELECT 2;\nSELECT 3;"
+        for source in (script, io.StringIO(script), script.encode("utf-8")):
+            statements = splitter.iter_statements(source)
+            assert next(statements).text == "SELECT 1"
+            with pytest.raises(Exception) as e:
+                next(statements)
+            assert "offset 17" in "{e}".format(e=e.value)
+
+    def test_copy_from_stdin(self):
+        """Test to check that the inline data of COPY ... FROM STDIN is streamed and not split into statements."""
+
+        script = "COPY t (a, b) FROM stdin;\n1\ta;b\n2\tc\n\\.\nSELECT 1;\nCOPY u FROM STDIN;\n3\n\\.\nSELECT 2;\n"
+
+        for chunk_size in (1, 3, 7, 4096):
+            statements = splitter.iter_statements(io.StringIO(script), chunk_size)
+
+            copy = next(statements)
+            assert copy.text == "COPY t (a, b) FROM stdin"
+            data = []
+            while True:
+                chunk = copy.copy_data.read(2)
+                if not chunk:
+                    break
+                data.append(chunk)
+            assert "".join(data) == "1\ta;b\n2\tc\n"
+
+            # unread data is skipped
+            assert [statement.text for statement in statements] == ["SELECT 1", "COPY u FROM STDIN", "SELECT 2"]
+
+            # read() returns all the data, not only the part in the buffer
+            statements = splitter.iter_statements(io.StringIO(script), chunk_size)
+            assert next(statements).copy_data.read() == "1\ta;b\n2\tc\n"
+
+    def test_split_buffer(self):
+        """Test to check that a mapped file is split as the same script in a string, with offsets in bytes."""
+
+        script = "SELECT 'é;' AS café$x, $é$ a;b $é$;\n" + SCRIPT
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "script.sql")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(script)
+            buffer = splitter.map_file(path)
+
+            statements = list(splitter.iter_statements(buffer))
+            # located, not decoded yet
+            assert statements[0]._text is None
+            assert [statement.text for statement in statements] == \
+                [statement.text for statement in splitter.iter_statements(script)]
+            assert statements[0].text == "SELECT 'é;' AS café$x, $é$ a;b $é$"
+            for statement in statements:
+                assert buffer[statement.offset:statement.end] == statement.text.encode("utf-8")
+
+            open(path, "w").close()
+            assert list(splitter.iter_statements(splitter.map_file(path))) == []
+
+        copy = next(splitter.iter_statements(b"COPY t FROM STDIN;\n1\n\\.\nSELECT 1;"))
+        assert copy.text == "COPY t FROM STDIN" and copy.copy_data.read() == b"1\n"
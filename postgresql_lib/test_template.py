@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import pool
+import parallel
+import splitter
+import template
+import script as pgscript
+import psycopg2
+import pytest
+import logging
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.test_template")
+logger.setLevel(logging.INFO)
+
+
+@pytest.mark.usefixtures('psql_settings', scope='class')
+class TestTemplate():
+    """Class to test the templated scripts template.py."""
+
+    def test_render(self, psql_settings):
+        """Test to check that the parameters are quoted and that strings, comments and casts are left as is."""
+
+        config = psql_settings
+        source = "CREATE USER :\"tenant\" -- owner :\"tenant\"\n" \
+                 "WITH PASSWORD :'password';\n" \
+                 "SELECT ':\"tenant\"', 'a'::\"text\", $$ :'password' $$;\n" \
+                 "COPY t FROM STDIN;\n:'password'\n\\.\n"
+        script_template = template.ScriptTemplate(source)
+        assert script_template.names == {"tenant", "password"}
+
+        with psycopg2.connect(host=config['host'], user=config['user'], password=config['password'],
+                              port=config.get('port', 5432)) as con:
+            script = script_template.render(con, {"tenant": 'plop"; DROP', "password": "it's"})
+            with pytest.raises(Exception):
+                script_template.render(con, {"tenant": "plop"})
+        con.close()
+
+        assert script == "CREATE USER \"plop\"\"; DROP\" -- owner :\"tenant\"\n" \
+                         "WITH PASSWORD 'it''s'\n;\n" \
+                         "SELECT ':\"tenant\"', 'a'::\"text\", $$ :'password' $$\n;\n" \
+                         "COPY t FROM STDIN\n;\n:'password'\n\\.\n"
+
+    def test_trailing_comment(self, psql_settings):
+        """Test to check that a statement ending with a -- comment does not swallow the next one."""
+
+        config = psql_settings
+        script_template = template.ScriptTemplate("CREATE USER :\"tenant\" -- the tenant\n;\n"
+                                                  "COMMENT ON ROLE :\"tenant\" IS :'comment';")
+
+        with psycopg2.connect(host=config['host'], user=config['user'], password=config['password'],
+                              port=config.get('port', 5432)) as con:
+            con.autocommit = True
+            script = script_template.render(con, {"tenant": "test_template_comment", "comment": "plop"})
+            try:
+                pgscript.PostgresqlScriptExecutor.run(con, script)
+                with con.cursor() as cur:
+                    cur.execute("SELECT shobj_description(oid, 'pg_authid') FROM pg_roles "
+                                "WHERE rolname = 'test_template_comment'")
+                    comment = cur.fetchone()
+            finally:
+                with con.cursor() as cur:
+                    cur.execute("DROP USER IF EXISTS test_template_comment")
+        con.close()
+
+        assert [statement.text for statement in splitter.iter_statements(script)] == \
+            ["CREATE USER \"test_template_comment\" -- the tenant",
+             "COMMENT ON ROLE \"test_template_comment\" IS 'plop'"]
+        assert comment == ("plop",)
+
+    def test_copy_data_limit(self, monkeypatch):
+        """Test to check that the COPY data of a template is bounded."""
+
+        source = "COPY t FROM STDIN;\n" + "plop\n" * 10 + "\\.\n"
+        assert len(template.ScriptTemplate(source)._statements[0][1]) == 50
+        monkeypatch.setattr(template, "MAX_COPY_DATA", 20)
+        with pytest.raises(Exception):
+            template.ScriptTemplate(source)
+
+    def test_load_parameters(self, tmpdir):
+        """Test to check that the rows of parameters are read from csv and json files."""
+
+        csv_file = tmpdir.join("tenants.csv")
+        csv_file.write("name,tenant\nfirst,plop1\nsecond,plop2\n")
+        json_file = tmpdir.join("tenants.json")
+        json_file.write('[{"tenant": "plop1"}, {"tenant": "plop2"}]')
+        invalid_file = tmpdir.join("invalid.json")
+        invalid_file.write('{"tenant": "plop1"}')
+
+        assert template.load_parameters(str(csv_file)) == [{"name": "first", "tenant": "plop1"},
+                                                           {"name": "second", "tenant": "plop2"}]
+        assert template.load_parameters(str(json_file)) == [{"tenant": "plop1"}, {"tenant": "plop2"}]
+        assert [pair.name for pair in parallel.template_pairs("t.sql", None, template.load_parameters(str(csv_file)))] \
+            == ["first", "second"]
+        assert [pair.name for pair in parallel.template_pairs("t.sql", None, [{}, {}])] == ["1", "2"]
+        with pytest.raises(Exception):
+            template.load_parameters(str(invalid_file))
+
+    def test_run(self, psql_settings, tmpdir):
+        """Test to check that a template runs once per row, and that a failing row is rolled back alone."""
+
+        script = tmpdir.join("tenant.sql")
+        script.write("CREATE USER :\"tenant\";\nCOMMENT ON ROLE :\"tenant\" IS :'comment';")
+        rollback_script = tmpdir.join("tenant_rollback.sql")
+        rollback_script.write("DROP USER IF EXISTS :\"tenant\";")
+        config = psql_settings
+        rows = [{"tenant": "test_template_{i}".format(i=i), "comment": "tenant {i}'s".format(i=i)} for i in range(4)]
+
+        with pool.ConnectionPool(maxconn=2, host=config['host'], user=config['user'], password=config['password'],
+                                 port=config.get('port', 5432)) as connections:
+            # the role of the last row exists already, the row fails and is rolled back
+            with connections.connection() as con:
+                with con.cursor() as cur:
+                    cur.execute("CREATE USER test_template_3")
+                con.commit()
+            pairs = parallel.template_pairs(str(script), str(rollback_script), rows)
+            res = parallel.ParallelScriptRunner(connections, workers=2).run(pairs)
+
+            with connections.connection() as con:
+                with con.cursor() as cur:
+                    cur.execute("SELECT rolname, shobj_description(oid, 'pg_authid') FROM pg_roles "
+                                "WHERE rolname LIKE 'test\\_template\\_%' ORDER BY rolname")
+                    roles = cur.fetchall()
+                    for role, _ in roles:
+                        cur.execute("DROP USER \"{role}\"".format(role=role))
+                con.commit()
+
+        assert [res[name]["status"] for name in ["1", "2", "3", "4"]] == \
+            [parallel.DONE, parallel.DONE, parallel.DONE, parallel.ROLLED_BACK]
+        assert roles == [("test_template_{i}".format(i=i), "tenant {i}'s".format(i=i)) for i in range(3)]
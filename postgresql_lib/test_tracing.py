@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import io
+import script
+import tracing
+import psycopg2
+import pytest
+import logging
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.test_tracing")
+logger.setLevel(logging.INFO)
+
+
+@pytest.mark.usefixtures('psql_settings', scope='class')
+class TestTracing():
+    """Class to test the statement hooks tracing.py."""
+
+    def test_hooks(self, psql_settings):
+        """Test to check that the hooks receive each query, with its offset, status and error."""
+
+        config = psql_settings
+        calls = []
+        hooks = tracing.StatementHooks(before=lambda *args: calls.append(("before",) + args),
+                                       after=lambda *args: calls.append(("after",) + args))
+        sql = "SELECT 1;\nSELECT 2;\nSELECT 1/0;\nSELECT 3;"
+
+        with psycopg2.connect(host=config['host'], user=config['user'], password=config['password'],
+                              port=config.get('port', 5432)) as con:
+            with pytest.raises(script.ScriptExecutionError):
+                script.PostgresqlScriptExecutor.run(con, sql, hooks=hooks)
+        con.close()
+
+        assert [call[:3] for call in calls] == [("before", 1, 0), ("after", 1, 0), ("before", 2, 10),
+                                                ("after", 2, 10), ("before", 3, 20), ("after", 3, 20)]
+        assert [call[4:] for call in calls if call[0] == "after"][:2] == [("SELECT 1", None), ("SELECT 1", None)]
+        assert calls[-1][4] is None
+        assert calls[-1][5].pgcode == "22012"
+        assert all(call[3] >= 0 for call in calls if call[0] == "after")
+
+    def test_spans(self, psql_settings):
+        """Test to check the spans of the queries, children of the caller, and that a failing export is ignored."""
+
+        config = psql_settings
+        spans = []
+        emitter = tracing.SpanEmitter.from_traceparent("00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01",
+                                                       spans.append)
+
+        def broken_export(span):
+            raise Exception("collector unavailable")
+
+        with psycopg2.connect(host=config['host'], user=config['user'], password=config['password'],
+                              port=config.get('port', 5432)) as con:
+            script.PostgresqlScriptExecutor.run(con, "SELECT 1;\nSELECT 2;", batch_size=2, hooks=emitter)
+            with pytest.raises(script.ScriptExecutionError):
+                script.PostgresqlScriptExecutor.run(con, "CREATE invalid_syntax;", hooks=emitter)
+            script.PostgresqlScriptExecutor.run(con, "SELECT 1;", hooks=tracing.SpanEmitter(broken_export))
+        con.close()
+
+        assert len(spans) == 3
+        assert all(span["trace_id"] == "4bf92f3577b34da6a3ce929d0e0e4736" for span in spans)
+        assert all(span["parent_span_id"] == "00f067aa0ba902b7" for span in spans)
+        assert len(set(span["span_id"] for span in spans)) == 3
+        assert all(span["start_time_unix_nano"] <= span["end_time_unix_nano"] for span in spans)
+        assert [span["attributes"]["db.statement.index"] for span in spans] == [1, 2, 1]
+        assert spans[1]["status"] == {"code": tracing.STATUS_OK}
+        assert spans[1]["attributes"]["db.response.status"] == "SELECT 1"
+        assert spans[2]["status"]["code"] == tracing.STATUS_ERROR
+        assert spans[2]["attributes"]["db.response.status_code"] == "42601"
+
+        with pytest.raises(Exception):
+            tracing.SpanEmitter.from_traceparent("invalid", spans.append)
+
+    def test_file_offsets(self, psql_settings):
+        """Test to check that the spans of a script read from a file object have the offsets of its queries."""
+
+        config = psql_settings
+        spans = []
+
+        with psycopg2.connect(host=config['host'], user=config['user'], password=config['password'],
+                              port=config.get('port', 5432)) as con:
+            with pytest.raises(script.ScriptExecutionError):
+                script.PostgresqlScriptExecutor.run(con, io.StringIO("SELECT 1;\nSELECT 2;\nSELECT 1/0;"),
+                                                    hooks=tracing.SpanEmitter(spans.append))
+        con.close()
+
+        assert [span["attributes"]["db.statement.offset"] for span in spans] == [0, 10, 20]
+        assert [span["status"]["code"] for span in spans] == [tracing.STATUS_OK, tracing.STATUS_OK,
+                                                              tracing.STATUS_ERROR]
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import io
+import script
+import pytest
+import psycopg2
+import splitter
+import transcript
+
+
+@pytest.mark.usefixtures('psql_settings', scope='class')
+class TestTranscript():
+    """Class to test the transcript transcript.py."""
+
+    def test_entries(self):
+        """Test to check that the entries have the shape of the dicts of the former transcript."""
+
+        source = "CREATE TABLE t (a int);\nINSERT INTO t VALUES (1);\nSELECT 1/0;"
+        statements = list(splitter.iter_statements(source))
+        res = transcript.Transcript(source)
+        res.rtt = 0.001
+        res.complete(res.add(statements[0]), "CREATE TABLE", 0.004, -1, 22)
+        res.complete(res.add(statements[1]), "INSERT 0 1", 0.004, 1, 25, batched=2)
+        res.add(statements[2])
+
+        assert list(res) == [1, 2, 3] and len(res) == 3
+        assert res[1] == {"command": "CREATE TABLE t (a int)", "status": "CREATE TABLE", "duration": 0.004,
+                          "rowcount": -1, "bytes": 22, "server_duration": 0.003}
+        assert res[2]["duration"] == 0.002 and res[2]["batched"] == 2
+        assert res[2]["server_duration"] == pytest.approx(0.0015)
+        assert res[3] == {"command": "SELECT 1/0"}
+        assert list(res.as_dict()) == [1, 2, 3]
+        with pytest.raises(KeyError):
+            res[4]
+
+        # a file source is not kept, its commands are
+        res = transcript.Transcript(io.StringIO(source))
+        res.add(statements[1])
+        assert res[1]["command"] == "INSERT INTO t VALUES (1)"
+
+    def test_sink(self):
+        """Test to check that the entries are passed to the sink and forgotten unless they are held."""
+
+        source = ";\n".join("SELECT {i}".format(i=i) for i in range(5))
+        statements = list(splitter.iter_statements(source))
+        received = []
+        res = transcript.Transcript(source, sink=lambda counter, entry: received.append((counter, entry)),
+                                    retain=False)
+        for statement in statements[:3]:
+            res.complete(res.add(statement), "SELECT 1", 0.001, 1, 8)
+        assert [counter for counter, entry in received] == [1, 2, 3]
+        assert len(res) == 0 and res.counter == 3
+
+        # held, e.g. until the ledger records them
+        res.hold = True
+        res.complete(res.add(statements[3]), "SELECT 1", 0.001, 1, 8)
+        res.add(statements[4])
+        res.close()
+        assert received[-1] == (5, {"command": "SELECT 4"})
+        assert list(res) == [4, 5]
+        res.release(4)
+        assert list(res) == [5]
+
+    def test_run(self, psql_settings):
+        """Test to check that the executor streams the transcript to the sink."""
+
+        config = psql_settings
+        received = []
+        with psycopg2.connect(host=config['host'], user=config['user'], password=config['password'],
+                              port=config.get('port', 5432)) as con:
+            with pytest.raises(script.ScriptExecutionError) as e:
+                script.PostgresqlScriptExecutor.run(con, "SELECT 1;\nSELECT 2;\nCREATE invalid_syntax;",
+                                                    sink=lambda counter, entry: received.append(entry),
+                                                    retain=False)
+            assert [entry.get("status") for entry in received] == ["SELECT 1", "SELECT 1", None]
+            assert received[2]["command"] == "CREATE invalid_syntax"
+            assert len(e.value.transcript) == 0
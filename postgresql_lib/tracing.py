@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import os
+import re
+import time
+import logging
+import binascii
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.tracing")
+
+# span status codes, as in OpenTelemetry
+STATUS_OK = "OK"
+STATUS_ERROR = "ERROR"
+
+# version-trace_id-parent_id-flags of a W3C traceparent header
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+class StatementHooks(object):
+    """
+    Functions called around each query run by the executor, e.g. to correlate the slow queries with the latency of an
+    application.
+
+    before(index, offset) is called when a query is added to the transcript and after(index, offset, duration, status,
+    error) once it completed, with its status message and a None error, or failed, with a None status and the
+    exception. index is the counter of the query in the transcript, offset its offset in the script (in characters,
+    in bytes for a mapped file) and duration in seconds. The queries sent in a batch or grouped in a multi-row INSERT
+    are added once their round trip returned, their before hook follows their execution.
+
+    hooks = StatementHooks(after=lambda index, offset, duration, status, error: print(index, duration, status))
+    PostgresqlScriptExecutor.run(con, script, hooks=hooks)
+
+    Subclasses override before_statement and after_statement instead. The hooks run in the thread of the executor,
+    they must be thread safe when they are shared, e.g. by the workers of a parallel.ParallelScriptRunner.
+    """
+
+    def __init__(self, before=None, after=None):
+        """
+
+        :param before: function called before each query, None to skip
+        :param after: function called after each query, None to skip
+        """
+        self.before = before
+        self.after = after
+
+    def before_statement(self, index, offset):
+        if self.before is not None:
+            self.before(index, offset)
+
+    def after_statement(self, index, offset, duration, status, error):
+        if self.after is not None:
+            self.after(index, offset, duration, status, error)
+
+
+class SpanEmitter(StatementHooks):
+    """
+    Hooks emitting a span per query, shaped as the spans of OpenTelemetry, to a function exporting them, e.g. writing
+    them as JSON Lines or handing them to an OpenTelemetry SDK:
+
+    {"name": "postgresql.statement", "trace_id": "4bf92f3577b34da6a3ce929d0e0e4736", "span_id": "00f067aa0ba902b7",
+     "parent_span_id": "b7ad6b7169203331", "start_time_unix_nano": ..., "end_time_unix_nano": ...,
+     "status": {"code": "OK"}, "attributes": {"db.system": "postgresql", "db.statement.index": 3,
+     "db.statement.offset": 120, "db.response.status": "INSERT 0 1"}}
+
+    The status of a failed query is {"code": "ERROR", "message": ...} and its sqlstate is added as
+    db.response.status_code. To attach the queries to the trace of the application running the script, give the trace
+    and the parent span, e.g. with from_traceparent.
+    """
+
+    def __init__(self, export, trace_id=None, parent_span_id=None, name="postgresql.statement"):
+        """
+
+        :param export: function called with each span, a dict
+        :param trace_id: trace of the spans, 32 hexadecimal digits, a new one if None
+        :param parent_span_id: span of the caller, 16 hexadecimal digits, None for root spans
+        :param name: name of the spans
+        """
+        super(SpanEmitter, self).__init__()
+        self.export = export
+        self.trace_id = trace_id or _random_id(16)
+        self.parent_span_id = parent_span_id
+        self.name = name
+
+    @staticmethod
+    def from_traceparent(traceparent, export, **kwargs):
+        """
+        :param traceparent: W3C traceparent header of the caller, e.g. "00-<trace id>-<parent id>-01"
+        :param export: function called with each span
+        :param kwargs: other arguments of SpanEmitter
+        :return: SpanEmitter whose spans are children of the caller
+        """
+        m = _TRACEPARENT.match(traceparent.strip().lower())
+        if m is None:
+            raise Exception("Invalid traceparent {header}".format(header=traceparent))
+        return SpanEmitter(export, m.group(1), m.group(2), **kwargs)
+
+    def after_statement(self, index, offset, duration, status, error):
+        end = time.time()
+        attributes = {"db.system": "postgresql", "db.statement.index": index, "db.statement.offset": offset}
+        if error is None:
+            attributes["db.response.status"] = status
+            span_status = {"code": STATUS_OK}
+        else:
+            if getattr(error, "pgcode", None):
+                attributes["db.response.status_code"] = error.pgcode
+            span_status = {"code": STATUS_ERROR, "message": "{e}".format(e=error).strip()}
+        span = {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": _random_id(8),
+            "parent_span_id": self.parent_span_id,
+            "start_time_unix_nano": int((end - duration) * 1e9),
+            "end_time_unix_nano": int(end * 1e9),
+            "status": span_status,
+            "attributes": attributes,
+        }
+        try:
+            self.export(span)
+        except Exception as e:
+            # tracing must not make the script fail
+            logger.debug("Cannot export the span of query {index}: {e}".format(index=index, e=e))
+
+
+def _random_id(size):
+    """Random identifier of size bytes, in hexadecimal."""
+    return binascii.hexlify(os.urandom(size)).decode("ascii")
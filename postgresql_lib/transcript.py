@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import time
+import array
+import logging
+import collections
+import collections.abc
+
+from postgresql_lib import splitter
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+logger = logging.getLogger("postgres_tools.postgresql_lib.transcript")
+
+# status of the entries whose query did not complete
+_NO_STATUS = -1
+
+
+class Transcript(collections.abc.Mapping):
+    """
+    Transcript of the queries executed by a script, mapping 1, 2, ... to {"command": ..., "status": ...,
+    "duration": ..., "rowcount": ..., "bytes": ..., "server_duration": ...}, "batched": ... is added for the queries
+    sent in a batch, "retries": ... and "lock_wait": ... for the queries retried on lock timeout. The entry of a query
+    which failed only has its command.
+
+    The entries are kept in parallel arrays and built on access, so a script of millions of queries costs a few
+    dozen bytes per query instead of a dict each: the commands are offsets into the source when it is a string or a
+    bytes buffer, e.g. a mapped file, the statuses are interned. With a sink, each entry is passed to it once complete
+    and, unless retain is True, forgotten right away. With metrics, the duration and size of each query are counted
+    once complete. With hooks, each query is passed to them when added and once complete or failed, see
+    tracing.StatementHooks.
+
+    transcript = Transcript(script)
+    counter = transcript.add(statement)
+    transcript.complete(counter, "INSERT 0 1", 0.001, 1, 35)
+    """
+
+    def __init__(self, source=None, sink=None, retain=True, metrics=None, hooks=None):
+        """
+
+        :param source: the script when it is a string or a bytes buffer, the commands are read from it instead of
+            being copied
+        :param sink: function called with the counter and the entry of each query once it is complete, and of the
+            failed query by close
+        :param retain: keep the entries once passed to the sink
+        :param metrics: metrics.MetricsRegistry counting the queries
+        :param hooks: tracing.StatementHooks called around each query
+        """
+        self.source = source if isinstance(source, str) or splitter.is_buffer(source) else None
+        self.sink = sink
+        self.retain = retain or sink is None
+        self.metrics = metrics
+        self.hooks = hooks
+        # time the last query was added, to measure the duration of a failure when there are hooks
+        self._added = 0.0
+        # keep the entries passed to the sink until release, e.g. until the ledger recorded them
+        self.hold = False
+        # network round trip subtracted from the durations, see script._round_trip
+        self.rtt = None
+        # number of queries added, the counter of the last one
+        self.counter = 0
+        # counter of the first entry kept, minus 1
+        self._first = 0
+        # number of entries passed to the sink
+        self._emitted = 0
+        self._statuses = []
+        self._status_index = {}
+        self._clear()
+
+    def add(self, statement):
+        """
+        Add a query before executing it.
+
+        :param statement: splitter.Statement
+        :return: counter of the query
+        """
+        if isinstance(statement, splitter.BufferStatement) and statement.buffer is self.source:
+            # in bytes, decoded on access
+            self._offsets.append(statement.offset)
+            self._lengths.append(statement.end - statement.offset)
+        elif isinstance(self.source, str) and self.source.startswith(statement.text, statement.offset):
+            self._offsets.append(statement.offset)
+            self._lengths.append(len(statement.text))
+        else:
+            self._offsets.append(-1)
+            self._lengths.append(0)
+            self._commands[len(self._lengths) - 1] = statement.text
+        self._status.append(_NO_STATUS)
+        self._durations.append(0.0)
+        self._rowcounts.append(-1)
+        self._bytes.append(0)
+        self._batched.append(1)
+        self._retries.append(0)
+        self._waits.append(0.0)
+        self.counter += 1
+        if self.hooks is not None:
+            # the command of a file object is copied, its offset in the script is only kept for the hooks
+            self._positions.append(statement.offset)
+            self._added = time.time()
+            self.hooks.before_statement(self.counter, statement.offset)
+        return self.counter
+
+    def complete(self, counter, status, duration, rowcount, size, batched=1, retries=0, waited=0.0):
+        """
+        Record the result of a query.
+
+        :param counter: counter of the query, see add
+        :param status: status message of the query
+        :param duration: seconds between sending the query and receiving its result, shared by the queries sent in
+            the same round trip
+        :param rowcount: number of rows returned or affected, -1 if not applicable or unknown
+        :param size: number of bytes of the query, and of the inline data of COPY ... FROM STDIN
+        :param batched: number of queries sent in the same round trip
+        :param retries: number of times the query failed on lock timeout before succeeding
+        :param waited: seconds spent in the failed attempts and their backoffs, not included in duration
+        """
+        i = counter - self._first - 1
+        index = self._status_index.get(status)
+        if index is None:
+            index = self._status_index[status] = len(self._statuses)
+            self._statuses.append(status)
+        self._status[i] = index
+        self._durations[i] = duration / batched
+        self._rowcounts[i] = rowcount
+        self._bytes[i] = size
+        self._batched[i] = batched
+        self._retries[i] = retries
+        self._waits[i] = waited
+        if self.metrics is not None:
+            self.metrics.observe_statement(duration / batched, size)
+        if self.hooks is not None:
+            self.hooks.after_statement(counter, self._positions[i], duration / batched, status, None)
+        if self.sink is not None:
+            self._emit(counter)
+
+    def fail(self, error):
+        """
+        Pass the failure of the last query added to the hooks, if it did not complete.
+
+        :param error: exception raised by the query
+        """
+        if self.hooks is None or self.counter == self._first:
+            return
+        i = self.counter - self._first - 1
+        if self._status[i] == _NO_STATUS:
+            self.hooks.after_statement(self.counter, self._positions[i], time.time() - self._added, None, error)
+
+    def release(self, counter):
+        """
+        Forget the entries up to counter if they are not retained, once they are no longer needed.
+
+        :param counter: counter of the last entry which can be forgotten
+        """
+        if self.retain or counter <= self._first:
+            return
+        counter = min(counter, self._emitted)
+        n = counter - self._first
+        if n >= len(self._lengths):
+            self._clear()
+        else:
+            for values in (self._offsets, self._lengths, self._status, self._durations, self._rowcounts,
+                           self._bytes, self._batched, self._retries, self._waits, self._positions):
+                del values[:n]
+            self._commands = {i - n: text for i, text in self._commands.items() if i >= n}
+        self._first = counter
+
+    def close(self):
+        """Pass the entries of the queries which did not complete, i.e. the failed query, to the sink."""
+        if self.sink is not None:
+            while self._emitted < self.counter:
+                self._emit(self._emitted + 1)
+
+    def as_dict(self):
+        """
+        :return: ordered dict of the entries kept, mapping 1, 2, ... to dicts
+        """
+        return collections.OrderedDict(self.items())
+
+    def __getitem__(self, counter):
+        if not isinstance(counter, int) or not self._first < counter <= self.counter:
+            raise KeyError(counter)
+        i = counter - self._first - 1
+        offset = self._offsets[i]
+        if offset >= 0:
+            command = self.source[offset:offset + self._lengths[i]]
+            if not isinstance(command, str):
+                command = command.decode("utf-8")
+        else:
+            command = self._commands[i]
+        entry = {"command": command}
+        if self._status[i] == _NO_STATUS:
+            return entry
+        entry["status"] = self._statuses[self._status[i]]
+        entry["duration"] = self._durations[i]
+        entry["rowcount"] = self._rowcounts[i]
+        entry["bytes"] = self._bytes[i]
+        batched = self._batched[i]
+        if batched > 1:
+            entry["batched"] = batched
+        if self._retries[i] > 0:
+            entry["retries"] = self._retries[i]
+            entry["lock_wait"] = self._waits[i]
+        if self.rtt is not None:
+            # postgresql does not report the duration of a query, a round trip shared by a batch is shared between
+            # its queries
+            entry["server_duration"] = max(0.0, self._durations[i] - self.rtt / batched)
+        return entry
+
+    def __iter__(self):
+        return iter(range(self._first + 1, self.counter + 1))
+
+    def __len__(self):
+        return self.counter - self._first
+
+    def __repr__(self):
+        return "Transcript({n} queries)".format(n=self.counter)
+
+    def _emit(self, counter):
+        self.sink(counter, self[counter])
+        self._emitted = counter
+        if not self.hold:
+            self.release(counter)
+
+    def _clear(self):
+        # offset of each command in the source, -1 when it is kept in _commands
+        self._offsets = array.array("q")
+        self._lengths = array.array("q")
+        # index of the status of each query in _statuses, _NO_STATUS until it completes
+        self._status = array.array("l")
+        self._durations = array.array("d")
+        self._rowcounts = array.array("q")
+        self._bytes = array.array("q")
+        self._batched = array.array("l")
+        self._retries = array.array("l")
+        self._waits = array.array("d")
+        # index of an entry -> command, for the commands not found in the source
+        self._commands = {}
+        # offset of each query in the script, given to the hooks, empty without hooks
+        self._positions = array.array("q")
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018:
+#     Sonia Bogos, sonia.bogos@elca.ch
+#
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import os
+import sys
+import json
+import logging
+import argparse
+import collections
+
+from postgresql_lib import fleet
+
+# logging
+logging.basicConfig(
+    format='%(asctime)s %'
+           '(name)s %(levelname)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'
+)
+
+version = "1.0"
+prog_name = sys.argv[0]
+usage = """{pn} [options] [-- pytest arguments]
+
+Run the container tests against all the containers of the config file concurrently
+""".format(
+    pn=prog_name
+)
+parser = argparse.ArgumentParser(prog="{pn} {v}".format(pn=prog_name, v=version), usage=usage)
+
+parser.add_argument(
+    '--config-file',
+    dest="config_file",
+    help='Path of the json container configuration, listing the containers under "containers": '
+         'Ex : tests_config/dev.json',
+    required=True
+)
+
+parser.add_argument(
+    '--psql-config-file',
+    dest="psql_config_file",
+    help='Path of the json psql credentials: Ex : tests_config/psql.json',
+    required=True
+)
+
+parser.add_argument(
+    '--container',
+    dest="containers",
+    help='Container to test, can be repeated, defaults to all the containers of the config file',
+    action="append",
+    required=False
+)
+
+parser.add_argument(
+    '--tests',
+    dest="tests",
+    help='Test file run against each container, can be repeated, defaults to {tests}'.format(
+        tests=" ".join(fleet.DEFAULT_TESTS)),
+    action="append",
+    required=False
+)
+
+parser.add_argument(
+    '--jobs',
+    dest="jobs",
+    help='Maximum number of containers tested at the same time, defaults to all of them',
+    type=int,
+    required=False
+)
+
+parser.add_argument(
+    '--output-dir',
+    dest="output_dir",
+    default="container_tests",
+    help='Directory receiving the junit report and the output of each container, defaults to container_tests',
+    required=False
+)
+
+parser.add_argument(
+    '--junitxml',
+    dest="junitxml",
+    help='Path of the junit report merging the reports of all the containers, defaults to report.xml in the output '
+         'directory',
+    required=False
+)
+
+parser.add_argument(
+    '--debug',
+    dest="debug",
+    default=False,
+    action="store_true",
+    help='Enable debug'
+)
+
+
+if __name__ == "__main__":
+
+    argv = sys.argv[1:]
+    pytest_args = []
+    if "--" in argv:
+        pytest_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    args = parser.parse_args(argv)
+
+    logger = logging.getLogger("postgres_tools.run_container_tests")
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+        logging.getLogger("postgres_tools.postgresql_lib").setLevel(logging.DEBUG)
+    else:
+        logger.setLevel(logging.INFO)
+        logging.getLogger("postgres_tools.postgresql_lib").setLevel(logging.INFO)
+
+    try:
+        with open(args.config_file) as json_data:
+            config = json.load(json_data)
+    except IOError as e:
+        logger.debug(e)
+        raise IOError("Config file {path} not found".format(path=args.config_file))
+
+    containers = args.containers or fleet.containers(config)
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    junitxml = args.junitxml or os.path.join(args.output_dir, "report.xml")
+
+    logger.info("Testing {n} containers: {names}".format(n=len(containers), names=", ".join(containers)))
+    runner = fleet.ContainerTestRunner(args.config_file, args.psql_config_file, args.tests, args.jobs,
+                                       args.output_dir, pytest_args)
+    res = runner.run(containers)
+
+    totals = fleet.merge_reports(collections.OrderedDict((name, res[name]["report"]) for name in res), junitxml)
+    for name in res:
+        logger.info("{name}: {status}, output in {log}".format(
+            name=name, status="passed" if res[name]["exit_code"] == 0 else "failed", log=res[name]["log"]))
+    logger.info("{tests} tests, {failures} failures, {errors} errors, {skipped} skipped, report in {path}".format(
+        path=junitxml, **totals))
+
+    if any(res[name]["exit_code"] != 0 for name in res):
+        sys.exit(1)
+    sys.exit(0)
@@ -16,12 +16,12 @@
 import re
 import pytest
 import logging
-import time
 import psycopg2
 
 import dateutil.parser
 
-from sh import docker
+from postgresql_lib import journal
+from postgresql_lib import readiness
 
 # logging
 logging.basicConfig(
@@ -33,66 +33,42 @@ logger = logging.getLogger("postgres_tools.tests.test_postgres_container")
 logger.setLevel(logging.DEBUG)
 
 
-@pytest.mark.usefixtures('psql_settings', 'settings', scope='class')
+@pytest.mark.usefixtures('psql_settings', 'settings', 'docker_client', 'health', scope='class')
 class TestContainerPostgresql():
     """
         Class to test the posgresql container.
     """
 
-    def test_systemd_running_postgresql(self, settings):
+    def test_systemd_running_postgresql(self, settings, health):
         """
         Test to check if systemd is running postgresql.
         :param settings: settings of the container, e.g. container name, service name, etc.
+        :param health: state of the systemd units of the container
         :return:
         """
 
-        container_name = settings['container_name']
-
-        command_postgresql = (
-        "busctl", "get-property", "org.freedesktop.systemd1", "/org/freedesktop/systemd1/unit/postgresql_2eservice",
-        "org.freedesktop.systemd1.Unit", "ActiveState")
-        active_status = '"active"'
-
-        # docker exec -it busctl get-property
-        check_service = docker.bake("exec", "-i", container_name, command_postgresql)
-        logger.debug(check_service)
-
-        # check the return value
-        postgresql_status = check_service().stdout.decode("utf-8")
-        logger.debug(postgresql_status)
+        service_name = settings['service_name']
+        logger.debug(health[service_name])
 
-        status = re.search(active_status, postgresql_status)
-        assert status is not None
+        assert health[service_name]['ActiveState'] == 'active'
 
-    def test_systemd_running_monit(self, settings):
+    def test_systemd_running_monit(self, settings, health):
         """
         Test to check if systemd is running monit.
         :param settings: settings of the container, e.g. container name, service name, etc.
+        :param health: state of the systemd units of the container
         :return:
         """
 
-        container_name = settings['container_name']
-
-        command_monit = (
-        "busctl", "get-property", "org.freedesktop.systemd1", "/org/freedesktop/systemd1/unit/monit_2eservice",
-        "org.freedesktop.systemd1.Unit", "ActiveState")
-        active_status = '"active"'
-
-        # docker exec -it busctl get-property
-        check_service = docker.bake("exec", "-i", container_name, command_monit)
-        logger.debug(check_service)
-
-        # check the return value
-        monit_status = check_service().stdout.decode("utf-8")
-        logger.debug(monit_status)
+        logger.debug(health['monit'])
 
-        status = re.search(active_status, monit_status)
-        assert status is not None
+        assert health['monit']['ActiveState'] == 'active'
 
-    def test_container_running(self, settings):
+    def test_container_running(self, settings, docker_client):
         """
         Test to check if the container is running.
         :param settings: settings of the container, e.g. container name, service name, etc.
+        :param docker_client: client of the docker daemon
         :return:
         """
 
@@ -100,16 +76,17 @@ class TestContainerPostgresql():
         container_name = settings['container_name']
 
         # docker inspect --format='{{.State.Status}} container
-        check_status = docker.bake("inspect", "--format='{{.State.Status}}'", container_name)
-        logger.debug(check_status)
+        container_status = docker_client.inspect(container_name)['State']['Status']
+        logger.debug(container_status)
 
-        status = re.search(running_status, check_status().stdout.decode("utf-8"))
+        status = re.search(running_status, container_status)
         assert status is not None
 
-    def test_monit_restarts_stopped_postgresl(self, settings):
+    def test_monit_restarts_stopped_postgresl(self, settings, docker_client):
         """
         Test to check if monit restarts a stopped postgresql.
         :param settings: settings of the container, e.g. container name, service name, etc.
+        :param docker_client: client of the docker daemon
         :return:
         """
 
@@ -117,37 +94,24 @@ class TestContainerPostgresql():
         service_name = settings['service_name']
         max_timeout = settings['psql_timeout']
 
+        previous_state = readiness.unit_state(container_name, service_name, docker_client)
+
         # stop postgresql
-        stop_service = docker.bake("exec", "-i", container_name, "systemctl", "stop", service_name)
+        stop_service = ("systemctl", "stop", service_name)
         logger.debug(stop_service)
 
-        stop_service()
-
-        tic_tac = 0
-        psql_is_up = False
-
-        while (tic_tac < max_timeout) and (not psql_is_up):
-            # check if monit started postgresql
-            time.sleep(1)
-
-            check_service = docker.bake("exec", "-i", container_name, "systemctl", "status", service_name)
-            logger.info("Check to see if {service} started after {time} seconds".format(service=service_name, time=tic_tac))
-            logger.debug(check_service)
+        assert docker_client.execute(container_name, stop_service).exit_code == 0
 
-            try:
-                postgresql_status = check_service().exit_code
-                if postgresql_status == 0:
-                    psql_is_up = True
-                    logger.info("{service} is running".format(service=service_name))
-
-            except Exception as e:
-                tic_tac = tic_tac + 1
+        # check if monit started postgresql
+        psql_is_up = readiness.wait_for_unit(container_name, service_name, max_timeout, previous_state,
+                                             docker=docker_client)
         assert psql_is_up == True
 
-    def test_monit_restarts_killed_postgresl(self, settings):
+    def test_monit_restarts_killed_postgresl(self, settings, docker_client):
         """
         Test to check if monit restarts a killed postgresql.
         :param settings: settings of the container, e.g. container name, service name, etc.
+        :param docker_client: client of the docker daemon
         :return:
         """
 
@@ -155,65 +119,51 @@ class TestContainerPostgresql():
         service_name = settings['service_name']
         max_timeout = settings['psql_timeout']
 
+        previous_state = readiness.unit_state(container_name, service_name, docker_client)
+
         # kill postgresql
-        stop_service = docker.bake("exec", "-i", container_name, "systemctl", "kill", service_name)
+        stop_service = ("systemctl", "kill", service_name)
         logger.debug(stop_service)
 
-        stop_service()
-
-        tic_tac = 0
-        psql_is_up = False
-
-        while (tic_tac < max_timeout) and (not psql_is_up):
-            # check if monit started postgresql
-            time.sleep(1)
-
-            check_service = docker.bake("exec", "-i", container_name, "systemctl", "status", service_name)
-            logger.info("Check to see if {service} started after {time} seconds".format(service=service_name, time=tic_tac))
-            logger.debug(check_service)
+        assert docker_client.execute(container_name, stop_service).exit_code == 0
 
-            try:
-                postgresql_status = check_service().exit_code
-                if postgresql_status == 0:
-                    psql_is_up = True
-                    logger.info("{service} is running".format(service=service_name))
-
-            except Exception as e:
-                tic_tac = tic_tac + 1
+        # check if monit started postgresql
+        psql_is_up = readiness.wait_for_unit(container_name, service_name, max_timeout, previous_state,
+                                             docker=docker_client)
         assert psql_is_up == True
 
-    def test_no_error_monit_log(self, settings):
+    def test_no_error_monit_log(self, settings, docker_client):
         """
         Test to check that, when running the container, systemd starts postgresql and there is no error in the monit logs.
         :param settings: settings of the container, e.g. container name, service name, etc.
+        :param docker_client: client of the docker daemon
         :return:
         """
 
         container_name = settings['container_name']
-        # message in syslog when there are no errors
-        no_error_status = "No entries"
+        max_timeout = settings.get('monit_log_timeout', 3)
 
         # docker inspect --format='{{.State.Status}} container
-        check_status = docker.bake("inspect", "--format='{{.State.StartedAt}}'", container_name)
-        logger.debug(check_status)
-        last_started_date = dateutil.parser.parse(check_status().stdout.rstrip()).replace(tzinfo=None)
-
-        time.sleep(3)
-
-        # check in journalctl if there are any errors since the container last started
-        get_monit_log = docker.bake("exec", container_name, "journalctl", "-u", "monit", "--since", last_started_date,
-                                    "-p", "err", "-b")
-        logger.debug(get_monit_log)
-
-        monit_log = get_monit_log().stdout.decode("utf-8")
-        logger.debug(monit_log)
-
-        assert re.search(no_error_status, monit_log) is not None
-
-    def test_systemd_restarts_monit(self, settings):
+        started_at = docker_client.inspect(container_name)['State']['StartedAt']
+        logger.debug(started_at)
+        last_started_date = dateutil.parser.parse(started_at).replace(tzinfo=None)
+
+        # follow the errors since the container last started while monit checks the services, the first one stops
+        # the waiting
+        reader = journal.JournalReader(["monit"])
+        errors = reader.follow(container_name, max_timeout, since=last_started_date.strftime("%Y-%m-%d %H:%M:%S"),
+                               docker=docker_client)
+        for entry in errors:
+            logger.debug("{unit}: {category}: {message}".format(unit=entry.unit, category=entry.category,
+                                                                message=entry.message))
+
+        assert errors == []
+
+    def test_systemd_restarts_monit(self, settings, docker_client):
         """
         Test to check that if monit is down then systemd will restart it.
         :param settings: settings of the container, e.g. container name, service name, etc.
+        :param docker_client: client of the docker daemon
         :return:
         """
 
@@ -221,91 +171,66 @@ class TestContainerPostgresql():
         service_name = "monit"
         max_timeout = settings['monit_timeout']
 
+        previous_state = readiness.unit_state(container_name, service_name, docker_client)
+
         # kill monit
-        stop_service = docker.bake("exec", "-i", container_name, "systemctl", "kill", service_name)
+        stop_service = ("systemctl", "kill", service_name)
         logger.debug(stop_service)
 
-        stop_service()
-
-        tic_tac = 0
-        monit_is_up = False
-
-        while (tic_tac < max_timeout) and (monit_is_up == False):
-            # check if systemd starts monit
-            time.sleep(1)
-
-            check_service = docker.bake("exec", "-i", container_name, "systemctl", "status", service_name)
-            logger.info("Check to see if {service} started after {time} seconds".format(service=service_name, time=tic_tac))
-            logger.debug(check_service)
+        assert docker_client.execute(container_name, stop_service).exit_code == 0
 
-            try:
-                monit_status = check_service().exit_code
-                if monit_status == 0:
-                    monit_is_up = True
-                    logger.info("{service} is running".format(service=service_name))
-
-            except Exception as e:
-                tic_tac = tic_tac + 1
+        # check if systemd starts monit
+        monit_is_up = readiness.wait_for_unit(container_name, service_name, max_timeout, previous_state,
+                                              docker=docker_client)
 
         assert monit_is_up == True
 
-    def test_container_exposed_ports(self, settings):
+    def test_container_exposed_ports(self, settings, docker_client):
         """
         Test to check if the correct ports are exposed.
         :param settings: settings of the container, e.g. container name, service name, etc.
+        :param docker_client: client of the docker daemon
         :return:
         """
 
         container_name = settings['container_name']
         ports = settings['ports']
 
-        check_ports = docker.bake("inspect", "--format='{{.Config.ExposedPorts}}'", container_name)
-        logger.debug(check_ports)
-
-        exposed_ports = check_ports().stdout.decode("utf-8")
+        exposed_ports = " ".join(docker_client.inspect(container_name)['Config']['ExposedPorts'])
         logger.debug(exposed_ports)
 
         for port in ports:
             assert re.search(port, exposed_ports) is not None
 
-    def test_monit_always_restarts(self, settings):
+    def test_monit_always_restarts(self, settings, health):
         """
         Test to check if monit is configured to always restart.
         :param settings: settings of the container, e.g. container name, service name, etc.
+        :param health: state of the systemd units of the container
         :return:
         """
-        container_name = settings['container_name']
-
-        command_monit = (
-            "busctl", "get-property", "org.freedesktop.systemd1", "/org/freedesktop/systemd1/unit/monit_2eservice",
-            "org.freedesktop.systemd1.Service", "Restart")
-        restart_status = '"always"'
-
-        # docker exec -it busctl get-property
-        check_monit_restart = docker.bake("exec", "-i", container_name, command_monit)
-        logger.debug(check_monit_restart)
 
-        # check the return value
-        monit_restart = check_monit_restart().stdout.decode("utf-8")
-        logger.debug(monit_restart)
+        logger.debug(health['monit'])
 
-        status = re.search(restart_status, monit_restart)
-        assert status is not None
+        assert health['monit']['Restart'] == 'always'
 
-    def test_data_consistency(self, settings, psql_settings):
+    def test_data_consistency(self, settings, psql_settings, docker_client):
         """
         Test to check that the modifications done in Postgresql are present after the container was stopped.
         :param settings: settings of the container, e.g. container name, service name, etc.
+        :param docker_client: client of the docker daemon
         :return:
         """
 
         container_name = settings['container_name']
         service_name = settings['service_name']
+        max_timeout = settings['psql_timeout']
 
         try:
             logger.info("connecting to postgres with user {user}".format(user=psql_settings['user']))
             with psycopg2.connect(host=psql_settings['host'], user=psql_settings['user'],
-                               password=psql_settings['password']) as con:
+                               password=psql_settings['password'],
+                               port=psql_settings.get('port', 5432)) as con:
                 with con.cursor() as cur:
 
                     # create an user
@@ -325,33 +250,22 @@ class TestContainerPostgresql():
                 con.close()
                 logger.info("closed connection to postgresql")
 
-        stop_container = docker.bake("stop", container_name)
-        logger.debug(stop_container)
-        stop_container()
-
-        restart_container = docker.bake("restart", container_name)
-        logger.debug(restart_container)
-        restart_container()
+        logger.debug("docker stop {container}".format(container=container_name))
+        docker_client.stop(container_name)
 
-        psql_is_up = False
+        logger.debug("docker restart {container}".format(container=container_name))
+        docker_client.restart(container_name)
 
-        while not psql_is_up:
-            time.sleep(1)
-            check_service = docker.bake("exec", "-i", container_name, "systemctl", "status", service_name)
-            logger.debug(check_service)
-
-            try:
-                postgresql_status = check_service().exit_code
-                if postgresql_status == 0:
-                    psql_is_up = True
-                    logger.info("{service} is running".format(service=service_name))
-            except Exception as e:
-                pass
+        # wait for postgresql to accept connections, systemd reports it active before
+        psql_is_up = readiness.wait_for_unit(container_name, service_name, max_timeout, docker=docker_client) and \
+            readiness.wait_for_postgresql(psql_settings['host'], psql_settings.get('port', 5432), max_timeout)
+        assert psql_is_up == True
 
         try:
             logger.info("connecting again to postgres with user {user}".format(user=psql_settings['user']))
             with psycopg2.connect(host=psql_settings['host'], user=psql_settings['user'],
-                                  password=psql_settings['password']) as con:
+                                  password=psql_settings['password'],
+                                  port=psql_settings.get('port', 5432)) as con:
                 with con.cursor() as cur:
 
                     # check if the user created exists
@@ -49,7 +49,8 @@ class TestServicePostgresql():
             logger.info("connecting to postgres with user {user}".format(user=psql_settings['user']))
 
             with psycopg2.connect(host=psql_settings['host'], user=psql_settings['user'],
-                               password=psql_settings['password']) as con:
+                               password=psql_settings['password'],
+                               port=psql_settings.get('port', 5432)) as con:
                 with con.cursor() as cur:
 
                     # check if we can create a user